@@ -1,25 +1,31 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from django.utils import timezone
-from webapp.models import Vendor, Performance
+from webapp.scheduling import process_owner, release_lease, tick, tick_interval
 
 # Update Performance Table every Sunday at 12:00 AM
 # Ensure Performance Table is updated with latest data from the Vendor Table
 # for Historical Performance Tracking
+#
+# The scheduler only ticks; webapp.scheduling decides which process runs
+# the due jobs, so it may be started in any number of processes.
 
 
-def update_performance():
-    for vendor in Vendor.objects.all():
-        Performance.objects.create(
-            vendor=vendor,
-            date=timezone.now(),
-            on_time_delivery_rate=vendor.on_time_delivery_rate,
-            quality_rating_avg=vendor.quality_rating_avg,
-            average_response_time=vendor.average_response_time,
-            fulfillment_rate=vendor.fulfillment_rate,
-        )
+def build_scheduler(scheduler_class=BackgroundScheduler, owner=None):
+    owner = owner or process_owner()
+    scheduler = scheduler_class()
+    scheduler.add_job(tick, 'interval', seconds=tick_interval(), kwargs={'owner': owner},
+                      max_instances=1, coalesce=True, next_run_time=timezone.now())
+    return scheduler
 
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(update_performance, 'cron',
-                  day_of_week='sun', hour=0, minute=0)
-scheduler.start()
+def start():
+    """
+    Start the background scheduler of this process"""
+    scheduler = build_scheduler()
+    scheduler.start()
+    return scheduler
+
+
+def stop(scheduler, owner=None):
+    scheduler.shutdown()
+    release_lease(owner or process_owner())
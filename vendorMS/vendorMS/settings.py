@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # request counts and latency per route for /metrics
+    'webapp.monitoring.RequestMetricsMiddleware',
+    # serves /api/async/ under ASGI without the thread switches of the
+    # middleware below, see webapp/async_api.py
+    'webapp.async_api.AsyncAPIMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +58,26 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per request timings, query counts and sampled cProfile captures, see
+# webapp/profiling.py. Statistics are served at /api/stats/requests/.
+PROFILING_ENABLED = os.environ.get('VENDORMS_PROFILING', '') == '1'
+# fraction of the profiled requests which also run under cProfile
+PROFILING_SAMPLE_RATE = float(os.environ.get('VENDORMS_PROFILING_SAMPLE_RATE', 0))
+# directory for the .prof files of sampled requests, logged when unset
+PROFILING_DIR = os.environ.get('VENDORMS_PROFILING_DIR')
+
+if PROFILING_ENABLED:
+    # outermost, so that the time of the other middleware is included
+    MIDDLEWARE.insert(0, 'webapp.profiling.ProfilingMiddleware')
+
+# Bearer token required by the Prometheus /metrics endpoint. Without it only
+# clients connecting from PROMETHEUS_ALLOWED_IPS (comma separated, e.g. a
+# scraper on the internal network) are served, and by default none are.
+PROMETHEUS_BEARER_TOKEN = os.environ.get('VENDORMS_PROMETHEUS_TOKEN')
+PROMETHEUS_ALLOWED_IPS = [address.strip() for address in
+                          os.environ.get('VENDORMS_PROMETHEUS_ALLOWED_IPS', '').split(',')
+                          if address.strip()]
+
 ROOT_URLCONF = 'vendorMS.urls'
 
 TEMPLATES = [
@@ -76,13 +102,85 @@ WSGI_APPLICATION = 'vendorMS.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# SQLite profiles, selected with VENDORMS_DB_PROFILE. 'production' enables
+# WAL, persistent connections and a busy timeout so that concurrent writers
+# wait for the lock instead of failing with "database is locked".
+SQLITE_PROFILES = {
+    'default': {
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {},
+        'PRAGMAS': {},
+    },
+    'production': {
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        # seconds to wait for a lock; BEGIN IMMEDIATE takes the write lock
+        # up front so a read transaction never has to be upgraded
+        'OPTIONS': {'timeout': 20, 'transaction_mode': 'IMMEDIATE'},
+        'PRAGMAS': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 20000,
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,
+        },
+    },
+}
+
+DB_PROFILE = os.environ.get('VENDORMS_DB_PROFILE', 'default')
+_db_profile = dict(SQLITE_PROFILES[DB_PROFILE])
+
+# applied on every new connection by webapp.signals.apply_sqlite_pragmas
+SQLITE_PRAGMAS = _db_profile.pop('PRAGMAS')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('VENDORMS_DB_NAME', BASE_DIR / 'db.sqlite3'),
+        **_db_profile,
+    }
+}
+
+# Read replicas, see webapp/replicas.py. VENDORMS_DB_REPLICAS is a comma
+# separated list of SQLite files, each added as a 'replica_<n>' alias with
+# the profile of the primary and refreshed with `manage.py sync_replicas`.
+# GET requests read from a replica, except for REPLICA_STICKY_SECONDS after
+# the same client wrote. Test runs mirror the replicas to the test database.
+DATABASE_REPLICAS = []
+for _index, _name in enumerate(filter(None, os.environ.get('VENDORMS_DB_REPLICAS', '').split(','))):
+    DATABASES[f'replica_{_index}'] = {**DATABASES['default'], 'NAME': _name,
+                                      'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica_{_index}')
+
+DATABASE_ROUTERS = ['webapp.replicas.ReplicaRouter']
+REPLICA_STICKY_SECONDS = float(os.environ.get('VENDORMS_REPLICA_STICKY_SECONDS', 5))
+# cache alias of the read-your-writes marks, shared by the processes when
+# VENDORMS_CACHE_BACKEND is
+REPLICA_STICKY_CACHE = 'default'
+
+if DATABASE_REPLICAS:
+    # after the request metrics, before anything reading the database
+    MIDDLEWARE.insert(MIDDLEWARE.index('webapp.monitoring.RequestMetricsMiddleware') + 1,
+                      'webapp.replicas.ReplicaRoutingMiddleware')
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Local memory by default, set VENDORMS_CACHE_BACKEND/VENDORMS_CACHE_LOCATION
+# to share the cache between processes (e.g. memcached or redis)
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('VENDORMS_CACHE_BACKEND',
+                                  'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('VENDORMS_CACHE_LOCATION', 'vendorms'),
     }
 }
 
+# Cache alias and timeout (seconds) of the vendor performance metrics cache
+VENDOR_METRICS_CACHE = 'default'
+VENDOR_METRICS_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -128,6 +226,106 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # for token based authentication
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'webapp.authentication.CachedTokenAuthentication',
     ],
+    # list endpoints are cursor paginated on the primary key
+    'DEFAULT_PAGINATION_CLASS': 'webapp.pagination.PrimaryKeyCursorPagination',
+    'PAGE_SIZE': 100,
+}
+
+# In-process token cache of CachedTokenAuthentication: max entries, TTL in
+# seconds and an optional Django cache alias shared between processes
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_CACHE_TTL = 60
+AUTH_TOKEN_CACHE_ALIAS = None
+
+# Purchase orders written per bulk_create/bulk_update batch in bulk endpoints
+BULK_WRITE_CHUNK_SIZE = 1000
+
+# Budgets checked by `manage.py benchmark`: the most queries one call of an
+# operation may run and its 95th percentile latency in milliseconds
+BENCHMARK_BUDGETS = {
+    # the writes include the ranking refresh after commit: BEGIN, one read
+    # and COMMIT, plus a range UPDATE and an own row UPDATE per changed metric.
+    # A create also checks that its po_number is not archived.
+    'po_create': {'queries': 11, 'p95_ms': 100},
+    'po_complete': {'queries': 13, 'p95_ms': 100},
+    'po_acknowledge': {'queries': 9, 'p95_ms': 100},
+    'po_list': {'queries': 1, 'p95_ms': 100},
+    'po_detail': {'queries': 1, 'p95_ms': 50},
+    'po_items': {'queries': 1, 'p95_ms': 50},
+    'vendor_list': {'queries': 1, 'p95_ms': 100},
+    'vendor_performance': {'queries': 1, 'p95_ms': 50},
+    'vendor_ranking': {'queries': 3, 'p95_ms': 50},
+    'vendor_rank': {'queries': 3, 'p95_ms': 50},
+    'vendor_scorecards': {'queries': 4, 'p95_ms': 100},
+    # grows with the number of vendors, SQLite splits each batch insert
+    # into several queries; 56 for the 5000 vendors of the 1m dataset
+    'update_performance': {'queries': 60, 'p95_ms': 5000},
+}
+
+# Rows fetched per query chunk and written per response chunk by exports
+EXPORT_CHUNK_SIZE = 2000
+
+# Purchase order archive, see webapp/archive.py. Completed and canceled
+# purchase orders ordered more than ARCHIVE_AFTER_DAYS ago are archived
+# weekly by the scheduler, ARCHIVE_BATCH_SIZE per transaction. Unset, the
+# archive only runs through `manage.py archive_purchase_orders`.
+ARCHIVE_AFTER_DAYS = (int(os.environ['VENDORMS_ARCHIVE_AFTER_DAYS'])
+                      if os.environ.get('VENDORMS_ARCHIVE_AFTER_DAYS') else None)
+ARCHIVE_BATCH_SIZE = 1000
+
+# Scheduled jobs, see webapp/scheduling.py. With SCHEDULER_AUTOSTART every
+# WSGI worker starts a scheduler; the one holding the database lease runs
+# the jobs. Set VENDORMS_SCHEDULER_AUTOSTART=0 when running
+# `manage.py run_scheduler` as a dedicated process instead.
+SCHEDULER_AUTOSTART = os.environ.get('VENDORMS_SCHEDULER_AUTOSTART', '1') == '1'
+# seconds between ticks, and for which a tick holds the lease
+SCHEDULER_TICK_SECONDS = 10
+SCHEDULER_LEASE_SECONDS = 60
+# seconds after which a run still marked running is taken over
+SCHEDULER_JOB_TIMEOUT = 3600
+# starts of a window before a failing run is given up
+SCHEDULER_MAX_ATTEMPTS = 3
+
+# Vendor rankings refreshed one by one after a metric change; larger sets of
+# changed vendors rebuild every ranking, see webapp/ranking.py
+RANKING_REBUILD_THRESHOLD = 200
+
+# Vendors read and Performance rows written per batch by the weekly snapshot
+PERFORMANCE_SNAPSHOT_BATCH_SIZE = 1000
+
+# Worker processes of the weekly snapshot and of `recompute_metrics
+# --workers`, vendors per shard and retries of a failed shard, see
+# webapp/sharding.py. One worker runs the shards in the calling process.
+PARALLEL_WORKERS = int(os.environ.get('VENDORMS_PARALLEL_WORKERS', 1))
+PARALLEL_SHARD_SIZE = 1000
+PARALLEL_SHARD_RETRIES = 2
+
+# 'sync' updates vendor metrics inside the purchase order write. 'async' only
+# queues the vendor in the MetricsOutbox table for the metrics worker, which
+# recomputes each queued vendor once per batch. Writes fall back to updating
+# the metrics themselves while the oldest queued event is older than
+# METRICS_MAX_STALENESS seconds (e.g. when the worker is not running). Each
+# process checks the age of the queue at most every METRICS_LAG_CHECK_INTERVAL
+# seconds.
+METRICS_MODE = os.environ.get('VENDORMS_METRICS_MODE', 'sync')
+METRICS_MAX_STALENESS = float(os.environ.get('VENDORMS_METRICS_MAX_STALENESS', 5))
+METRICS_LAG_CHECK_INTERVAL = 1.0
+METRICS_WORKER_BATCH_SIZE = 500
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'webapp': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
 }
@@ -16,8 +16,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from webapp.views.stats_views import prometheus_metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('webapp.urls')),
+    path('metrics', prometheus_metrics, name='prometheus-metrics'),
 ]
@@ -8,10 +8,14 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/wsgi/
 """
 
 import os
-import vendorMS.scheduler
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vendorMS.settings')
 
 application = get_wsgi_application()
+
+if settings.SCHEDULER_AUTOSTART:
+    from vendorMS.scheduler import start
+    start()
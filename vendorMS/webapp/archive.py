@@ -0,0 +1,146 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .metrics import COUNTER_FIELDS, contribution, snapshot_of
+from .models import ArchiveCarryOver, ArchivedPurchaseOrder, PurchaseOrder
+
+logger = logging.getLogger(__name__)
+
+# Purchase order archive
+#
+# Completed and canceled purchase orders whose order_date is older than
+# ARCHIVE_AFTER_DAYS are moved in batches from PurchaseOrder into
+# ArchivedPurchaseOrder, partitioned by the month of their order_date. Open
+# purchase orders are never archived, so every purchase order the API or the
+# signals change is in PurchaseOrder.
+#
+# Archiving does not change any vendor counter: the rows are removed without
+# the delete signals, and what they added to the counters is added to the
+# vendor's ArchiveCarryOver in the same transaction. A recompute adds the
+# carry-overs to the counters it aggregates from PurchaseOrder.
+
+ARCHIVED_STATUSES = ('completed', 'canceled')
+
+
+def archive_candidates(cutoff):
+    return PurchaseOrder.objects.filter(status__in=ARCHIVED_STATUSES, order_date__lt=cutoff)
+
+
+def archived_copy(purchase_order):
+    order_date = timezone.localtime(purchase_order.order_date)
+    return ArchivedPurchaseOrder(
+        id=purchase_order.pk, po_number=purchase_order.po_number,
+        vendor_id=purchase_order.vendor_id, order_date=purchase_order.order_date,
+        delivery_date=purchase_order.delivery_date,
+        items=purchase_order.items, quantity=purchase_order.quantity,
+        status=purchase_order.status, quality_rating=purchase_order.quality_rating,
+        issue_date=purchase_order.issue_date,
+        acknowledgment_date=purchase_order.acknowledgment_date,
+        delivered_on_time=purchase_order.delivered_on_time,
+        period=order_date.date().replace(day=1))
+
+
+def carry_over(counters):
+    """
+    Add counters keyed by vendor id to the vendors' ArchiveCarryOver rows,
+    with one executemany UPDATE like metrics.write_counters"""
+    ArchiveCarryOver.objects.bulk_create(
+        [ArchiveCarryOver(vendor_id=vendor_id) for vendor_id in counters],
+        ignore_conflicts=True)
+    quote = connection.ops.quote_name
+    assignments = ', '.join(f'{quote(field)} = {quote(field)} + %s' for field in COUNTER_FIELDS)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {quote(ArchiveCarryOver._meta.db_table)} SET {assignments} '
+            f'WHERE {quote("vendor_id")} = %s',
+            [[values[field] for field in COUNTER_FIELDS] + [vendor_id]
+             for vendor_id, values in counters.items()])
+
+
+def archive_batch(cutoff, after_pk=0, batch_size=None):
+    """
+    Archive up to batch_size purchase orders with ids above after_pk in one
+    transaction. Returns the ids of the archived purchase orders."""
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    with transaction.atomic():
+        batch = list(archive_candidates(cutoff).filter(pk__gt=after_pk).defer(None)
+                     .select_for_update().order_by('pk')[:batch_size])
+        if not batch:
+            return []
+        ids = [purchase_order.pk for purchase_order in batch]
+        ArchivedPurchaseOrder.objects.bulk_create([archived_copy(po) for po in batch])
+        counters = {}
+        for purchase_order in batch:
+            # exactly what the incremental engine added to the counters
+            vendor_counters = counters.setdefault(purchase_order.vendor_id,
+                                                  dict.fromkeys(COUNTER_FIELDS, 0))
+            for field, value in contribution(snapshot_of(purchase_order)).items():
+                vendor_counters[field] += value
+        carry_over(counters)
+        delete_rows(ids)
+    return ids
+
+
+def delete_rows(ids):
+    """
+    Delete purchase orders by id with one plain DELETE. QuerySet.delete()
+    would send the delete signals, which subtract the rows from the vendor
+    counters the carry-over keeps them in; nothing else references them."""
+    quote = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {quote(PurchaseOrder._meta.db_table)} '
+                       f'WHERE {quote(PurchaseOrder._meta.pk.column)} IN ({placeholders})', ids)
+
+
+def archive_purchase_orders(older_than_days=None, batch_size=None, progress=None):
+    """
+    Archive every closed purchase order ordered more than older_than_days
+    (default ARCHIVE_AFTER_DAYS) ago, batch by batch. progress(archived) is
+    called after each batch. Returns the number of archived purchase orders."""
+    days = settings.ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = timezone.now() - timedelta(days=days)
+    started = time.monotonic()
+    archived, after_pk = 0, 0
+    while True:
+        ids = archive_batch(cutoff, after_pk, batch_size)
+        if not ids:
+            break
+        archived += len(ids)
+        after_pk = ids[-1]
+        if progress:
+            progress(archived)
+    logger.info("Archived %d purchase orders ordered before %s in %.2fs",
+                archived, cutoff.isoformat(), time.monotonic() - started)
+    return archived
+
+
+def fetch_purchase_order(po_number):
+    """
+    Read-through lookup of a purchase order by po_number: the live
+    PurchaseOrder if there is one, otherwise the archived copy. Returns
+    (purchase order, archived) or (None, False)."""
+    purchase_order = PurchaseOrder.objects.defer(None).filter(po_number=po_number).first()
+    if purchase_order is not None:
+        return purchase_order, False
+    archived = ArchivedPurchaseOrder.objects.filter(po_number=po_number).first()
+    if archived is None:
+        return None, False
+    return restored(archived), True
+
+
+def restored(archived):
+    """
+    Return an unsaved PurchaseOrder with the fields of an archived one"""
+    return PurchaseOrder(
+        id=archived.pk, po_number=archived.po_number, vendor_id=archived.vendor_id,
+        order_date=archived.order_date, delivery_date=archived.delivery_date,
+        items=archived.items, quantity=archived.quantity,
+        status=archived.status, quality_rating=archived.quality_rating,
+        issue_date=archived.issue_date, acknowledgment_date=archived.acknowledgment_date,
+        delivered_on_time=archived.delivered_on_time)
@@ -0,0 +1,61 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.security import SecurityMiddleware
+from django.urls import Resolver404, get_resolver
+
+# Async API dispatch
+#
+# Under ASGI, Django's MiddlewareMixin based middleware run each hook in a
+# worker thread, several thread switches per request. The read-only async
+# views under ASYNC_API_PREFIX authenticate with tokens and only answer GET,
+# so they need neither sessions, CSRF nor messages. AsyncAPIMiddleware sits
+# before Django's middleware in MIDDLEWARE and calls those views itself,
+# adding the security and X-Frame-Options headers inline, as both only
+# read settings. Middleware before it (request metrics, replica routing,
+# profiling) still apply. Every other request, and every request in a sync
+# handler, goes through the whole stack unchanged.
+
+ASYNC_API_PREFIX = '/api/async/'
+
+
+def _no_response(request):
+    return None
+
+
+class AsyncAPIMiddleware:
+    """
+    Serves the async views under ASYNC_API_PREFIX in the event loop, skipping
+    the MiddlewareMixin based middleware after it"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # only their hooks are called, never their get_response
+        self.security = SecurityMiddleware(_no_response)
+        self.x_frame_options = XFrameOptionsMiddleware(_no_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not request.path_info.startswith(ASYNC_API_PREFIX):
+            return await self.get_response(request)
+        try:
+            match = get_resolver(getattr(request, 'urlconf', None)).resolve(request.path_info)
+        except Resolver404:
+            return await self.get_response(request)
+        if not iscoroutinefunction(match.func):
+            return await self.get_response(request)
+        request.resolver_match = match
+
+        # the SSL redirect of SECURE_SSL_REDIRECT, if any
+        response = self.security.process_request(request)
+        if response is None:
+            response = await match.func(request, *match.args, **match.kwargs)
+        response = self.x_frame_options.process_response(request, response)
+        return self.security.process_response(request, response)
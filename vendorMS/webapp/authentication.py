@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .replicas import use_primary
+
+
+class TokenCache:
+    """
+    Thread safe LRU cache of token key -> (user_id, is_active) with a TTL.
+
+    When settings.AUTH_TOKEN_CACHE_ALIAS names a Django cache, entries are
+    also stored there so that other processes can share them. Only the ids
+    are cached, never the user with its password hash: credentials() builds
+    a fresh user for each request."""
+    KEY_PREFIX = 'auth-token'
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _shared(self):
+        alias = settings.AUTH_TOKEN_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def _local(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+        return None
+
+    def get(self, key):
+        now = time.monotonic()
+        value = self._local(key, now)
+        if value is not None:
+            return value
+        shared = self._shared()
+        value = shared.get(f'{self.KEY_PREFIX}:{key}') if shared else None
+        if value is not None:
+            self._store(key, value, now)
+        return value
+
+    async def aget(self, key):
+        now = time.monotonic()
+        value = self._local(key, now)
+        if value is not None:
+            return value
+        shared = self._shared()
+        value = await shared.aget(f'{self.KEY_PREFIX}:{key}') if shared else None
+        if value is not None:
+            self._store(key, value, now)
+        return value
+
+    def set(self, key, value):
+        self._store(key, value, time.monotonic())
+        shared = self._shared()
+        if shared:
+            shared.set(f'{self.KEY_PREFIX}:{key}', value, self.ttl)
+
+    async def aset(self, key, value):
+        self._store(key, value, time.monotonic())
+        shared = self._shared()
+        if shared:
+            await shared.aset(f'{self.KEY_PREFIX}:{key}', value, self.ttl)
+
+    def _store(self, key, value, now):
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        shared = self._shared()
+        if shared:
+            shared.delete(f'{self.KEY_PREFIX}:{key}')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_TOKEN_CACHE_TTL)
+
+
+def cache_entry(user):
+    return (user.pk, user.is_active)
+
+
+def credentials(key, entry):
+    """
+    Build (user, token) for a cached entry. The user is a new instance with
+    every field but its id and is_active deferred, the other fields are
+    loaded on first access"""
+    user_id, is_active = entry
+    if not is_active:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    User = get_user_model()
+    user = User.from_db(None, [User._meta.pk.attname, 'is_active'], (user_id, is_active))
+    token = Token.from_db(None, ['key', 'user_id'], (key, user_id))
+    token.user = user
+    return user, token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement for TokenAuthentication which remembers the user of
+    a token instead of looking up Token and User on every request.
+
+    Entries are dropped when a token is deleted or its user is saved, and
+    otherwise expire after AUTH_TOKEN_CACHE_TTL seconds. Misses are read
+    from the primary: a replica may not have a token issued moments ago."""
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is not None:
+            return credentials(key, entry)
+        with use_primary():
+            user, token = super().authenticate_credentials(key)
+        token_cache.set(key, cache_entry(user))
+        return user, token
+
+
+class TokenKeyParser(TokenAuthentication):
+    """
+    Parses the Authorization header exactly as TokenAuthentication does, but
+    returns the token key instead of looking it up"""
+
+    def authenticate_credentials(self, key):
+        return key
+
+
+async def aauthenticate(request):
+    """
+    Authenticate a plain Django async view request like
+    CachedTokenAuthentication, with the async cache and ORM APIs.
+
+    Returns (user, token), or None when no token was sent. Raises
+    AuthenticationFailed for malformed or invalid tokens."""
+    key = TokenKeyParser().authenticate(request)
+    if key is None:
+        return None
+    entry = await token_cache.aget(key)
+    if entry is None:
+        try:
+            with use_primary():
+                token = await Token.objects.select_related('user').aget(key=key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        entry = cache_entry(token.user)
+        if entry[1]:
+            await token_cache.aset(key, entry)
+    return credentials(key, entry)
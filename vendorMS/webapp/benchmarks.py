@@ -0,0 +1,244 @@
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .authentication import token_cache
+from .metrics import recompute_vendors
+from .models import Vendor, PurchaseOrder, Performance
+from .snapshots import take_performance_snapshot, week_start
+
+# Benchmarks of the API and metric hot paths on synthetic data. Every
+# operation is timed and its queries counted per iteration; results are
+# compared against per operation budgets of queries and p95 latency. The
+# peak Python memory allocated by one more iteration is traced separately,
+# as tracing slows down the timed ones.
+
+SCALES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+
+# Purchase orders per vendor in seeded datasets
+POS_PER_VENDOR = 200
+
+SEED_BATCH_SIZE = 5000
+
+ITEM_DESCRIPTIONS = ('Hex bolt M8', 'Flat washer 8 mm', 'Hydraulic hose 1/2"',
+                     'Bearing 6204-2RS', 'Steel sheet 2 mm', 'Cable tie 300 mm')
+
+
+def parse_scale(value):
+    """
+    Return the number of purchase orders for '1k', '100k', '1m' or a number"""
+    value = value.lower()
+    return SCALES[value] if value in SCALES else int(value)
+
+
+def seed_items(rng):
+    # Order lines like those of real purchase orders, 1 to 20 per order
+    return {'lines': [{'sku': f'SKU-{rng.randint(1, 5000)}',
+                       'description': rng.choice(ITEM_DESCRIPTIONS),
+                       'quantity': rng.randint(1, 50),
+                       'unit_price': round(rng.uniform(0.5, 500), 2)}
+                      for _ in range(rng.randint(1, 20))]}
+
+
+def seed(purchase_orders, rng=None):
+    """
+    Fill an empty database with vendors and purchase orders with a mix of
+    statuses, ratings and acknowledgments, then recompute vendor metrics"""
+    rng = rng or random.Random(0)
+    vendor_count = max(1, purchase_orders // POS_PER_VENDOR)
+    now = timezone.now()
+    with transaction.atomic():
+        Vendor.objects.bulk_create(
+            [Vendor(name=f'Vendor {i}', contact_details='Contact', address='Address',
+                    vendor_code=f'BENCH-{i}') for i in range(vendor_count)],
+            batch_size=SEED_BATCH_SIZE)
+        vendor_ids = list(Vendor.objects.values_list('pk', flat=True))
+        for start in range(0, purchase_orders, SEED_BATCH_SIZE):
+            batch = []
+            for i in range(start, min(purchase_orders, start + SEED_BATCH_SIZE)):
+                po_status = rng.choice(['pending', 'completed', 'canceled'])
+                issue_date = now - timedelta(days=rng.randint(1, 365))
+                batch.append(PurchaseOrder(
+                    po_number=f'BENCH-{i}', vendor_id=rng.choice(vendor_ids),
+                    order_date=issue_date, issue_date=issue_date,
+                    delivery_date=issue_date + timedelta(days=rng.randint(1, 30)),
+                    items=seed_items(rng), quantity=rng.randint(1, 100), status=po_status,
+                    quality_rating=(rng.choice([None, 1.0, 3.0, 5.0])
+                                    if po_status == 'completed' else None),
+                    delivered_on_time=rng.random() < 0.7 if po_status == 'completed' else None,
+                    acknowledgment_date=(issue_date + timedelta(hours=rng.randint(1, 100))
+                                         if rng.random() < 0.7 else None)))
+            PurchaseOrder.objects.bulk_create(batch)
+        recompute_vendors()
+
+
+class Operations:
+    """
+    The benchmarked operations. Each returns a callable doing one iteration
+    through the API client (or the job function), with untimed set up done
+    before the callable is returned."""
+
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random(0)
+        user, _ = User.objects.get_or_create(username='benchmark')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.vendor_ids = list(Vendor.objects.values_list('pk', flat=True))
+        self.last_pk = PurchaseOrder.objects.order_by('pk').values_list('pk', flat=True).last()
+        self.created = 0
+
+    def random_id(self, queryset=None):
+        # A random purchase order of queryset, found through the primary
+        # key index instead of ORDER BY RANDOM()
+        queryset = PurchaseOrder.objects.all() if queryset is None else queryset
+        start = self.rng.randint(1, self.last_pk)
+        return (queryset.filter(pk__gte=start).order_by('pk').values_list('pk', flat=True).first()
+                or queryset.order_by('pk').values_list('pk', flat=True).first())
+
+    def pending_id(self):
+        # A random unacknowledged pending purchase order
+        return self.random_id(PurchaseOrder.objects.filter(status='pending',
+                                                           acknowledgment_date__isnull=True))
+
+    def po_create(self):
+        self.created += 1
+        now = timezone.now().isoformat()
+        data = {'po_number': f'NEW-{time.time_ns()}-{self.created}',
+                'vendor': self.rng.choice(self.vendor_ids), 'order_date': now,
+                'delivery_date': now, 'issue_date': now, 'items': {'item': 1},
+                'quantity': 1, 'status': 'pending'}
+        return lambda: self.client.post(reverse('purchaseorder-list'), data, format='json')
+
+    def po_complete(self):
+        url = reverse('purchaseorder-detail', kwargs={'pk': self.pending_id()})
+        return lambda: self.client.patch(url, {'status': 'completed', 'quality_rating': 4.0},
+                                         format='json')
+
+    def po_acknowledge(self):
+        url = reverse('purchaseorder-acknowledge', kwargs={'pk': self.pending_id()})
+        return lambda: self.client.post(url)
+
+    def po_list(self):
+        return lambda: self.client.get(reverse('purchaseorder-list'))
+
+    def po_detail(self):
+        url = reverse('purchaseorder-detail', kwargs={'pk': self.random_id()})
+        return lambda: self.client.get(url)
+
+    def po_items(self):
+        url = reverse('purchaseorder-items', kwargs={'pk': self.random_id()})
+
+        def run():
+            response = self.client.get(url)
+            b''.join(response.streaming_content)
+            return response
+        return run
+
+    def vendor_list(self):
+        return lambda: self.client.get(reverse('vendor-list'))
+
+    def vendor_performance(self):
+        url = reverse('vendor-performance', kwargs={'pk': self.rng.choice(self.vendor_ids)})
+        return lambda: self.client.get(url)
+
+    def vendor_ranking(self):
+        params = {'metric': 'on_time_delivery_rate', 'min_completed_pos': 5}
+        return lambda: self.client.get(reverse('vendor-ranking'), params)
+
+    def vendor_rank(self):
+        url = reverse('vendor-rank', kwargs={'pk': self.rng.choice(self.vendor_ids)})
+        return lambda: self.client.get(url)
+
+    def vendor_scorecards(self):
+        return lambda: self.client.get(reverse('vendor-scorecards'))
+
+    def update_performance(self):
+        # The weekly job skips vendors already snapshotted this week
+        Performance.objects.filter(date__gte=week_start(timezone.now())).delete()
+        return take_performance_snapshot
+
+    NAMES = ('po_create', 'po_complete', 'po_acknowledge', 'po_list', 'po_detail',
+             'po_items', 'vendor_list',
+             'vendor_performance', 'vendor_ranking', 'vendor_rank', 'vendor_scorecards',
+             'update_performance')
+
+    # Iterations of the weekly job relative to the other operations
+    ITERATION_DIVISORS = {'update_performance': 10}
+
+
+def measure(operation, iterations):
+    """
+    Run operation() iterations times and return latency percentiles in
+    milliseconds, the largest number of queries of one iteration and the
+    peak memory allocated by one traced iteration in KiB"""
+    latencies, queries = [], 0
+    for _ in range(iterations):
+        run = operation()
+        # CaptureQueriesContext counts by the length of the bounded query
+        # log, which stops growing once it is full
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = run()
+            latencies.append((time.perf_counter() - started) * 1000)
+        status_code = getattr(response, 'status_code', 200)
+        if status_code >= 400:
+            raise RuntimeError(f"{operation.__name__} returned {status_code}")
+        queries = max(queries, len(captured))
+    run = operation()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(statistics.median(latencies), 3),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+        'max_ms': round(latencies[-1], 3),
+        'queries': queries,
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(iterations, names=None):
+    """
+    Measure every operation on the current database and return
+    {name: measurement}"""
+    cache.clear()
+    token_cache.clear()
+    operations = Operations()
+    results = {}
+    for name in names or Operations.NAMES:
+        count = max(1, iterations // Operations.ITERATION_DIVISORS.get(name, 1))
+        results[name] = measure(getattr(operations, name), count)
+    return results
+
+
+def check_budgets(results, budgets):
+    """
+    Return a list of budget violations of {name: measurement} results"""
+    violations = []
+    for name, result in results.items():
+        budget = budgets.get(name, {})
+        if 'queries' in budget and result['queries'] > budget['queries']:
+            violations.append(f"{name}: {result['queries']} queries, "
+                              f"budget {budget['queries']}")
+        if 'p95_ms' in budget and result['p95_ms'] > budget['p95_ms']:
+            violations.append(f"{name}: p95 {result['p95_ms']:.1f} ms, "
+                              f"budget {budget['p95_ms']} ms")
+    return violations
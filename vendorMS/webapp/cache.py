@@ -0,0 +1,87 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import METRIC_FIELDS, Vendor
+from .monitoring import vendor_metrics_cache_hits, vendor_metrics_cache_misses
+from .replicas import use_primary
+
+# Read-through cache of the four performance metrics of each vendor.
+# Entries are dropped by the code paths that change vendor metrics, once
+# their transaction has committed. Misses are filled from the primary: an
+# entry read from a lagging replica would be served to every client,
+# including the one which just wrote, until it expires. Hits and misses are
+# counted in the vendorms_vendor_metrics_cache_* counters served at /metrics.
+
+KEY_PREFIX = 'vendor-metrics'
+
+
+def _cache():
+    return caches[settings.VENDOR_METRICS_CACHE]
+
+
+def _key(vendor_id):
+    return f'{KEY_PREFIX}:{vendor_id}'
+
+
+def get_vendor_metrics(vendor_id):
+    """
+    Return {'metrics', 'etag'} for a vendor, or None if the vendor does not
+    exist"""
+    entry = _cache().get(_key(vendor_id))
+    if entry is not None:
+        vendor_metrics_cache_hits.inc()
+        return entry
+    vendor_metrics_cache_misses.inc()
+    with use_primary():
+        metrics = Vendor.objects.filter(pk=vendor_id).values(*METRIC_FIELDS).first()
+    if metrics is None:
+        return None
+    entry = _entry(metrics)
+    _cache().set(_key(vendor_id), entry, settings.VENDOR_METRICS_CACHE_TIMEOUT)
+    return entry
+
+
+async def aget_vendor_metrics(vendor_id):
+    """
+    Async version of get_vendor_metrics"""
+    entry = await _cache().aget(_key(vendor_id))
+    if entry is not None:
+        vendor_metrics_cache_hits.inc()
+        return entry
+    vendor_metrics_cache_misses.inc()
+    with use_primary():
+        metrics = await Vendor.objects.filter(pk=vendor_id).values(*METRIC_FIELDS).afirst()
+    if metrics is None:
+        return None
+    entry = _entry(metrics)
+    await _cache().aset(_key(vendor_id), entry, settings.VENDOR_METRICS_CACHE_TIMEOUT)
+    return entry
+
+
+def _entry(metrics):
+    # Only an ETag: the time the entry was filled is not when the metrics
+    # changed, so it cannot serve as Last-Modified
+    return {
+        'metrics': metrics,
+        'etag': hashlib.sha1(json.dumps(metrics, sort_keys=True).encode()).hexdigest(),
+    }
+
+
+def invalidate_vendor_metrics(vendor_ids):
+    """
+    Drop the cached metrics of the given vendors when the current
+    transaction commits"""
+    keys = [_key(vendor_id) for vendor_id in vendor_ids]
+    if keys:
+        transaction.on_commit(lambda: _cache().delete_many(keys))
+
+
+def cache_stats():
+    """
+    Return the hit and miss counts of this process"""
+    return {'hits': vendor_metrics_cache_hits.value(),
+            'misses': vendor_metrics_cache_misses.value()}
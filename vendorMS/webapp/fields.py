@@ -0,0 +1,82 @@
+import json
+import zlib
+
+from django import forms
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+# zlib streams start with 0x78 ('x'), which no JSON document does, so plain
+# and compressed payloads are told apart by their first byte
+ZLIB_HEADER = b'x'
+
+
+def compress_json(value):
+    """
+    Encode value as JSON, zlib compressed unless that would make it larger"""
+    data = json.dumps(value, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+    compressed = zlib.compress(data)
+    return compressed if len(compressed) < len(data) else data
+
+
+def decompress_json(data):
+    """
+    Decode a payload written by compress_json. Also accepts JSON text, as
+    stored before the payload was compressed."""
+    if isinstance(data, str):
+        return json.loads(data)
+    data = bytes(data)
+    return json.loads(zlib.decompress(data) if data[:1] == ZLIB_HEADER else data)
+
+
+def iter_json(data, chunk_size=64 * 1024):
+    """
+    Yield the JSON text of a compress_json payload in chunks of at most
+    chunk_size bytes, decompressing as it goes"""
+    if isinstance(data, str):
+        data = data.encode()
+    data = bytes(data)
+    if data[:1] != ZLIB_HEADER:
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+        return
+    decompressor = zlib.decompressobj()
+    chunk = decompressor.decompress(data, chunk_size)
+    while chunk:
+        yield chunk
+        chunk = decompressor.decompress(decompressor.unconsumed_tail, chunk_size)
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+class CompressedJSONField(models.BinaryField):
+    """
+    JSON value stored as a compress_json blob. Unlike JSONField it cannot be
+    filtered on in queries; it is meant for payloads which are only read
+    and written whole."""
+    description = "JSON stored zlib compressed"
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs.pop('editable', None)
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else decompress_json(value)
+
+    def to_python(self, value):
+        return value
+
+    def get_prep_value(self, value):
+        return None if value is None else compress_json(value)
+
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj), cls=DjangoJSONEncoder)
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{'form_class': forms.JSONField,
+                                    'encoder': DjangoJSONEncoder, **kwargs})
@@ -0,0 +1,99 @@
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.exceptions import ValidationError
+
+from .models import METRIC_FIELDS, PurchaseOrder
+
+
+class PurchaseOrderFilterSerializer(serializers.Serializer):
+    """
+    Serializer for the purchase order list query parameters"""
+    vendor = serializers.IntegerField(required=False)
+    status = serializers.ChoiceField(
+        choices=PurchaseOrder._meta.get_field('status').choices, required=False)
+    acknowledged = serializers.BooleanField(required=False, allow_null=True, default=None)
+    order_date_after = serializers.DateTimeField(required=False)
+    order_date_before = serializers.DateTimeField(required=False)
+    issue_date_after = serializers.DateTimeField(required=False)
+    issue_date_before = serializers.DateTimeField(required=False)
+    delivery_date_after = serializers.DateTimeField(required=False)
+    delivery_date_before = serializers.DateTimeField(required=False)
+
+
+class PurchaseOrderFilterBackend(BaseFilterBackend):
+    """
+    Filters purchase orders by vendor, status, acknowledged=true|false and
+    <date>_after / <date>_before ranges (inclusive / exclusive) on
+    order_date, issue_date and delivery_date"""
+
+    def filter_queryset(self, request, queryset, view):
+        return queryset.filter(**purchase_order_filters(request.query_params))
+
+
+def purchase_order_filters(query_params):
+    """
+    Translate purchase order list query parameters into queryset filter
+    keyword arguments. Raises ValidationError for invalid parameters."""
+    params = PurchaseOrderFilterSerializer(data=query_params.dict())
+    if not params.is_valid():
+        raise ValidationError(params.errors)
+    filters = {}
+    for name, value in params.validated_data.items():
+        if value is None:
+            continue
+        if name == 'acknowledged':
+            filters['acknowledgment_date__isnull'] = not value
+        elif name.endswith('_after'):
+            filters[name[:-len('_after')] + '__gte'] = value
+        elif name.endswith('_before'):
+            filters[name[:-len('_before')] + '__lt'] = value
+        else:
+            filters[name] = value
+    return filters
+
+
+class PerformanceHistoryFilterSerializer(serializers.Serializer):
+    """
+    Serializer for the vendor performance history query parameters.
+
+    'from' (inclusive) and 'to' (exclusive) limit the date range and bucket
+    aggregates the rows per month, quarter or year."""
+    to = serializers.DateTimeField(required=False)
+    bucket = serializers.ChoiceField(choices=['month', 'quarter', 'year'], required=False)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # 'from' is a keyword so it cannot be declared as a class attribute
+        fields['from'] = serializers.DateTimeField(required=False)
+        return fields
+
+
+class PerformanceExportFilterSerializer(PerformanceHistoryFilterSerializer):
+    """
+    Serializer for the performance export query parameters: vendor and the
+    'from' / 'to' date range"""
+    vendor = serializers.IntegerField(required=False)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fields.pop('bucket')
+        return fields
+
+
+class PurchaseOrderExportFilterSerializer(serializers.Serializer):
+    """
+    Serializer for the purchase order export query parameters besides the
+    list filters: include_archived=1 adds the archived purchase orders"""
+    include_archived = serializers.BooleanField(required=False, default=False)
+
+
+class VendorRankingFilterSerializer(serializers.Serializer):
+    """
+    Serializer for the vendor ranking query parameters: the metric to rank
+    by, the number of vendors, a minimum number of completed purchase orders
+    and a min_value / max_value range (inclusive) of the metric"""
+    metric = serializers.ChoiceField(choices=METRIC_FIELDS)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=50)
+    min_completed_pos = serializers.IntegerField(min_value=0, required=False)
+    min_value = serializers.FloatField(required=False)
+    max_value = serializers.FloatField(required=False)
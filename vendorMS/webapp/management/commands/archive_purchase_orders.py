@@ -0,0 +1,41 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from webapp.archive import archive_candidates, archive_purchase_orders
+
+
+class Command(BaseCommand):
+    help = ("Move completed and canceled purchase orders older than "
+            "--older-than-days into the purchase order archive, in batches of "
+            "one transaction each. Vendor metrics are not changed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help='Minimum age of the order_date in days '
+                                 '(defaults to ARCHIVE_AFTER_DAYS).')
+        parser.add_argument('--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE,
+                            help='Purchase orders archived per transaction.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the purchase orders that would be archived.')
+
+    def handle(self, *args, **options):
+        days = options['older_than_days']
+        if days is None:
+            raise CommandError("Pass --older-than-days or set VENDORMS_ARCHIVE_AFTER_DAYS.")
+        if options['dry_run']:
+            count = archive_candidates(timezone.now() - timedelta(days=days)).count()
+            self.stdout.write(f"{count} purchase orders would be archived.")
+            return
+
+        started = time.monotonic()
+        archived = archive_purchase_orders(
+            days, options['batch_size'],
+            progress=lambda done: self.stdout.write(f"  {done} archived"))
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} purchase orders in {elapsed:.2f}s "
+            f"({archived / max(elapsed, 1e-9):.0f} POs/s)."))
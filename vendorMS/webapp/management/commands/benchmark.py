@@ -0,0 +1,93 @@
+import json
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from webapp.benchmarks import (Operations, check_budgets, parse_scale, run_benchmarks,
+                               seed)
+from webapp.models import Vendor
+
+
+class Command(BaseCommand):
+    help = ("Seed synthetic datasets and benchmark the API and metric hot "
+            "paths: latency percentiles and query counts per operation, "
+            "checked against settings.BENCHMARK_BUDGETS. Each scale runs in "
+            "its own database, never in the configured one.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='append', dest='scales',
+                            help="Purchase orders to seed: 1k, 100k, 1m or a number "
+                                 "(repeatable, defaults to 1k).")
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Iterations per operation.')
+        parser.add_argument('--operation', action='append', dest='operations',
+                            choices=Operations.NAMES,
+                            help='Operation to run (repeatable, defaults to all).')
+        parser.add_argument('--data-dir',
+                            help='Keep the seeded databases in this directory and reuse '
+                                 'them on later runs.')
+        parser.add_argument('--output', help='Write the JSON results to this file.')
+        parser.add_argument('--budgets',
+                            help='JSON file of budgets to use instead of BENCHMARK_BUDGETS.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("The benchmark databases are SQLite files.")
+        budgets = settings.BENCHMARK_BUDGETS
+        if options['budgets']:
+            with open(options['budgets']) as file:
+                budgets = json.load(file)
+
+        report = {'started': timezone.now().isoformat(),
+                  'profile': settings.DB_PROFILE, 'scales': []}
+        setup_test_environment()
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                for scale in options['scales'] or ['1k']:
+                    report['scales'].append(self.run_scale(
+                        scale, options['data_dir'] or directory, budgets, options))
+        finally:
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+        violations = [violation for result in report['scales']
+                      for violation in result['violations']]
+        if violations:
+            raise CommandError("Budgets exceeded:\n  " + "\n  ".join(violations))
+
+    def run_scale(self, scale, directory, budgets, options):
+        purchase_orders = parse_scale(scale)
+        keep = bool(options['data_dir'])
+        # The benchmark database replaces the configured one like a test
+        # database, kept between runs with --data-dir
+        connection.settings_dict['TEST']['NAME'] = os.path.join(
+            directory, f'benchmark-{purchase_orders}.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, keepdb=keep, serialize=False)
+        try:
+            started = time.monotonic()
+            if not Vendor.objects.exists():
+                seed(purchase_orders)
+            seed_seconds = time.monotonic() - started
+            self.stderr.write(f"{scale}: seeded in {seed_seconds:.1f}s, running benchmarks")
+            results = run_benchmarks(options['iterations'], options['operations'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keep)
+        return {
+            'scale': scale,
+            'purchase_orders': purchase_orders,
+            'seed_seconds': round(seed_seconds, 3),
+            'operations': results,
+            'violations': [f"{scale} {violation}"
+                           for violation in check_budgets(results, budgets)],
+        }
@@ -0,0 +1,58 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from webapp.models import Vendor, PurchaseOrder
+
+
+class Command(BaseCommand):
+    help = ("Show query plans and timings of the common purchase order filters "
+            "with and without the PurchaseOrder composite indexes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendor', type=int,
+                            help='Vendor id to query for (defaults to the first vendor).')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Runs per query; the best time is reported.')
+
+    def queries(self, vendor_id):
+        since = timezone.now() - timedelta(days=30)
+        purchase_orders = PurchaseOrder.objects.filter(vendor_id=vendor_id)
+        return {
+            'pending, issued after T': purchase_orders.filter(
+                status='pending', issue_date__gte=since).values_list('id', flat=True),
+            'unacknowledged': purchase_orders.filter(
+                acknowledgment_date__isnull=True).values_list('id', flat=True),
+            'completed count (metrics)': purchase_orders.filter(
+                status='completed').values('vendor_id').order_by(),
+        }
+
+    def run(self, label, queries, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        for name, queryset in queries.items():
+            best = float('inf')
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                best = min(best, time.perf_counter() - started)
+            self.stdout.write(f"{name}: {best * 1000:.3f} ms")
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f"    {line}")
+
+    def handle(self, *args, **options):
+        vendor_id = options['vendor'] or Vendor.objects.order_by('pk').values_list(
+            'pk', flat=True).first()
+        queries = self.queries(vendor_id)
+
+        with transaction.atomic():
+            # Drop the indexes inside a transaction which is rolled back
+            with connection.cursor() as cursor:
+                for index in PurchaseOrder._meta.indexes:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+            self.run('Without composite indexes', queries, options['repeat'])
+            transaction.set_rollback(True)
+
+        self.run('With composite indexes', queries, options['repeat'])
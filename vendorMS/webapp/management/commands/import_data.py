@@ -0,0 +1,212 @@
+import csv
+import itertools
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+
+from webapp import metrics
+from webapp.metrics import recompute_vendors
+from webapp.models import ArchivedPurchaseOrder, Vendor, PurchaseOrder
+from webapp.serializers import VendorSerializer, PurchaseOrderSerializer
+
+# CSV columns which are empty for missing values
+NULLABLE_COLUMNS = ('quality_rating', 'acknowledgment_date', 'delivered_on_time')
+
+# Purchase order history fields which the API does not accept from clients
+HISTORY_FIELDS = {
+    'acknowledgment_date': serializers.DateTimeField(allow_null=True, required=False),
+    'delivered_on_time': serializers.BooleanField(allow_null=True, required=False),
+}
+
+
+class Command(BaseCommand):
+    help = ("Import vendors or purchase orders from a CSV or NDJSON file. "
+            "Rows are validated with the API serializers and written with "
+            "bulk_create, one transaction per batch, without per row signals. "
+            "Vendor metrics are recomputed once at the end. Purchase orders "
+            "reference their vendor by vendor_code.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=['vendors', 'purchase_orders'])
+        parser.add_argument('path', help='CSV or NDJSON file.')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='File format, defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=settings.BULK_WRITE_CHUNK_SIZE,
+                            help='Rows written per transaction.')
+        parser.add_argument('--start-line', type=int, default=0,
+                            help='Skip this many rows, to resume an interrupted import '
+                                 'from the last reported line.')
+        parser.add_argument('--rejects', help='Append rejected rows as NDJSON to this file.')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.')
+        if file_format not in ('csv', 'ndjson'):
+            raise CommandError("Cannot tell the file format, use --format.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        prepare = (self.prepare_vendors if options['model'] == 'vendors'
+                   else self.prepare_purchase_orders)
+        model = Vendor if options['model'] == 'vendors' else PurchaseOrder
+
+        self.vendor_ids, self.vendors = {}, {}
+        if model is PurchaseOrder:
+            self.vendor_ids = dict(Vendor.objects.values_list('vendor_code', 'id'))
+        rejects = open(options['rejects'], 'a') if options['rejects'] else None
+        affected = set()
+        imported = rejected = 0
+        line = options['start_line']
+        started = time.monotonic()
+        try:
+            with open(options['path'], newline='') as source:
+                rows = itertools.islice(read_rows(source, file_format), options['start_line'], None)
+                while batch := list(itertools.islice(rows, options['batch_size'])):
+                    objects, errors = prepare(batch)
+                    with transaction.atomic():
+                        model.objects.bulk_create(objects)
+                    if model is PurchaseOrder:
+                        affected.update(obj.vendor_id for obj in objects)
+                    for error in errors:
+                        if rejects:
+                            rejects.write(json.dumps(error, default=str) + '\n')
+                    imported += len(objects)
+                    rejected += len(errors)
+                    line = batch[-1][0]
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f"Line {line}: {imported} imported, {rejected} rejected, "
+                        f"{imported / max(elapsed, 1e-9):.0f} rows/s")
+        finally:
+            if rejects:
+                rejects.close()
+
+        if model is PurchaseOrder and imported:
+            # A resumed import also covers the vendors of the earlier run
+            vendor_ids = None if options['start_line'] else sorted(affected)
+            recompute_started = time.monotonic()
+            with transaction.atomic():
+                recompute_vendors(vendor_ids)
+            self.stdout.write(f"Recomputed vendor metrics in "
+                              f"{time.monotonic() - recompute_started:.2f}s.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} {options['model']} up to line {line} in "
+            f"{time.monotonic() - started:.2f}s, {rejected} rejected."))
+
+    def prepare_vendors(self, batch):
+        # Vendor codes are checked against the batch and one query instead
+        # of a UniqueValidator query per row
+        serializer = VendorSerializer()
+        vendor_code = serializer.fields['vendor_code']
+        vendor_code.validators = [v for v in vendor_code.validators
+                                  if not isinstance(v, UniqueValidator)]
+        existing = set(Vendor.objects.filter(
+            vendor_code__in=[row.get('vendor_code') for _, row in batch if isinstance(row, dict)]
+        ).values_list('vendor_code', flat=True))
+
+        def build(data, row):
+            if data['vendor_code'] in existing:
+                raise serializers.ValidationError(
+                    {'vendor_code': ["vendor with this vendor code already exists."]})
+            existing.add(data['vendor_code'])
+            return Vendor(**data)
+        return validate_rows(serializer, batch, build)
+
+    def prepare_purchase_orders(self, batch):
+        # Vendors are resolved from the vendor_code map; the serializer's
+        # vendor field looks them up in self.vendors instead of querying.
+        # Taken and archived po_numbers are looked up once per batch, as in
+        # the bulk endpoint
+        po_numbers = [str(row.get('po_number')) for _, row in batch if isinstance(row, dict)]
+        archived = set(ArchivedPurchaseOrder.objects.filter(po_number__in=po_numbers)
+                       .values_list('po_number', flat=True))
+        serializer = PurchaseOrderSerializer(
+            context={'vendors': self.vendors, 'archived_po_numbers': archived})
+        po_number = serializer.fields['po_number']
+        po_number.validators = [v for v in po_number.validators
+                                if not isinstance(v, UniqueValidator)]
+        existing = set(PurchaseOrder.objects.filter(po_number__in=po_numbers)
+                       .values_list('po_number', flat=True))
+
+        known, rejected = [], []
+        for line, row in batch:
+            if isinstance(row, dict) and 'vendor_code' in row:
+                vendor_id = self.vendor_ids.get(row['vendor_code'])
+                if vendor_id is None:
+                    rejected.append({'line': line, 'row': row,
+                                     'errors': {'vendor_code': ["Unknown vendor_code."]}})
+                    continue
+                row['vendor'] = vendor_id
+                if vendor_id not in self.vendors:
+                    self.vendors[vendor_id] = Vendor(pk=vendor_id)
+            known.append((line, row))
+
+        def build(data, row):
+            if data['po_number'] in existing:
+                raise serializers.ValidationError(
+                    {'po_number': ["purchase order with this po number already exists."]})
+            # Read only in the API, but part of the history being imported
+            errors = {}
+            for name, field in HISTORY_FIELDS.items():
+                try:
+                    data[name] = field.run_validation(row.get(name))
+                except serializers.ValidationError as exc:
+                    errors[name] = exc.detail
+            if errors:
+                raise serializers.ValidationError(errors)
+            existing.add(data['po_number'])
+            purchase_order = PurchaseOrder(**data)
+            metrics.prepare_save(purchase_order, None)
+            return purchase_order
+        objects, invalid = validate_rows(serializer, known, build)
+        return objects, rejected + invalid
+
+
+def validate_rows(serializer, batch, build):
+    """
+    Validate (line, row) pairs with a reused serializer and build model
+    objects from the valid ones with build(data, row).
+    Returns (objects, rejected reports)."""
+    objects, rejected = [], []
+    for line, row in batch:
+        try:
+            if not isinstance(row, dict):
+                raise serializers.ValidationError(
+                    {'non_field_errors': [row or "Expected an object."]})
+            objects.append(build(serializer.run_validation(row), row))
+        except serializers.ValidationError as exc:
+            rejected.append({'line': line, 'row': row, 'errors': exc.detail})
+    return objects, rejected
+
+
+def read_rows(source, file_format):
+    """
+    Yield (line, row) for every record of a CSV or NDJSON file, line being
+    the 1-based record number. Malformed records are yielded as an error
+    message instead of a dict."""
+    if file_format == 'csv':
+        for line, row in enumerate(csv.DictReader(source), 1):
+            for name in NULLABLE_COLUMNS:
+                if row.get(name) == '':
+                    row[name] = None
+            if row.get('items'):
+                try:
+                    row['items'] = json.loads(row['items'])
+                except ValueError as exc:
+                    yield line, f"Invalid items JSON: {exc}"
+                    continue
+            yield line, row
+        return
+    line = 0
+    for text in source:
+        if not text.strip():
+            continue
+        line += 1
+        try:
+            yield line, json.loads(text)
+        except ValueError as exc:
+            yield line, f"Invalid JSON: {exc}"
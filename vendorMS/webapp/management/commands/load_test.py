@@ -0,0 +1,189 @@
+import asyncio
+import io
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from rest_framework.authtoken.models import Token
+from vendorMS.asgi import application as asgi_application
+
+from webapp.models import Vendor, PurchaseOrder
+
+# Each scenario is requested once through the sync DRF endpoint on the WSGI
+# application and once through its async variant on the ASGI application
+SCENARIOS = {
+    'vendor-list': ('/api/vendors/', '/api/async/vendors/'),
+    'vendor-detail': ('/api/vendors/{vendor_id}/', '/api/async/vendors/{vendor_id}/'),
+    'vendor-metrics': ('/api/vendors/{vendor_id}/performance/',
+                       '/api/async/vendors/{vendor_id}/performance/'),
+    'vendor-history': ('/api/vendors/{vendor_id}/performances',
+                       '/api/async/vendors/{vendor_id}/performances'),
+    'po-list': ('/api/purchase_orders/', '/api/async/purchase_orders/'),
+    'po-detail': ('/api/purchase_orders/{po_id}/', '/api/async/purchase_orders/{po_id}/'),
+}
+
+
+class Command(BaseCommand):
+    help = ("Load test the sync API on WSGI against the async API on ASGI and "
+            "report p50/p99 latency and requests per second. By default the "
+            "applications are driven in-process; use --wsgi-url/--asgi-url to "
+            "test running servers over keep-alive connections.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per scenario and server.')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Concurrent connections (WSGI threads in-process).')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            choices=sorted(SCENARIOS),
+                            help='Scenario to run (repeatable, defaults to all).')
+        parser.add_argument('--wsgi-url', help='Base URL of a running WSGI server.')
+        parser.add_argument('--asgi-url', help='Base URL of a running ASGI server.')
+        parser.add_argument('--token', help='API token, created for a load test user by default.')
+
+    def handle(self, *args, **options):
+        if bool(options['wsgi_url']) != bool(options['asgi_url']):
+            raise CommandError("Pass both --wsgi-url and --asgi-url, or neither.")
+        vendor = Vendor.objects.order_by('pk').first()
+        purchase_order = PurchaseOrder.objects.order_by('pk').first()
+        if vendor is None or purchase_order is None:
+            raise CommandError("Load testing needs at least one vendor and purchase order.")
+        token = options['token'] or Token.objects.get_or_create(
+            user=User.objects.get_or_create(username='loadtest')[0])[0].key
+        ids = {'vendor_id': vendor.pk, 'po_id': purchase_order.pk}
+
+        if options['wsgi_url']:
+            runners = {'wsgi': lambda path: run_http(options['wsgi_url'] + path, token, options),
+                       'asgi': lambda path: run_http(options['asgi_url'] + path, token, options)}
+        else:
+            wsgi, asgi = get_wsgi_application(), asgi_application
+            runners = {'wsgi': lambda path: run_wsgi(wsgi, path, token, options),
+                       'asgi': lambda path: asyncio.run(run_asgi(asgi, path, token, options))}
+
+        self.stdout.write(f"{'scenario':<20} {'server':<6} {'p50 ms':>8} {'p99 ms':>8} "
+                          f"{'req/s':>8} {'errors':>7}")
+        for name in options['scenarios'] or SCENARIOS:
+            for server, path in zip(('wsgi', 'asgi'), SCENARIOS[name]):
+                latencies, errors, elapsed = runners[server](path.format(**ids))
+                self.stdout.write(
+                    f"{name:<20} {server:<6} {percentile(latencies, 50):>8.2f} "
+                    f"{percentile(latencies, 99):>8.2f} {len(latencies) / elapsed:>8.0f} "
+                    f"{errors:>7}")
+
+
+def percentile(latencies, pct):
+    # Latency percentile in milliseconds
+    if len(latencies) < 2:
+        return latencies[0] * 1000 if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method='inclusive')[pct - 1] * 1000
+
+
+def run_wsgi(application, path, token, options):
+    path, _, query = path.partition('?')
+
+    def request(_):
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+            'HTTP_AUTHORIZATION': f'Token {token}', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': io.StringIO(),
+        }
+        statuses = []
+        started = time.perf_counter()
+        result = application(environ, lambda status, headers: statuses.append(status))
+        b''.join(result)
+        result.close()
+        return time.perf_counter() - started, statuses[0].startswith('200')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(options['concurrency']) as executor:
+        results = list(executor.map(request, range(options['requests'])))
+    return _summary(results, time.perf_counter() - started)
+
+
+async def run_asgi(application, path, token, options):
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'authorization', f'Token {token}'.encode())],
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 50000),
+    }
+
+    async def request():
+        statuses = []
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        finished = asyncio.Event()
+
+        async def receive():
+            # The request body, then a disconnect once the response is sent
+            if messages:
+                return messages.pop()
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+            elif not message.get('more_body'):
+                finished.set()
+
+        started = time.perf_counter()
+        await application(dict(scope), receive, send)
+        return time.perf_counter() - started, statuses[0] == 200
+
+    results = []
+    remaining = iter(range(options['requests']))
+
+    async def worker():
+        for _ in remaining:
+            results.append(await request())
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+    return _summary(results, time.perf_counter() - started)
+
+
+def run_http(url, token, options):
+    parts = urlsplit(url)
+    target = parts.path + (f'?{parts.query}' if parts.query else '')
+    message = (f'GET {target} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+               f'Authorization: Token {token}\r\nConnection: keep-alive\r\n\r\n').encode()
+
+    async def connection(remaining, results):
+        # One keep-alive connection issuing requests back to back
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        try:
+            for _ in remaining:
+                started = time.perf_counter()
+                writer.write(message)
+                status_line = await reader.readline()
+                length = 0
+                while (line := await reader.readline()) not in (b'\r\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    if name.lower() == 'content-length':
+                        length = int(value)
+                await reader.readexactly(length)
+                results.append((time.perf_counter() - started, b' 200 ' in status_line))
+        finally:
+            writer.close()
+
+    async def run():
+        results = []
+        remaining = iter(range(options['requests']))
+        started = time.perf_counter()
+        await asyncio.gather(*(connection(remaining, results)
+                               for _ in range(options['concurrency'])))
+        return _summary(results, time.perf_counter() - started)
+
+    return asyncio.run(run())
+
+
+def _summary(results, elapsed):
+    # (latencies, error count, elapsed seconds)
+    return ([latency for latency, _ in results], sum(not ok for _, ok in results), elapsed)
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from webapp.metrics_queue import drain_outbox
+
+
+class Command(BaseCommand):
+    help = ("Recompute vendor metrics queued in the metrics outbox by "
+            "purchase order writes in async METRICS_MODE.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the outbox instead of exiting once it is empty.')
+        parser.add_argument('--interval', type=float,
+                            default=settings.METRICS_MAX_STALENESS / 2,
+                            help='Seconds between polls with --loop.')
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.METRICS_WORKER_BATCH_SIZE,
+                            help='Vendors recomputed per transaction.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            processed = drain_outbox(options['batch_size'])
+            if processed or not options['loop']:
+                self.stdout.write(f"Recomputed {processed} vendors in "
+                                  f"{time.monotonic() - started:.2f}s.")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,130 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from webapp.metrics import (COUNTER_FIELDS, add_carry_overs, aggregate_counters,
+                            derive_metrics, recompute_vendors)
+from webapp.models import METRIC_FIELDS, ArchiveCarryOver, Vendor, PurchaseOrder
+from webapp.ranking import rebuild_rankings
+from webapp.sharding import ShardError, parallel_recompute
+
+# Summed response times may differ by float rounding between SQL and Python
+COUNTER_TOLERANCE = {'rel_tol': 1e-7, 'abs_tol': 1e-3}
+# Differences up to one rounding step of the stored metrics are not drift
+METRIC_TOLERANCE = 0.01 + 1e-9
+
+
+class Command(BaseCommand):
+    help = ("Rebuild vendor metric counters and metrics from the purchase order "
+            "history with a single GROUP BY pass, and report how far the "
+            "stored values had drifted. Recomputing all vendors also rebuilds "
+            "the vendor rankings.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendor', type=int, action='append', dest='vendors',
+                            help='Only recompute this vendor id (repeatable).')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Vendors written per bulk update.')
+        parser.add_argument('--check', action='store_true',
+                            help='Only report drift, do not save.')
+        parser.add_argument('--show', type=int, default=10,
+                            help='Number of most drifted vendors to list.')
+        parser.add_argument('--workers', type=int, default=settings.PARALLEL_WORKERS,
+                            help='Worker processes; more than one recomputes all vendors '
+                                 'in shards of --shard-size vendors, one transaction each.')
+        parser.add_argument('--shard-size', type=int, default=settings.PARALLEL_SHARD_SIZE,
+                            help='Vendors per shard with --workers.')
+
+    def handle(self, *args, **options):
+        vendors = Vendor.objects.all()
+        purchase_orders = PurchaseOrder.objects.all()
+        carry_overs = ArchiveCarryOver.objects.all()
+        if options['vendors']:
+            vendors = vendors.filter(pk__in=options['vendors'])
+            purchase_orders = purchase_orders.filter(vendor_id__in=options['vendors'])
+            carry_overs = carry_overs.filter(vendor_id__in=options['vendors'])
+        stored = {row.pop('pk'): row
+                  for row in vendors.values('pk', *COUNTER_FIELDS, *METRIC_FIELDS)}
+
+        started = time.monotonic()
+        sharded = options['workers'] > 1 and not options['vendors']
+        if sharded:
+            counters = self.recompute_in_shards(options)
+        else:
+            counters = add_carry_overs(aggregate_counters(purchase_orders), carry_overs)
+        aggregated = time.monotonic()
+        if not sharded and not options['check']:
+            with transaction.atomic():
+                recompute_vendors(stored.keys(), options['batch_size'], counters,
+                                  rankings=bool(options['vendors']))
+            if not options['vendors']:
+                rebuild_rankings()
+        written = time.monotonic()
+
+        drifted = self.report_drift(stored, counters, options['show'])
+        total = sum(values['total_po_count'] for values in counters.values())
+        if sharded:
+            self.stdout.write(
+                f"Aggregated {total} purchase orders and wrote {len(stored)} vendors in "
+                f"{options['workers']} workers in {aggregated - started:.2f}s "
+                f"({total / max(aggregated - started, 1e-9):.0f} POs/s).")
+        else:
+            self.stdout.write(
+                f"Aggregated {total} purchase orders in {aggregated - started:.2f}s "
+                f"({total / max(aggregated - started, 1e-9):.0f} POs/s), "
+                f"wrote {len(stored)} vendors in {written - aggregated:.2f}s.")
+
+        if options['check']:
+            if drifted:
+                raise CommandError(f"{drifted} vendors have drifted metrics.")
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Recomputed metrics for {len(stored)} vendors."))
+
+    def recompute_in_shards(self, options):
+        def progress(done, total):
+            self.stdout.write(f"  {done}/{total} shards done")
+        try:
+            return parallel_recompute(options['workers'], options['shard_size'],
+                                      write=not options['check'], progress=progress)
+        except ShardError as exc:
+            raise CommandError(str(exc))
+
+    def report_drift(self, stored, counters, show):
+        # Report drift of the stored counters and metrics and return the
+        # number of vendors with either
+        empty = dict.fromkeys(COUNTER_FIELDS, 0)
+        counter_drift = 0
+        drifted = 0
+        metric_drift = {field: [] for field in METRIC_FIELDS}
+        worst = []
+        for vendor_id, values in stored.items():
+            expected = counters.get(vendor_id, empty)
+            counters_match = all(math.isclose(values[field], expected[field], **COUNTER_TOLERANCE)
+                                 for field in COUNTER_FIELDS)
+            counter_drift += not counters_match
+            largest = 0.0
+            for field, value in derive_metrics(expected).items():
+                difference = abs(values[field] - value)
+                if difference > METRIC_TOLERANCE:
+                    metric_drift[field].append(difference)
+                    largest = max(largest, difference)
+            if largest:
+                worst.append((largest, vendor_id, values, expected))
+            drifted += bool(largest) or not counters_match
+
+        self.stdout.write(f"Checked {len(stored)} vendors, {counter_drift} "
+                          f"with drifted counters.")
+        for field, differences in metric_drift.items():
+            if differences:
+                self.stdout.write(
+                    f"  {field}: {len(differences)} vendors drifted, "
+                    f"max {max(differences):.2f}, mean {sum(differences) / len(differences):.2f}")
+        for largest, vendor_id, values, expected in sorted(worst, reverse=True)[:show]:
+            recomputed = derive_metrics(expected)
+            self.stdout.write(f"  Vendor {vendor_id}: " + ', '.join(
+                f"{field} {values[field]} -> {recomputed[field]}" for field in METRIC_FIELDS))
+        return drifted
@@ -0,0 +1,126 @@
+import io
+import itertools
+import json
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from webapp.models import Vendor
+from webapp.replicas import sync_replicas
+
+# Read endpoints requested in turn by the readers
+READ_PATHS = (
+    '/api/vendors/',
+    '/api/vendors/{vendor_id}/performances',
+    '/api/purchase_orders/?vendor={vendor_id}',
+    '/api/export/purchase_orders.ndjson?vendor={vendor_id}',
+)
+
+
+class Command(BaseCommand):
+    help = ("Run concurrent readers and purchase order writers through the "
+            "in-process WSGI application, once with every query on the primary "
+            "and once with the reads routed to the replicas, and compare their "
+            "throughput. Writes purchase orders: run it on a scratch database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=10.0,
+                            help='Duration of each run.')
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured, set VENDORMS_DB_REPLICAS.")
+        vendor_ids = list(Vendor.objects.values_list('pk', flat=True)[:100])
+        if not vendor_ids:
+            raise CommandError("Load testing needs at least one vendor.")
+        tokens = {role: Token.objects.get_or_create(
+            user=User.objects.get_or_create(username=f'replica-load-{role}')[0])[0].key
+            for role in ('reader', 'writer')}
+        # the replicas need the tokens and vendors
+        sync_replicas()
+
+        application = get_wsgi_application()
+        self.stdout.write(f"{'mode':<10} {'reads/s':>9} {'read p99 ms':>12} "
+                          f"{'writes/s':>9} {'write p99 ms':>13} {'errors':>7}")
+        for mode, replicas in (('primary', []), ('replicas', settings.DATABASE_REPLICAS)):
+            with override_settings(DATABASE_REPLICAS=replicas):
+                reads, writes = run(application, tokens, vendor_ids, options)
+            self.stdout.write(
+                f"{mode:<10} {len(reads) / options['seconds']:>9.0f} "
+                f"{percentile(reads, 99):>12.2f} {len(writes) / options['seconds']:>9.0f} "
+                f"{percentile(writes, 99):>13.2f} "
+                f"{sum(not ok for _, ok in reads + writes):>7}")
+
+
+def percentile(results, pct):
+    # Latency percentile in milliseconds of (seconds, ok) results
+    latencies = [latency for latency, _ in results]
+    if len(latencies) < 2:
+        return latencies[0] * 1000 if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method='inclusive')[pct - 1] * 1000
+
+
+def request(application, method, path, token, body=b''):
+    path, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query,
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+        'HTTP_AUTHORIZATION': f'Token {token}', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body), 'wsgi.url_scheme': 'http',
+        'wsgi.errors': io.StringIO(),
+    }
+    statuses = []
+    started = time.perf_counter()
+    result = application(environ, lambda status, headers: statuses.append(status))
+    b''.join(result)
+    result.close()
+    return time.perf_counter() - started, statuses[0][:1] == '2'
+
+
+def run(application, tokens, vendor_ids, options):
+    """
+    Run the readers and writers for options['seconds'] and return their
+    (seconds, ok) results"""
+    deadline = time.monotonic() + options['seconds']
+    reads, writes = [], []
+    counter = itertools.count()
+
+    def reader(offset):
+        paths = itertools.cycle(READ_PATHS[offset % len(READ_PATHS):]
+                                + READ_PATHS[:offset % len(READ_PATHS)])
+        for number in itertools.count():
+            if time.monotonic() >= deadline:
+                return
+            path = next(paths).format(vendor_id=vendor_ids[number % len(vendor_ids)])
+            reads.append(request(application, 'GET', path, tokens['reader']))
+
+    def writer(_):
+        while time.monotonic() < deadline:
+            number = next(counter)
+            now = timezone.now().isoformat()
+            body = json.dumps({
+                'po_number': f'REPLICA-LOAD-{time.time_ns()}-{number}',
+                'vendor': vendor_ids[number % len(vendor_ids)], 'order_date': now,
+                'delivery_date': now, 'issue_date': now, 'items': {'item': number},
+                'quantity': 1, 'status': 'pending'}).encode()
+            writes.append(request(application, 'POST', '/api/purchase_orders/',
+                                  tokens['writer'], body))
+
+    threads = ([threading.Thread(target=reader, args=(i,)) for i in range(options['readers'])]
+               + [threading.Thread(target=writer, args=(i,)) for i in range(options['writers'])])
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return reads, writes
@@ -0,0 +1,34 @@
+from apscheduler.schedulers.blocking import BlockingScheduler
+from django.core.management.base import BaseCommand
+
+from vendorMS.scheduler import build_scheduler
+from webapp.scheduling import process_owner, release_lease, tick
+
+
+class Command(BaseCommand):
+    help = ("Run the scheduled jobs (weekly performance snapshot, purchase "
+            "order archive with ARCHIVE_AFTER_DAYS, metrics outbox in async "
+            "METRICS_MODE) in a dedicated process. Several "
+            "instances may run; one holds the database lease and runs the jobs, "
+            "the others take over when its lease expires.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Run one tick and exit, e.g. from cron.')
+
+    def handle(self, *args, **options):
+        owner = process_owner()
+        if options['once']:
+            leader = tick(owner)
+            release_lease(owner)
+            self.stdout.write("Ran the due jobs." if leader
+                              else "Another scheduler holds the lease.")
+            return
+        scheduler = build_scheduler(BlockingScheduler, owner)
+        self.stdout.write(f"Scheduler {owner} started.")
+        try:
+            scheduler.start()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            release_lease(owner)
@@ -0,0 +1,115 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+VENDORS = 1000
+
+
+class Command(BaseCommand):
+    help = ("Compare the SQLite database profiles under concurrent writers "
+            "(vendor metric updates plus Performance inserts) and readers.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5.0,
+                            help='Duration of each run.')
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--profile', action='append', dest='profiles',
+                            choices=sorted(settings.SQLITE_PROFILES),
+                            help='Profile to run (repeatable, defaults to all).')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'profile':<12} {'writes/s':>10} {'reads/s':>10} {'locked':>8}")
+        for name in options['profiles'] or settings.SQLITE_PROFILES:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'stress.sqlite3')
+                result = self.stress(path, settings.SQLITE_PROFILES[name], options)
+            self.stdout.write(
+                f"{name:<12} {result['writes'] / options['seconds']:>10.0f} "
+                f"{result['reads'] / options['seconds']:>10.0f} {result['locked']:>8}")
+
+    def connect(self, path, profile):
+        connection = sqlite3.connect(path, timeout=profile['OPTIONS'].get('timeout', 5),
+                                     isolation_level=None, check_same_thread=False)
+        for name, value in profile['PRAGMAS'].items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def stress(self, path, profile, options):
+        connection = self.connect(path, profile)
+        connection.executescript('''
+            CREATE TABLE vendor (id INTEGER PRIMARY KEY, total INTEGER, rate REAL);
+            CREATE TABLE performance (id INTEGER PRIMARY KEY, vendor_id INTEGER,
+                                      rate REAL, date TEXT);
+            CREATE INDEX performance_vendor ON performance (vendor_id);
+        ''')
+        connection.executemany('INSERT INTO vendor VALUES (?, 0, 0.0)',
+                               [(i,) for i in range(VENDORS)])
+        connection.close()
+
+        # Persistent connections are reused, otherwise every operation
+        # opens a new connection like a request with CONN_MAX_AGE = 0
+        persistent = profile.get('CONN_MAX_AGE', 0) != 0
+        begin = f"BEGIN {profile['OPTIONS'].get('transaction_mode', 'DEFERRED')}"
+        deadline = time.monotonic() + options['seconds']
+        result = {'writes': 0, 'reads': 0, 'locked': 0}
+        lock = threading.Lock()
+
+        def write(connection):
+            # read-then-write transaction like a PO save and its metric update
+            vendor_id = random.randrange(VENDORS)
+            connection.execute(begin)
+            try:
+                connection.execute('SELECT total FROM vendor WHERE id = ?', (vendor_id,))
+                connection.execute('UPDATE vendor SET total = total + 1, rate = ? '
+                                   'WHERE id = ?', (random.random(), vendor_id))
+                connection.execute("INSERT INTO performance (vendor_id, rate, date) "
+                                   "VALUES (?, ?, datetime('now'))", (vendor_id, 0.5))
+                connection.execute('COMMIT')
+            except sqlite3.OperationalError:
+                connection.execute('ROLLBACK')
+                raise
+            return 'writes'
+
+        def read(connection):
+            vendor_id = random.randrange(VENDORS)
+            connection.execute('SELECT rate FROM vendor WHERE id = ?', (vendor_id,)).fetchall()
+            connection.execute('SELECT count(*) FROM performance WHERE vendor_id = ?',
+                               (vendor_id,)).fetchall()
+            return 'reads'
+
+        def worker(operation):
+            counts = {'writes': 0, 'reads': 0, 'locked': 0}
+            connection = self.connect(path, profile) if persistent else None
+            while time.monotonic() < deadline:
+                current = connection or self.connect(path, profile)
+                try:
+                    counts[operation(current)] += 1
+                except sqlite3.OperationalError as exc:
+                    if 'locked' not in str(exc):
+                        raise
+                    counts['locked'] += 1
+                finally:
+                    if not persistent:
+                        current.close()
+            if connection:
+                connection.close()
+            with lock:
+                for key, value in counts.items():
+                    result[key] += value
+
+        threads = ([threading.Thread(target=worker, args=(write,))
+                    for _ in range(options['writers'])]
+                   + [threading.Thread(target=worker, args=(read,))
+                      for _ in range(options['readers'])])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return result
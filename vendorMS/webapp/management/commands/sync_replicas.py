@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp.replicas import sync_replicas
+
+
+class Command(BaseCommand):
+    help = ("Copy the primary SQLite database into the read replicas of "
+            "VENDORMS_DB_REPLICAS, once or every --interval seconds. Replicas "
+            "of other databases are kept by their own replication.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Keep copying, waiting this many seconds between copies.')
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured, set VENDORMS_DB_REPLICAS.")
+        while True:
+            try:
+                timings = sync_replicas()
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            for alias, seconds in timings.items():
+                self.stdout.write(f"{alias}: copied in {seconds:.2f}s")
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
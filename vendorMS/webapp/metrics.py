@@ -0,0 +1,348 @@
+import time
+
+from django.conf import settings
+from django.db import NotSupportedError, connection
+from django.db.models import Count, F, FloatField, Func, Max, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
+from django.utils import timezone
+
+from .cache import invalidate_vendor_metrics
+from .monitoring import vendor_metric_updates
+from .ranking import schedule_refresh
+from .models import ArchiveCarryOver, MetricsOutbox, PurchaseOrder, Vendor
+
+# Incremental vendor metric engine
+#
+# Every vendor keeps running counters of its purchase order history. A
+# purchase order save only has to work out how its own contribution to those
+# counters changed (after - before) and apply the difference with a single
+# F() expression UPDATE, which also rewrites the four derived metric fields.
+
+SNAPSHOT_FIELDS = ('vendor_id', 'status', 'quality_rating', 'delivered_on_time',
+                   'acknowledgment_date', 'issue_date', 'delivery_date')
+
+COUNTER_FIELDS = ('total_po_count', 'completed_po_count', 'on_time_po_count',
+                  'rated_po_count', 'quality_rating_sum',
+                  'acknowledged_po_count', 'response_time_sum')
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def fetch_snapshot(instance):
+    """
+    Return the stored state of a purchase order before it is saved,
+    or None when the purchase order does not exist yet"""
+    if instance.pk is None:
+        return None
+    return (PurchaseOrder.objects.filter(pk=instance.pk)
+            .values(*SNAPSHOT_FIELDS).first())
+
+
+def snapshot_of(instance):
+    """
+    Return the in-memory state of a purchase order in snapshot form"""
+    return {field: getattr(instance, field) for field in SNAPSHOT_FIELDS}
+
+
+def mark_completed(instance, before):
+    """
+    Record delivery of a purchase order that is being completed.
+
+    The delivery date is replaced with the completion time and compared
+    against the promised delivery date to decide if it was on time.
+    Purchase orders created as completed are taken as delivered on time."""
+    if before is None:
+        if instance.delivered_on_time is None:
+            instance.delivered_on_time = True
+        return
+    state = completed_state(before, timezone.now())
+    instance.delivered_on_time = state['delivered_on_time']
+    instance.delivery_date = state['delivery_date']
+
+
+def completed_state(state, completed_at):
+    """
+    Return the state of a purchase order after completing it at completed_at"""
+    return dict(state, status='completed', delivery_date=completed_at,
+                delivered_on_time=completed_at <= state['delivery_date'])
+
+
+def prepare_save(instance, before):
+    """
+    Apply side effects of a purchase order save that depend on its stored state"""
+    if (instance.status == 'completed'
+            and (before is None or before['status'] != 'completed')):
+        mark_completed(instance, before)
+
+
+def contribution(state):
+    """
+    Return what a single purchase order adds to its vendor's counters"""
+    completed = state['status'] == 'completed'
+    rated = completed and state['quality_rating'] is not None
+    acknowledged = state['acknowledgment_date'] is not None
+    return {
+        'total_po_count': 1,
+        'completed_po_count': int(completed),
+        'on_time_po_count': int(completed and bool(state['delivered_on_time'])),
+        'rated_po_count': int(rated),
+        'quality_rating_sum': state['quality_rating'] if rated else 0.0,
+        'acknowledged_po_count': int(acknowledged),
+        'response_time_sum': ((state['acknowledgment_date'] - state['issue_date']).total_seconds()
+                              if acknowledged else 0.0),
+    }
+
+
+def _ratio(numerator, denominator, scale=1.0):
+    # Rounded numerator * scale / denominator, 0.0 while the denominator is 0
+    return Coalesce(
+        Round(Cast(numerator, FloatField()) * Value(scale) / NullIf(denominator, 0), 2),
+        Value(0.0), output_field=FloatField())
+
+
+def derived_expressions(counters=None):
+    """
+    Build the SQL expressions for the four vendor metric fields.
+
+    counters maps counter fields to expressions, defaulting to the stored
+    column values. Rates are percentages and response time is in days."""
+    counters = counters or {field: F(field) for field in COUNTER_FIELDS}
+    return {
+        'on_time_delivery_rate': _ratio(counters['on_time_po_count'],
+                                        counters['completed_po_count'], 100.0),
+        'quality_rating_avg': _ratio(counters['quality_rating_sum'],
+                                     counters['rated_po_count']),
+        'average_response_time': _ratio(counters['response_time_sum'],
+                                        counters['acknowledged_po_count'],
+                                        1.0 / SECONDS_PER_DAY),
+        'fulfillment_rate': _ratio(counters['completed_po_count'],
+                                   counters['total_po_count'], 100.0),
+    }
+
+
+def derive_metrics(counters):
+    """
+    Compute the four vendor metric values from counter values in Python"""
+    def ratio(numerator, denominator, scale=1.0):
+        return round(numerator * scale / denominator, 2) if denominator else 0.0
+    return {
+        'on_time_delivery_rate': ratio(counters['on_time_po_count'],
+                                       counters['completed_po_count'], 100.0),
+        'quality_rating_avg': ratio(counters['quality_rating_sum'],
+                                    counters['rated_po_count']),
+        'average_response_time': ratio(counters['response_time_sum'],
+                                       counters['acknowledged_po_count'],
+                                       1.0 / SECONDS_PER_DAY),
+        'fulfillment_rate': ratio(counters['completed_po_count'],
+                                  counters['total_po_count'], 100.0),
+    }
+
+
+def apply_delta(vendor_id, delta):
+    """
+    Add delta to a vendor's counters and rewrite its metrics in one UPDATE"""
+    if not any(delta.values()):
+        return
+    counters = {field: F(field) + delta[field] for field in COUNTER_FIELDS}
+    Vendor.objects.filter(pk=vendor_id).update(
+        **counters, **derived_expressions(counters))
+    invalidate_vendor_metrics([vendor_id])
+
+
+def apply_change(before, after):
+    """
+    Update vendor counters for a purchase order going from before to after.
+
+    Either state may be None for purchase orders being created or deleted."""
+    apply_changes([(before, after)])
+
+
+def apply_changes(changes):
+    """
+    Update vendor counters for many (before, after) purchase order changes,
+    issuing one UPDATE per affected vendor.
+
+    In async METRICS_MODE the affected vendors are queued in the outbox for
+    webapp.metrics_queue instead, unless the queue is already older than
+    METRICS_MAX_STALENESS, in which case they are recomputed right away and
+    their queued events are removed."""
+    if settings.METRICS_MODE == 'async':
+        vendor_ids = {state['vendor_id'] for pair in changes
+                      for state in pair if state is not None}
+        if outbox_is_stale():
+            recompute_queued_vendors(vendor_ids)
+        else:
+            enqueue_vendors(vendor_ids)
+        return
+    deltas = {}
+    for before, after in changes:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            delta = deltas.setdefault(state['vendor_id'], dict.fromkeys(COUNTER_FIELDS, 0))
+            for field, value in contribution(state).items():
+                delta[field] += sign * value
+    for vendor_id, delta in deltas.items():
+        apply_delta(vendor_id, delta)
+    vendor_metric_updates.inc(len(deltas), mode='incremental')
+    schedule_refresh(deltas)
+
+
+def enqueue_vendors(vendor_ids):
+    """
+    Queue vendors for a metric recompute by the outbox worker"""
+    MetricsOutbox.objects.bulk_create(
+        [MetricsOutbox(vendor_id=vendor_id) for vendor_id in vendor_ids])
+    vendor_metric_updates.inc(len(vendor_ids), mode='queued')
+
+
+def outbox_lag():
+    """
+    Return the age in seconds of the oldest queued outbox event, or 0"""
+    oldest = (MetricsOutbox.objects.order_by('created_at')
+              .values_list('created_at', flat=True).first())
+    return (timezone.now() - oldest).total_seconds() if oldest else 0.0
+
+
+# Last outbox_lag() reading of this process, as {'at': monotonic time, 'lag': seconds}
+_lag_checked = {'at': None, 'lag': 0.0}
+
+
+def outbox_is_stale():
+    """
+    Whether the oldest queued outbox event is older than METRICS_MAX_STALENESS.
+    The lag is queried at most once per METRICS_LAG_CHECK_INTERVAL seconds,
+    writes in between reuse the last reading"""
+    now = time.monotonic()
+    checked_at = _lag_checked['at']
+    if checked_at is None or now - checked_at >= settings.METRICS_LAG_CHECK_INTERVAL:
+        _lag_checked.update(at=now, lag=outbox_lag())
+    return _lag_checked['lag'] > settings.METRICS_MAX_STALENESS
+
+
+def recompute_queued_vendors(vendor_ids):
+    """
+    Recompute vendors right away and remove their queued outbox events,
+    which the recompute covers. Events queued after it stay for the worker"""
+    last_id = (MetricsOutbox.objects.filter(vendor_id__in=vendor_ids)
+               .aggregate(last_id=Max('id'))['last_id'])
+    recompute_vendors(vendor_ids)
+    if last_id is not None:
+        MetricsOutbox.objects.filter(vendor_id__in=vendor_ids, id__lte=last_id).delete()
+
+
+class SecondsBetween(Func):
+    """
+    Seconds from the second datetime expression to the first, computed
+    natively in SQL (Django's DurationField arithmetic runs a Python
+    function per row on SQLite)"""
+    arity = 2
+    output_field = FloatField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f"SecondsBetween is not supported on {connection.vendor}.")
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection,
+                              template='((julianday(%(expressions)s)) * 86400.0)',
+                              arg_joiner=') - julianday(', **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection,
+                              template='EXTRACT(EPOCH FROM (%(expressions)s))',
+                              arg_joiner=' - ', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        # TIMESTAMPDIFF takes the start before the end
+        clone = self.copy()
+        clone.set_source_expressions(self.get_source_expressions()[::-1])
+        return super(SecondsBetween, clone).as_sql(
+            compiler, connection,
+            template='(TIMESTAMPDIFF(MICROSECOND, %(expressions)s) / 1000000.0)',
+            **extra_context)
+
+
+def aggregate_counters(queryset=None):
+    """
+    Compute vendor counters from purchase order rows in a single GROUP BY query"""
+    queryset = PurchaseOrder.objects.all() if queryset is None else queryset
+    completed = Q(status='completed')
+    acknowledged = Q(acknowledgment_date__isnull=False)
+    response_time = SecondsBetween('acknowledgment_date', 'issue_date')
+    rows = queryset.order_by().values('vendor_id').annotate(
+        total_po_count=Count('pk'),
+        completed_po_count=Count('pk', filter=completed),
+        on_time_po_count=Count('pk', filter=completed & Q(delivered_on_time=True)),
+        rated_po_count=Count('pk', filter=completed & Q(quality_rating__isnull=False)),
+        quality_rating_sum=Sum('quality_rating', filter=completed),
+        acknowledged_po_count=Count('pk', filter=acknowledged),
+        response_time_sum=Sum(response_time, filter=acknowledged),
+    )
+    counters = {}
+    for row in rows:
+        vendor_id = row.pop('vendor_id')
+        row['quality_rating_sum'] = row['quality_rating_sum'] or 0.0
+        row['response_time_sum'] = row['response_time_sum'] or 0.0
+        counters[vendor_id] = row
+    return counters
+
+
+def add_carry_overs(counters, carry_overs=None):
+    """
+    Add the counters carried over from archived purchase orders to counters
+    keyed by vendor id, in place. carry_overs is an ArchiveCarryOver
+    queryset, all of them by default. Returns counters."""
+    carry_overs = ArchiveCarryOver.objects.all() if carry_overs is None else carry_overs
+    for row in carry_overs.values('vendor_id', *COUNTER_FIELDS):
+        vendor_counters = counters.setdefault(row.pop('vendor_id'),
+                                              dict.fromkeys(COUNTER_FIELDS, 0))
+        for field, value in row.items():
+            vendor_counters[field] += value
+    return counters
+
+
+def recompute_vendors(vendor_ids=None, batch_size=500, counters=None, rankings=True):
+    """
+    Rebuild counters and metrics from scratch for the given vendors (or all).
+
+    counters may hold counters already aggregated for these vendors,
+    including their archive carry-overs. Without
+    rankings the caller refreshes the vendor rankings itself.
+    Returns the recomputed counters keyed by vendor id."""
+    purchase_orders = PurchaseOrder.objects.all()
+    carry_overs = ArchiveCarryOver.objects.all()
+    if vendor_ids is None:
+        vendor_ids = list(Vendor.objects.order_by('pk').values_list('pk', flat=True))
+    else:
+        vendor_ids = list(vendor_ids)
+        purchase_orders = purchase_orders.filter(vendor_id__in=vendor_ids)
+        carry_overs = carry_overs.filter(vendor_id__in=vendor_ids)
+    if counters is None:
+        counters = add_carry_overs(aggregate_counters(purchase_orders), carry_overs)
+    empty = dict.fromkeys(COUNTER_FIELDS, 0)
+
+    for start in range(0, len(vendor_ids), batch_size):
+        chunk = vendor_ids[start:start + batch_size]
+        write_counters({vendor_id: counters.setdefault(vendor_id, dict(empty))
+                        for vendor_id in chunk})
+        Vendor.objects.filter(pk__in=chunk).update(**derived_expressions())
+        invalidate_vendor_metrics(chunk)
+    vendor_metric_updates.inc(len(vendor_ids), mode='recompute')
+    if rankings:
+        schedule_refresh(vendor_ids)
+    return counters
+
+
+def write_counters(counters):
+    """
+    Overwrite the counters of many vendors with one executemany UPDATE.
+
+    Used instead of bulk_update, whose per object CASE expressions cost
+    more than the aggregation itself for large numbers of vendors."""
+    quote = connection.ops.quote_name
+    assignments = ', '.join(f'{quote(field)} = %s' for field in COUNTER_FIELDS)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {quote(Vendor._meta.db_table)} SET {assignments} WHERE {quote("id")} = %s',
+            [[values[field] for field in COUNTER_FIELDS] + [vendor_id]
+             for vendor_id, values in counters.items()])
@@ -0,0 +1,49 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from .metrics import recompute_vendors
+from .models import MetricsOutbox
+
+logger = logging.getLogger(__name__)
+
+# Worker side of the async metrics mode. Purchase order writes queue
+# "vendor dirty" events in MetricsOutbox; the worker coalesces the pending
+# events per vendor and recomputes each dirty vendor once per batch.
+
+
+def process_outbox(batch_size=None):
+    """
+    Recompute the metrics of up to batch_size queued vendors and remove
+    their events. Returns the number of vendors recomputed."""
+    batch_size = batch_size or settings.METRICS_WORKER_BATCH_SIZE
+    with transaction.atomic():
+        events = MetricsOutbox.objects.order_by('id')
+        last_id = events.values_list('id', flat=True).last()
+        if last_id is None:
+            return 0
+        vendor_ids = list(events.filter(id__lte=last_id).values_list('vendor_id', flat=True)
+                          .distinct().order_by()[:batch_size])
+        recompute_vendors(vendor_ids)
+        # Events queued after last_id stay for the next run
+        MetricsOutbox.objects.filter(id__lte=last_id, vendor_id__in=vendor_ids).delete()
+    return len(vendor_ids)
+
+
+def drain_outbox(batch_size=None):
+    """
+    Process queued events until the outbox is empty"""
+    total = 0
+    while processed := process_outbox(batch_size):
+        total += processed
+    return total
+
+
+def run_worker():
+    """
+    Drain the outbox and log how many vendors were recomputed"""
+    processed = drain_outbox()
+    if processed:
+        logger.info("Recomputed metrics of %d queued vendors", processed)
+    return processed
@@ -0,0 +1,138 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:59
+
+from django.db import NotSupportedError, migrations, models
+from django.db.models import Count, FloatField, Func, Q, Sum
+
+# Frozen copies of metrics.SECONDS_PER_DAY and metrics.SecondsBetween, so
+# that changes to the app code cannot break this migration
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class SecondsBetween(Func):
+    """
+    Seconds from the second datetime expression to the first, computed in SQL"""
+    arity = 2
+    output_field = FloatField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f"SecondsBetween is not supported on {connection.vendor}.")
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection,
+                              template='((julianday(%(expressions)s)) * 86400.0)',
+                              arg_joiner=') - julianday(', **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection,
+                              template='EXTRACT(EPOCH FROM (%(expressions)s))',
+                              arg_joiner=' - ', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        # TIMESTAMPDIFF takes the start before the end
+        clone = self.copy()
+        clone.set_source_expressions(self.get_source_expressions()[::-1])
+        return super(SecondsBetween, clone).as_sql(
+            compiler, connection,
+            template='(TIMESTAMPDIFF(MICROSECOND, %(expressions)s) / 1000000.0)',
+            **extra_context)
+
+
+COUNTER_FIELDS = ('total_po_count', 'completed_po_count', 'on_time_po_count',
+                  'rated_po_count', 'quality_rating_sum',
+                  'acknowledged_po_count', 'response_time_sum')
+
+
+def fill_counters(apps, schema_editor):
+    # The delivery date of completed purchase orders was overwritten with the
+    # completion time, so whether they were on time is lost: they are taken
+    # as delivered on time, as purchase orders created completed are.
+    PurchaseOrder = apps.get_model('webapp', 'PurchaseOrder')
+    Vendor = apps.get_model('webapp', 'Vendor')
+    PurchaseOrder.objects.filter(status='completed', delivered_on_time__isnull=True).update(
+        delivered_on_time=True)
+
+    # Counters from the purchase order history, as metrics.aggregate_counters
+    completed = Q(status='completed')
+    acknowledged = Q(acknowledgment_date__isnull=False)
+    rows = PurchaseOrder.objects.order_by().values('vendor_id').annotate(
+        total_po_count=Count('pk'),
+        completed_po_count=Count('pk', filter=completed),
+        on_time_po_count=Count('pk', filter=completed & Q(delivered_on_time=True)),
+        rated_po_count=Count('pk', filter=completed & Q(quality_rating__isnull=False)),
+        quality_rating_sum=Sum('quality_rating', filter=completed),
+        acknowledged_po_count=Count('pk', filter=acknowledged),
+        response_time_sum=Sum(SecondsBetween('acknowledgment_date', 'issue_date'),
+                              filter=acknowledged),
+    )
+    counters = {row.pop('vendor_id'): row for row in rows}
+
+    def ratio(numerator, denominator, scale=1.0):
+        return round((numerator or 0.0) * scale / denominator, 2) if denominator else 0.0
+
+    vendors = list(Vendor.objects.filter(pk__in=counters))
+    for vendor in vendors:
+        row = counters[vendor.pk]
+        for field in COUNTER_FIELDS:
+            setattr(vendor, field, row[field] or 0)
+        vendor.on_time_delivery_rate = ratio(row['on_time_po_count'],
+                                             row['completed_po_count'], 100.0)
+        vendor.quality_rating_avg = ratio(row['quality_rating_sum'], row['rated_po_count'])
+        vendor.average_response_time = ratio(row['response_time_sum'],
+                                             row['acknowledged_po_count'],
+                                             1.0 / SECONDS_PER_DAY)
+        vendor.fulfillment_rate = ratio(row['completed_po_count'],
+                                        row['total_po_count'], 100.0)
+    Vendor.objects.bulk_update(
+        vendors, [*COUNTER_FIELDS, 'on_time_delivery_rate', 'quality_rating_avg',
+                  'average_response_time', 'fulfillment_rate'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0002_alter_performance_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='delivered_on_time',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vendor',
+            name='acknowledged_po_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='vendor',
+            name='completed_po_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='vendor',
+            name='on_time_po_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='vendor',
+            name='quality_rating_sum',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='vendor',
+            name='rated_po_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='vendor',
+            name='response_time_sum',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='vendor',
+            name='total_po_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
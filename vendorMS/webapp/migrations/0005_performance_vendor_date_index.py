@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0004_purchaseorder_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='performance',
+            index=models.Index(fields=['vendor', 'date'], name='performance_vendor_date_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0005_performance_vendor_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricsOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='webapp.vendor')),
+            ],
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Window
+from django.db.models.functions import Rank
+
+# metric -> (counter which must be positive to rank, lower is better), as
+# ranking.RANKED_METRICS
+RANKED_METRICS = {
+    'on_time_delivery_rate': ('completed_po_count', False),
+    'quality_rating_avg': ('rated_po_count', False),
+    'average_response_time': ('acknowledged_po_count', True),
+    'fulfillment_rate': ('total_po_count', False),
+}
+
+
+def fill_rankings(apps, schema_editor):
+    # Rank the existing vendors as ranking.rebuild_rankings does, so the
+    # incremental rank moves start from a complete table
+    Vendor = apps.get_model('webapp', 'Vendor')
+    VendorRank = apps.get_model('webapp', 'VendorRank')
+    for metric, (counter, lower_is_better) in RANKED_METRICS.items():
+        order = F(metric).asc() if lower_is_better else F(metric).desc()
+        rows = (Vendor.objects.filter(**{f'{counter}__gt': 0})
+                .annotate(rank=Window(Rank(), order_by=order))
+                .values_list('pk', metric, 'rank'))
+        VendorRank.objects.bulk_create(
+            [VendorRank(vendor_id=pk, metric=metric, rank=rank,
+                        score=-value if lower_is_better else value)
+             for pk, value, rank in rows], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0007_scheduler_lease_and_job_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorRank',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(choices=[('on_time_delivery_rate', 'on_time_delivery_rate'), ('quality_rating_avg', 'quality_rating_avg'), ('average_response_time', 'average_response_time'), ('fulfillment_rate', 'fulfillment_rate')], max_length=30)),
+                ('score', models.FloatField()),
+                ('rank', models.IntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='vendor',
+            index=models.Index(fields=['on_time_delivery_rate'], name='vendor_on_time_rate_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vendor',
+            index=models.Index(fields=['quality_rating_avg'], name='vendor_quality_avg_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vendor',
+            index=models.Index(fields=['average_response_time'], name='vendor_response_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vendor',
+            index=models.Index(fields=['fulfillment_rate'], name='vendor_fulfillment_rate_idx'),
+        ),
+        migrations.AddField(
+            model_name='vendorrank',
+            name='vendor',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='ranks', to='webapp.vendor'),
+        ),
+        migrations.AddIndex(
+            model_name='vendorrank',
+            index=models.Index(fields=['metric', 'score'], name='vendorrank_metric_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='vendorrank',
+            constraint=models.UniqueConstraint(fields=('vendor', 'metric'), name='vendorrank_vendor_metric_uniq'),
+        ),
+        migrations.RunPython(fill_rankings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0008_vendor_rankings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveCarryOver',
+            fields=[
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive_carry_over', serialize=False, to='webapp.vendor')),
+                ('total_po_count', models.IntegerField(default=0)),
+                ('completed_po_count', models.IntegerField(default=0)),
+                ('on_time_po_count', models.IntegerField(default=0)),
+                ('rated_po_count', models.IntegerField(default=0)),
+                ('quality_rating_sum', models.FloatField(default=0.0)),
+                ('acknowledged_po_count', models.IntegerField(default=0)),
+                ('response_time_sum', models.FloatField(default=0.0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedPurchaseOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('po_number', models.CharField(max_length=250, unique=True)),
+                ('order_date', models.DateTimeField()),
+                ('delivery_date', models.DateTimeField()),
+                ('items', models.BinaryField()),
+                ('quantity', models.IntegerField()),
+                ('status', models.CharField(max_length=9)),
+                ('quality_rating', models.FloatField(blank=True, null=True)),
+                ('issue_date', models.DateTimeField()),
+                ('acknowledgment_date', models.DateTimeField(blank=True, null=True)),
+                ('delivered_on_time', models.BooleanField(blank=True, null=True)),
+                ('period', models.DateField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_pos', to='webapp.vendor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period'], name='archivedpo_period_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+import webapp.fields
+
+BATCH_SIZE = 2000
+
+
+def _convert(apps, schema_editor, source, target, encode):
+    # Copy every purchase order's items from the source to the target column
+    # in primary key batches, one executemany UPDATE per batch
+    PurchaseOrder = apps.get_model('webapp', 'PurchaseOrder')
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    update = (f'UPDATE {quote(PurchaseOrder._meta.db_table)} SET {quote(target)} = %s '
+              f'WHERE {quote("id")} = %s')
+    after_pk = 0
+    while True:
+        rows = list(PurchaseOrder.objects.filter(pk__gt=after_pk).order_by('pk')
+                    .values_list('pk', source)[:BATCH_SIZE])
+        if not rows:
+            break
+        with connection.cursor() as cursor:
+            cursor.executemany(update, [(encode(items), pk) for pk, items in rows])
+        after_pk = rows[-1][0]
+
+
+def compress_items(apps, schema_editor):
+    _convert(apps, schema_editor, 'items', 'items_data', webapp.fields.compress_json)
+
+
+def decompress_items(apps, schema_editor):
+    field = apps.get_model('webapp', 'PurchaseOrder')._meta.get_field('items')
+    _convert(apps, schema_editor, 'items_data', 'items',
+             lambda items: field.get_db_prep_value(items, schema_editor.connection))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0009_purchase_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='items_data',
+            field=webapp.fields.CompressedJSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='purchaseorder',
+            name='items',
+            field=models.JSONField(null=True),
+        ),
+        migrations.RunPython(compress_items, decompress_items),
+        migrations.RemoveField(
+            model_name='purchaseorder',
+            name='items',
+        ),
+        migrations.RenameField(
+            model_name='purchaseorder',
+            old_name='items_data',
+            new_name='items',
+        ),
+        migrations.AlterField(
+            model_name='purchaseorder',
+            name='items',
+            field=webapp.fields.CompressedJSONField(),
+        ),
+        migrations.AlterField(
+            model_name='archivedpurchaseorder',
+            name='items',
+            field=webapp.fields.CompressedJSONField(),
+        ),
+    ]
@@ -1,5 +1,11 @@
 from django.db import models
 
+from .fields import CompressedJSONField
+
+# Performance metrics stored on Vendor and recorded in Performance
+METRIC_FIELDS = ('on_time_delivery_rate', 'quality_rating_avg',
+                 'average_response_time', 'fulfillment_rate')
+
 
 class Vendor(models.Model):
     """
@@ -12,7 +18,10 @@ class Vendor(models.Model):
     on_time_delivery_rate: Percentage of on-time deliveries
     quality_rating_avg: Average quality rating for purchase orders
     average_response_time: Average time taken to acknowldge purchase orders
-    fulfillment_rate: Percentage of purchase orders fulfilled successfully"""
+    fulfillment_rate: Percentage of purchase orders fulfilled successfully
+
+    The *_count and *_sum fields are running counters kept by webapp.metrics
+    from which the four metrics above are derived."""
 
     name = models.CharField(max_length=255, blank=False)
     contact_details = models.TextField(blank=False)
@@ -22,6 +31,31 @@ class Vendor(models.Model):
     quality_rating_avg = models.FloatField(default=0.0)
     average_response_time = models.FloatField(default=0.0)
     fulfillment_rate = models.FloatField(default=0.0)
+    total_po_count = models.IntegerField(default=0)
+    completed_po_count = models.IntegerField(default=0)
+    on_time_po_count = models.IntegerField(default=0)
+    rated_po_count = models.IntegerField(default=0)
+    quality_rating_sum = models.FloatField(default=0.0)
+    acknowledged_po_count = models.IntegerField(default=0)
+    response_time_sum = models.FloatField(default=0.0)
+
+    class Meta:
+        indexes = [
+            # rankings and filters by each metric
+            models.Index(fields=['on_time_delivery_rate'], name='vendor_on_time_rate_idx'),
+            models.Index(fields=['quality_rating_avg'], name='vendor_quality_avg_idx'),
+            models.Index(fields=['average_response_time'], name='vendor_response_time_idx'),
+            models.Index(fields=['fulfillment_rate'], name='vendor_fulfillment_rate_idx'),
+        ]
+
+
+class PurchaseOrderManager(models.Manager):
+    """
+    Manager deferring the items payload, which is loaded only where it is
+    used: call defer(None) on a queryset to load it with the other fields"""
+
+    def get_queryset(self):
+        return super().get_queryset().defer('items')
 
 
 class PurchaseOrder(models.Model):
@@ -32,18 +66,19 @@ class PurchaseOrder(models.Model):
     vendor: Foreign Key to the Vendor model
     order_date: Date when the order was placed
     delivery_date: Expected/actual delivery date of the order
-    items: Details of items ordered
+    items: Details of items ordered, stored compressed and deferred by default
     quantity: Total quantity of items in the order
     status: Current status of the order
     quality_rating: Rating given to the vendor for this order
     issue_date: Timestamp when the order was issued to the vendor
-    acknowledgment_date: Timestamp when the vendor acknowledged the order"""
+    acknowledgment_date: Timestamp when the vendor acknowledged the order
+    delivered_on_time: Whether a completed order was delivered by its delivery date"""
 
     po_number = models.CharField(max_length=250, unique=True, blank=False)
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, blank=False)
     order_date = models.DateTimeField(blank=False)
     delivery_date = models.DateTimeField(blank=False)
-    items = models.JSONField(blank=False)
+    items = CompressedJSONField(blank=False)
     quantity = models.IntegerField(blank=False)
     status = models.CharField(choices=[
         ("pending", "order is pending"),
@@ -53,6 +88,66 @@ class PurchaseOrder(models.Model):
     quality_rating = models.FloatField(null=True, blank=True)
     issue_date = models.DateTimeField(blank=False)
     acknowledgment_date = models.DateTimeField(null=True, blank=True)
+    delivered_on_time = models.BooleanField(null=True, blank=True)
+
+    objects = PurchaseOrderManager()
+
+    class Meta:
+        indexes = [
+            # pending/completed orders of a vendor, optionally by issue date
+            models.Index(fields=['vendor', 'status', 'issue_date'],
+                         name='po_vendor_status_issue_idx'),
+            # acknowledged/unacknowledged orders of a vendor
+            models.Index(fields=['vendor', 'acknowledgment_date'],
+                         name='po_vendor_ack_idx'),
+        ]
+
+
+class ArchivedPurchaseOrder(models.Model):
+    """
+    Completed or canceled purchase order moved out of PurchaseOrder by
+    webapp.archive. Fields as in PurchaseOrder, except:
+
+    id: The id the purchase order had in PurchaseOrder
+    period: First day of the order_date month, the archive partition
+    archived_at: Time the purchase order was archived"""
+
+    id = models.BigIntegerField(primary_key=True)
+    po_number = models.CharField(max_length=250, unique=True)
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='archived_pos')
+    order_date = models.DateTimeField()
+    delivery_date = models.DateTimeField()
+    items = CompressedJSONField()
+    quantity = models.IntegerField()
+    status = models.CharField(max_length=9)
+    quality_rating = models.FloatField(null=True, blank=True)
+    issue_date = models.DateTimeField()
+    acknowledgment_date = models.DateTimeField(null=True, blank=True)
+    delivered_on_time = models.BooleanField(null=True, blank=True)
+    period = models.DateField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # one partition, e.g. to purge or export it
+            models.Index(fields=['period'], name='archivedpo_period_idx'),
+        ]
+
+
+class ArchiveCarryOver(models.Model):
+    """
+    Counters of the archived purchase orders of a vendor, kept by
+    webapp.archive so recomputing the metrics from the purchase orders left
+    in PurchaseOrder stays exact. Fields as the counters of Vendor."""
+    vendor = models.OneToOneField(Vendor, on_delete=models.CASCADE, primary_key=True,
+                                  related_name='archive_carry_over')
+    total_po_count = models.IntegerField(default=0)
+    completed_po_count = models.IntegerField(default=0)
+    on_time_po_count = models.IntegerField(default=0)
+    rated_po_count = models.IntegerField(default=0)
+    quality_rating_sum = models.FloatField(default=0.0)
+    acknowledged_po_count = models.IntegerField(default=0)
+    response_time_sum = models.FloatField(default=0.0)
 
 
 class Performance(models.Model):
@@ -72,3 +167,99 @@ class Performance(models.Model):
     quality_rating_avg = models.FloatField(default=0.0)
     average_response_time = models.FloatField(default=0.0)
     fulfillment_rate = models.FloatField(default=0.0)
+
+    class Meta:
+        indexes = [
+            # history of a vendor within a date range
+            models.Index(fields=['vendor', 'date'], name='performance_vendor_date_idx'),
+        ]
+
+
+class VendorRank(models.Model):
+    """
+    Precomputed rank of a vendor by one metric, kept by webapp.ranking
+
+    vendor: The ranked vendor. Rows of deleted vendors are removed by the
+            ranking refresh, which needs their last score to do so.
+    metric: Name of the metric
+    score: The metric value, negated for metrics where lower is better
+    rank: 1 + the number of vendors with a higher score
+    """
+    # looked up through the unique (vendor, metric) index
+    vendor = models.ForeignKey(Vendor, on_delete=models.DO_NOTHING, db_constraint=False,
+                               db_index=False, related_name='ranks')
+    metric = models.CharField(choices=[(field, field) for field in METRIC_FIELDS],
+                              max_length=30)
+    score = models.FloatField()
+    rank = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'metric'], name='vendorrank_vendor_metric_uniq'),
+        ]
+        indexes = [
+            # rank shifts and counts within a range of scores
+            models.Index(fields=['metric', 'score'], name='vendorrank_metric_score_idx'),
+        ]
+
+
+class MetricsOutbox(models.Model):
+    """
+    Vendors whose metrics have to be recomputed, written instead of updating
+    the metrics directly when METRICS_MODE is 'async'
+
+    vendor: Foreign Key to the Vendor model
+    created_at: Time the event was queued
+    """
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, blank=False)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class SchedulerLease(models.Model):
+    """
+    Lease held by the scheduler process elected to run the scheduled jobs
+
+    name: Name of the lease
+    owner: host:pid of the process holding the lease
+    expires_at: Time after which another process may take the lease over
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    owner = models.CharField(max_length=255)
+    expires_at = models.DateTimeField()
+
+
+class JobRun(models.Model):
+    """
+    One run of a scheduled job for one schedule window
+
+    job: Name of the job
+    window: Scheduled time the run is for
+    status: running, succeeded, failed or skipped (a missed window which
+            was superseded by a later one)
+    owner: host:pid of the process which ran the job
+    started_at: Time the run started
+    finished_at: Time the run ended
+    rows: Number of rows the job wrote
+    attempts: Number of times the window was started
+    error: Error of a failed run
+    """
+    job = models.CharField(max_length=100)
+    window = models.DateTimeField()
+    status = models.CharField(choices=[
+        ("running", "job is running"),
+        ("succeeded", "job succeeded"),
+        ("failed", "job failed"),
+        ("skipped", "window was missed"),
+    ], max_length=9)
+    owner = models.CharField(max_length=255, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    rows = models.IntegerField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            # a window is run by one process only
+            models.UniqueConstraint(fields=['job', 'window'], name='jobrun_job_window_uniq'),
+        ]
@@ -0,0 +1,289 @@
+import functools
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db.models import Min, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import JobRun, MetricsOutbox
+
+# In-process metrics in the Prometheus text format, served at /metrics.
+# Counters, gauges and histograms keep their values per label set behind
+# one lock each, so recording costs a dict lookup and a few additions.
+# Values are per process: with several workers every worker reports its
+# own numbers and the scraper sees whichever one answered. The state of the
+# scheduled jobs and of the metrics outbox is the exception: it is read from
+# the database on every scrape, since the jobs run in one process only.
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._samples(items))
+        return lines
+
+    def _samples(self, items):
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                for key, value in items]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        # gauges may also go down, amount can be negative
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    def _samples(self, items):
+        names = self.label_names + ('le',)
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket'
+                             f'{_format_labels(names, key + (_format_value(bound),))} '
+                             f'{cumulative}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+http_requests = Counter(
+    'vendorms_http_requests_total', 'HTTP requests by route, method and status.',
+    ('route', 'method', 'status'))
+http_request_duration = Histogram(
+    'vendorms_http_request_duration_seconds', 'HTTP request latency by route and method.',
+    ('route', 'method'))
+signal_handler_duration = Histogram(
+    'vendorms_signal_handler_duration_seconds', 'Execution time of model signal handlers.',
+    ('handler',))
+vendor_metric_updates = Counter(
+    'vendorms_vendor_metric_updates_total',
+    'Vendors whose metrics were updated incrementally, recomputed or queued.',
+    ('mode',))
+vendor_metrics_cache_hits = Counter(
+    'vendorms_vendor_metrics_cache_hits_total',
+    'Vendor performance metrics lookups served from the cache.')
+vendor_metrics_cache_misses = Counter(
+    'vendorms_vendor_metrics_cache_misses_total',
+    'Vendor performance metrics lookups filled from the database.')
+job_runs = Counter(
+    'vendorms_job_runs_total', 'Runs of scheduled jobs by outcome.', ('job', 'outcome'))
+scheduler_leader = Gauge(
+    'vendorms_scheduler_leader', '1 if this process holds the scheduler lease.')
+
+
+def _latest_runs(runs):
+    # the most recently finished of runs for each job
+    return runs.filter(pk=Subquery(runs.filter(job=OuterRef('job'))
+                                   .order_by('-finished_at', '-pk').values('pk')[:1]))
+
+
+class DatabaseGauges:
+    """
+    Gauges of the scheduled jobs and the metrics outbox, read from their
+    JobRun and MetricsOutbox rows when rendered, so that every process
+    reports the runs of whichever process held the scheduler lease"""
+
+    def render(self):
+        last_duration = Gauge('vendorms_job_last_duration_seconds',
+                              'Duration of the last finished run of a job.', ('job',))
+        last_rows = Gauge('vendorms_job_last_rows',
+                          'Rows written by the last successful run of a job.', ('job',))
+        last_success = Gauge('vendorms_job_last_success_timestamp_seconds',
+                             'Unix time at which a job last finished successfully.', ('job',))
+        outbox_lag = Gauge('vendorms_metrics_outbox_lag_seconds',
+                           'Age of the oldest queued metrics outbox event, 0 when empty.')
+
+        finished = JobRun.objects.filter(status__in=('succeeded', 'failed'),
+                                         finished_at__isnull=False, started_at__isnull=False)
+        for job, started_at, finished_at in _latest_runs(finished).values_list(
+                'job', 'started_at', 'finished_at'):
+            last_duration.set((finished_at - started_at).total_seconds(), job=job)
+        for job, rows, finished_at in _latest_runs(finished.filter(status='succeeded')) \
+                .values_list('job', 'rows', 'finished_at'):
+            last_rows.set(rows or 0, job=job)
+            last_success.set(finished_at.timestamp(), job=job)
+        oldest = MetricsOutbox.objects.aggregate(oldest=Min('created_at'))['oldest']
+        outbox_lag.set((timezone.now() - oldest).total_seconds() if oldest else 0.0)
+
+        lines = []
+        for gauge in (last_duration, last_rows, last_success, outbox_lag):
+            lines.extend(gauge.render())
+        return lines
+
+
+REGISTRY = (http_requests, http_request_duration, signal_handler_duration,
+            vendor_metric_updates, vendor_metrics_cache_hits, vendor_metrics_cache_misses,
+            job_runs, scheduler_leader, DatabaseGauges())
+
+
+def render():
+    """
+    Return every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def route_of(request):
+    # URL name of the matched route, bounded unlike the path
+    match = getattr(request, 'resolver_match', None)
+    return (match.url_name or match.route) if match else 'unmatched'
+
+
+def observe_request(request, response, seconds):
+    route = route_of(request)
+    http_requests.inc(route=route, method=request.method, status=response.status_code)
+    http_request_duration.observe(seconds, route=route, method=request.method)
+
+
+class RequestMetricsMiddleware:
+    """
+    Counts requests and records their latency per route. Runs natively in
+    both sync and async handlers, so it adds no thread switch under ASGI."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        observe_request(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        observe_request(request, response, time.perf_counter() - started)
+        return response
+
+
+def timed_handler(handler):
+    """
+    Decorator recording the execution time of a signal handler"""
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            signal_handler_duration.observe(time.perf_counter() - started,
+                                            handler=handler.__name__)
+    return wrapper
+
+
+def timed_job(name):
+    """
+    Decorator counting the outcomes of a job's runs in this process. Their
+    duration and rows are served from the JobRun rows, see DatabaseGauges"""
+    def decorator(job):
+        @functools.wraps(job)
+        def wrapper(*args, **kwargs):
+            try:
+                rows = job(*args, **kwargs)
+            except Exception:
+                job_runs.inc(job=name, outcome='failure')
+                raise
+            job_runs.inc(job=name, outcome='success')
+            return rows
+        return wrapper
+    return decorator
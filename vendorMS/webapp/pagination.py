@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PrimaryKeyCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key.
+
+    Page size defaults to PAGE_SIZE in settings.REST_FRAMEWORK and can be
+    set per request with ?page_size= up to max_page_size."""
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,182 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Opt-in request profiling, enabled with settings.PROFILING_ENABLED. For
+# every request the middleware records the wall time, the time spent in
+# database queries, the number of queries and how many of them repeated an
+# earlier query of the same request with the same parameters. The numbers
+# are sent back as a Server-Timing header, logged as one JSON line and added
+# to per endpoint histograms of this process.
+
+# Upper bounds in milliseconds of the latency histogram buckets
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_lock = threading.Lock()
+_endpoints = {}
+
+# cProfile allows one active profiler per process (enabling a second one
+# from another thread fails on Python 3.12+), so sampled requests take this
+# lock and go unprofiled while another request holds it
+_profiler_lock = threading.Lock()
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper timing each query of a request"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            self.statements[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values())
+
+
+class ProfilingMiddleware:
+    """
+    Records the timings of each request, see the comment at the top of this
+    module. A fraction settings.PROFILING_SAMPLE_RATE of the requests also
+    runs under cProfile, one request at a time; the profile is written to
+    settings.PROFILING_DIR, or logged as the slowest functions when it is
+    not set.
+
+    Streaming responses are measured until their first chunk is ready."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        profiler = (cProfile.Profile()
+                    if random.random() < settings.PROFILING_SAMPLE_RATE
+                    and _profiler_lock.acquire(blocking=False) else None)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            if profiler:
+                stack.callback(_profiler_lock.release)
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler:
+                    profiler.disable()
+        total_ms = (time.perf_counter() - started) * 1000
+        db_ms = recorder.seconds * 1000
+
+        endpoint = endpoint_name(request)
+        record(endpoint, total_ms, db_ms, recorder.count, recorder.duplicates)
+        response['Server-Timing'] = (
+            f'total;dur={total_ms:.1f}, db;dur={db_ms:.1f};desc="{recorder.count} queries", '
+            f'app;dur={total_ms - db_ms:.1f}')
+        line = {
+            'method': request.method, 'path': request.path, 'endpoint': endpoint,
+            'status': response.status_code, 'total_ms': round(total_ms, 3),
+            'db_ms': round(db_ms, 3), 'queries': recorder.count,
+            'duplicate_queries': recorder.duplicates,
+        }
+        if profiler:
+            line['profile'] = save_profile(profiler, endpoint)
+        logger.info(json.dumps(line))
+        return response
+
+
+def endpoint_name(request):
+    """
+    Name of the endpoint a request was routed to: the method and URL name,
+    e.g. 'GET vendor-detail'"""
+    match = request.resolver_match
+    if match is None:
+        return f'{request.method} unresolved'
+    return f'{request.method} {match.view_name or match.route}'
+
+
+def save_profile(profiler, endpoint):
+    # Path of the written .prof file, or the top functions by cumulative time
+    directory = settings.PROFILING_DIR
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{}-{}.prof'.format(
+            time.time_ns(), ''.join(c if c.isalnum() else '_' for c in endpoint)))
+        profiler.dump_stats(path)
+        return path
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(20)
+    return output.getvalue()
+
+
+def record(endpoint, total_ms, db_ms, queries, duplicates):
+    """
+    Add a request to the histograms of its endpoint"""
+    with _lock:
+        stats = _endpoints.get(endpoint)
+        if stats is None:
+            stats = _endpoints[endpoint] = {
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'db_ms': 0.0,
+                'queries': 0, 'duplicate_queries': 0,
+                'buckets': [0] * (len(HISTOGRAM_BUCKETS) + 1),
+            }
+        stats['count'] += 1
+        stats['total_ms'] += total_ms
+        stats['max_ms'] = max(stats['max_ms'], total_ms)
+        stats['db_ms'] += db_ms
+        stats['queries'] += queries
+        stats['duplicate_queries'] += duplicates
+        index = next((i for i, bound in enumerate(HISTOGRAM_BUCKETS) if total_ms <= bound),
+                     len(HISTOGRAM_BUCKETS))
+        stats['buckets'][index] += 1
+
+
+def profiling_stats():
+    """
+    Return the per endpoint statistics of this process: request count,
+    mean and max latency, mean database time, queries and duplicate queries
+    per request, and the latency histogram as {upper bound in ms: count}"""
+    with _lock:
+        endpoints = {name: dict(stats, buckets=list(stats['buckets']))
+                     for name, stats in _endpoints.items()}
+    result = {}
+    for name, stats in sorted(endpoints.items()):
+        count = stats['count']
+        result[name] = {
+            'count': count,
+            'mean_ms': round(stats['total_ms'] / count, 3),
+            'max_ms': round(stats['max_ms'], 3),
+            'mean_db_ms': round(stats['db_ms'] / count, 3),
+            'queries_per_request': round(stats['queries'] / count, 2),
+            'duplicate_queries_per_request': round(stats['duplicate_queries'] / count, 2),
+            'histogram': dict(zip([str(bound) for bound in HISTOGRAM_BUCKETS] + ['+Inf'],
+                                  stats['buckets'])),
+        }
+    return result
+
+
+def reset_profiling_stats():
+    with _lock:
+        _endpoints.clear()
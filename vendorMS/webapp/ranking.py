@@ -0,0 +1,141 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, Rank
+
+from .models import METRIC_FIELDS, Vendor, VendorRank
+
+# Precomputed vendor rankings
+#
+# VendorRank keeps the rank of every vendor by each metric, so the rank of
+# one vendor is a unique index lookup. A vendor is ranked by a metric once
+# the metric has a denominator, e.g. the on-time delivery rate once it has
+# a completed purchase order. Ranks are competition ranks (1, 2, 2, 4) over
+# a score which is the metric value, negated where lower is better.
+#
+# When a vendor's score moves from old to new, only the vendors scored in
+# between change rank, by one, so a change costs one range UPDATE on the
+# (metric, score) index plus the write of the vendor's own row, which
+# counts its rank in the same statement. Changes are applied after the
+# transaction changing the metrics commits; a failed refresh is logged
+# rather than failing the request, and repaired by recompute_metrics,
+# which rebuilds every ranking.
+
+# metric -> (counter which must be positive to rank, lower is better)
+RANKED_METRICS = {
+    'on_time_delivery_rate': ('completed_po_count', False),
+    'quality_rating_avg': ('rated_po_count', False),
+    'average_response_time': ('acknowledged_po_count', True),
+    'fulfillment_rate': ('total_po_count', False),
+}
+
+ELIGIBILITY_FIELDS = tuple(counter for counter, _ in RANKED_METRICS.values())
+
+
+def score_of(metric, row):
+    """
+    Return the ranking score of a vendor row by metric, or None when the
+    vendor is not ranked by it"""
+    counter, lower_is_better = RANKED_METRICS[metric]
+    if not row[counter]:
+        return None
+    return -row[metric] if lower_is_better else row[metric]
+
+
+def schedule_refresh(vendor_ids):
+    """
+    Refresh the rankings of the given vendors when the current transaction
+    commits"""
+    vendor_ids = list(vendor_ids)
+    if vendor_ids:
+        transaction.on_commit(lambda: refresh_rankings(vendor_ids), robust=True)
+
+
+def refresh_rankings(vendor_ids):
+    """
+    Bring the ranks of the given vendors, and of the vendors ranked between
+    their old and new scores, up to date with the stored metrics. Larger
+    sets than RANKING_REBUILD_THRESHOLD rebuild every ranking instead."""
+    if len(vendor_ids) > settings.RANKING_REBUILD_THRESHOLD:
+        rebuild_rankings()
+        return
+    with transaction.atomic():
+        # the stored scores are read along with the metrics, one query
+        stored_scores = {f'{metric}__stored': Subquery(VendorRank.objects.filter(
+            vendor_id=OuterRef('pk'), metric=metric).values('score')) for metric in RANKED_METRICS}
+        rows = {row['pk']: row for row in Vendor.objects.filter(pk__in=vendor_ids)
+                .values('pk', *METRIC_FIELDS, *ELIGIBILITY_FIELDS, **stored_scores)}
+        stored = {(vendor_id, metric): row[f'{metric}__stored']
+                  for vendor_id, row in rows.items() for metric in RANKED_METRICS}
+        deleted = set(vendor_ids) - set(rows)
+        if deleted:
+            stored.update(((vendor_id, metric), score) for vendor_id, metric, score in
+                          VendorRank.objects.filter(vendor_id__in=deleted)
+                          .values_list('vendor_id', 'metric', 'score'))
+        for vendor_id in vendor_ids:
+            row = rows.get(vendor_id)
+            for metric in RANKED_METRICS:
+                old = stored.get((vendor_id, metric))
+                new = score_of(metric, row) if row else None
+                if old != new:
+                    _move(vendor_id, metric, old, new)
+
+
+def _move(vendor_id, metric, old, new):
+    # Vendors scored between old and new gain or lose the vendor above them
+    others = VendorRank.objects.filter(metric=metric).exclude(vendor_id=vendor_id)
+    if old is None:
+        others.filter(score__lt=new).update(rank=F('rank') + 1)
+    elif new is None:
+        others.filter(score__lt=old).update(rank=F('rank') - 1)
+    elif new > old:
+        others.filter(score__gte=old, score__lt=new).update(rank=F('rank') + 1)
+    else:
+        others.filter(score__gte=new, score__lt=old).update(rank=F('rank') - 1)
+
+    own = VendorRank.objects.filter(vendor_id=vendor_id, metric=metric)
+    if new is None:
+        own.delete()
+    elif old is None:
+        VendorRank.objects.create(vendor_id=vendor_id, metric=metric, score=new,
+                                  rank=others.filter(score__gt=new).count() + 1)
+    else:
+        # the rank is counted within the UPDATE
+        above = (others.filter(score__gt=new).order_by()
+                 .values('metric').annotate(count=Count('pk')).values('count'))
+        own.update(score=new, rank=Coalesce(Subquery(above), 0) + 1)
+
+
+def rebuild_rankings():
+    """
+    Recompute every ranking from the stored vendor metrics with one ranked
+    query per metric"""
+    with transaction.atomic():
+        VendorRank.objects.all().delete()
+        for metric, (counter, lower_is_better) in RANKED_METRICS.items():
+            order = F(metric).asc() if lower_is_better else F(metric).desc()
+            rows = (Vendor.objects.filter(**{f'{counter}__gt': 0})
+                    .annotate(rank=Window(Rank(), order_by=order))
+                    .values_list('pk', metric, 'rank'))
+            VendorRank.objects.bulk_create(
+                [VendorRank(vendor_id=pk, metric=metric, rank=rank,
+                            score=-value if lower_is_better else value)
+                 for pk, value, rank in rows.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)],
+                batch_size=settings.BULK_WRITE_CHUNK_SIZE)
+
+
+def ranked_counts():
+    """
+    Return {metric: number of ranked vendors}"""
+    counts = dict.fromkeys(RANKED_METRICS, 0)
+    counts.update(VendorRank.objects.order_by().values_list('metric')
+                  .annotate(count=Count('pk')).values_list('metric', 'count'))
+    return counts
+
+
+def percentile(rank, count):
+    """
+    Percentage of the other ranked vendors which rank below rank"""
+    if count <= 1:
+        return 100.0
+    return round(100.0 * (count - rank) / (count - 1), 2)
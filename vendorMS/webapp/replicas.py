@@ -0,0 +1,175 @@
+import contextlib
+import hashlib
+import logging
+import random
+import sqlite3
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+# Read replica routing
+#
+# settings.DATABASE_REPLICAS names database aliases holding copies of the
+# primary ('default'). ReplicaRoutingMiddleware pins each request to one
+# database: GET and HEAD requests read from a randomly chosen replica, other
+# requests use the primary for their reads and writes, so the signal driven
+# metric updates read the rows they change from the primary. Code running
+# outside a request (commands, the scheduler, the metrics worker) always
+# uses the primary.
+#
+# Replicas lag behind the primary, so a client which wrote is kept on the
+# primary for REPLICA_STICKY_SECONDS afterwards and reads its own writes.
+# Clients are told apart by their credentials; the marks are kept in the
+# REPLICA_STICKY_CACHE cache, which has to be shared for stickiness to hold
+# across processes.
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+KEY_PREFIX = 'replica-sticky'
+
+_pinned = ContextVar('vendorms_database', default=None)
+
+
+@contextlib.contextmanager
+def pinned_to(alias):
+    """
+    Route the reads of the enclosed code to the alias database"""
+    token = _pinned.set(alias)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def use_primary():
+    """
+    Read from the primary in the enclosed code, e.g. to read a row right
+    after writing it in a GET request"""
+    return pinned_to(DEFAULT_DB_ALIAS)
+
+
+class ReplicaRouter:
+    """
+    Sends writes to the primary and reads to the database the current
+    request is pinned to. Reads inside a transaction on the primary stay
+    on the primary."""
+
+    def db_for_read(self, model, **hints):
+        alias = _pinned.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # every database holds the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema with the data from the primary
+        return db not in settings.DATABASE_REPLICAS
+
+
+def _client_key(request):
+    credentials = (request.META.get('HTTP_AUTHORIZATION')
+                   or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+                   or request.META.get('REMOTE_ADDR', ''))
+    return f'{KEY_PREFIX}:{hashlib.sha256(credentials.encode()).hexdigest()[:32]}'
+
+
+def _sticky_cache():
+    return caches[settings.REPLICA_STICKY_CACHE]
+
+
+def _pinned_stream(alias, content):
+    # Streamed bodies, like the exports, are read after the middleware
+    # returned: each chunk is produced with the request's database pinned
+    content = iter(content)
+    while True:
+        with pinned_to(alias):
+            chunk = next(content, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _pin_stream(alias, response):
+    if response.streaming and not response.is_async:
+        response.streaming_content = _pinned_stream(alias, response.streaming_content)
+    return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Pins each request to a database for ReplicaRouter and marks the clients
+    which wrote. Runs natively in both sync and async handlers."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        key = _client_key(request)
+        if request.method not in SAFE_METHODS:
+            with use_primary():
+                response = self.get_response(request)
+            _sticky_cache().set(key, True, settings.REPLICA_STICKY_SECONDS)
+            return response
+        alias = (DEFAULT_DB_ALIAS if _sticky_cache().get(key)
+                 else random.choice(settings.DATABASE_REPLICAS))
+        with pinned_to(alias):
+            return _pin_stream(alias, self.get_response(request))
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        key = _client_key(request)
+        if request.method not in SAFE_METHODS:
+            with use_primary():
+                response = await self.get_response(request)
+            await _sticky_cache().aset(key, True, settings.REPLICA_STICKY_SECONDS)
+            return response
+        alias = (DEFAULT_DB_ALIAS if await _sticky_cache().aget(key)
+                 else random.choice(settings.DATABASE_REPLICAS))
+        with pinned_to(alias):
+            return _pin_stream(alias, await self.get_response(request))
+
+
+def sync_replicas(aliases=None):
+    """
+    Copy the primary SQLite database into each replica with the SQLite
+    online backup API, which gives a consistent copy while the primary is
+    written to. Returns {alias: seconds taken}."""
+    primary = connections[DEFAULT_DB_ALIAS].settings_dict
+    timings = {}
+    for alias in aliases or settings.DATABASE_REPLICAS:
+        replica = connections[alias].settings_dict
+        if 'sqlite3' not in primary['ENGINE'] or 'sqlite3' not in replica['ENGINE']:
+            raise ValueError(f"{alias}: only SQLite replicas are copied, other databases "
+                             "are kept up to date by their own replication.")
+        started = time.monotonic()
+        source = sqlite3.connect(primary['NAME'])
+        target = sqlite3.connect(replica['NAME'], timeout=replica['OPTIONS'].get('timeout', 5))
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        timings[alias] = time.monotonic() - started
+        logger.info("Copied the primary database to %s in %.2fs", alias, timings[alias])
+    return timings
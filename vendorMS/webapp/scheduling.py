@@ -0,0 +1,192 @@
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from . import monitoring
+from .archive import archive_purchase_orders
+from .metrics_queue import run_worker
+from .models import JobRun, SchedulerLease
+from .sharding import parallel_snapshot
+from .snapshots import take_performance_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Scheduled jobs, safe to start in any number of processes. Every scheduler
+# process ticks every SCHEDULER_TICK_SECONDS and tries to take the
+# SchedulerLease; only the process holding it runs jobs, and it renews the
+# lease on every tick. Each window of a windowed job is additionally claimed
+# through its unique JobRun row, so a window is never run twice even when a
+# lease expires while its holder is still busy.
+#
+# After downtime the latest missed window of a job is run on the next tick.
+# Older missed windows are recorded as skipped: the snapshot records the
+# current metrics, so running them late would only duplicate that window.
+# Job functions are called with the start of the window they run for.
+
+LEASE_NAME = 'scheduler'
+
+# Weekly Performance snapshot: every Sunday at 12:00 AM local time
+SNAPSHOT_JOB = 'update_performance'
+SNAPSHOT_WEEKDAY = 6
+
+# Purchase order archive, in the same weekly windows when ARCHIVE_AFTER_DAYS is set
+ARCHIVE_JOB = 'archive_purchase_orders'
+
+
+def update_performance(window):
+    # Rows are deduplicated within the window being run, not the current
+    # week, so a late catch-up does not count for the window after it
+    period = (window, next_window(window))
+    # sharded over worker processes when PARALLEL_WORKERS > 1
+    if settings.PARALLEL_WORKERS > 1:
+        return parallel_snapshot(window=period)
+    return take_performance_snapshot(window=period)
+
+
+def archive_closed_purchase_orders(window):
+    return archive_purchase_orders()
+
+
+def process_owner():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def acquire_lease(owner, seconds=None, name=LEASE_NAME):
+    """
+    Take or renew the lease for owner. Returns True while owner holds it."""
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=seconds or settings.SCHEDULER_LEASE_SECONDS)
+    if SchedulerLease.objects.filter(Q(owner=owner) | Q(expires_at__lt=now), name=name).update(
+            owner=owner, expires_at=expires_at):
+        return True
+    try:
+        with transaction.atomic():
+            SchedulerLease.objects.create(name=name, owner=owner, expires_at=expires_at)
+    except IntegrityError:
+        return False
+    return True
+
+
+def release_lease(owner, name=LEASE_NAME):
+    SchedulerLease.objects.filter(name=name, owner=owner).delete()
+
+
+def snapshot_window(moment):
+    """
+    Return the latest weekly snapshot window at or before moment"""
+    local = timezone.localtime(moment)
+    days = (local.weekday() - SNAPSHOT_WEEKDAY) % 7
+    day = local.date() - timedelta(days=days)
+    return timezone.make_aware(datetime(day.year, day.month, day.day))
+
+
+def next_window(window):
+    """
+    Return the weekly window following window"""
+    # stepped in local time so the hour stays put across DST changes
+    local = timezone.localtime(window).replace(tzinfo=None)
+    return timezone.make_aware(local + timedelta(days=7))
+
+
+def due_windows(job, latest):
+    """
+    Return the windows of job after its last recorded run, up to and
+    including latest, in order. Without any recorded run only latest is due."""
+    last = JobRun.objects.filter(job=job).aggregate(last=Max('window'))['last']
+    if last is None:
+        return [latest]
+    windows = []
+    window = last
+    while True:
+        window = next_window(window)
+        if window > latest:
+            return windows
+        windows.append(window)
+
+
+def claim_run(job, window, owner):
+    """
+    Start the run of a window. Returns the JobRun, or None if the window is
+    already done, running in another process or out of attempts."""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return JobRun.objects.create(job=job, window=window, owner=owner, status='running',
+                                         started_at=now, attempts=1)
+    except IntegrityError:
+        pass
+    # a failed run is retried, a run older than the timeout is taken over
+    retry = (Q(status='failed', attempts__lt=settings.SCHEDULER_MAX_ATTEMPTS)
+             | Q(status='running',
+                 started_at__lt=now - timedelta(seconds=settings.SCHEDULER_JOB_TIMEOUT)))
+    if JobRun.objects.filter(retry, job=job, window=window).update(
+            status='running', owner=owner, started_at=now, finished_at=None, error='',
+            attempts=F('attempts') + 1):
+        return JobRun.objects.get(job=job, window=window)
+    return None
+
+
+def run_window(job, window, func, owner):
+    """
+    Run func(window) for one window of job and record the outcome in its JobRun"""
+    run = claim_run(job, window, owner)
+    if run is None:
+        return None
+    try:
+        run.rows = monitoring.timed_job(job)(func)(window)
+        run.status = 'succeeded'
+    except Exception as exc:
+        logger.exception("Job %s failed for window %s", job, window)
+        run.status = 'failed'
+        run.error = f'{type(exc).__name__}: {exc}'
+    run.finished_at = timezone.now()
+    run.save(update_fields=['status', 'rows', 'error', 'finished_at'])
+    return run
+
+
+def run_windowed_job(job, func, latest, owner):
+    """
+    Run the due windows of job: skip all missed windows but the latest,
+    then run that one"""
+    windows = due_windows(job, latest)
+    if len(windows) > 1:
+        JobRun.objects.bulk_create(
+            [JobRun(job=job, window=window, status='skipped', owner=owner,
+                    error=f'Missed, superseded by the window of {windows[-1].isoformat()}.')
+             for window in windows[:-1]], ignore_conflicts=True)
+        logger.warning("Job %s skipped %d missed windows", job, len(windows) - 1)
+    # the latest window is also retried here while it has attempts left
+    return run_window(job, windows[-1] if windows else latest, func, owner)
+
+
+def tick(owner=None, now=None):
+    """
+    One scheduler tick: run the due jobs if this process holds the lease.
+    Returns True if it did."""
+    owner = owner or process_owner()
+    leader = acquire_lease(owner)
+    monitoring.scheduler_leader.set(int(leader))
+    if not leader:
+        return False
+    window = snapshot_window(now or timezone.now())
+    run_windowed_job(SNAPSHOT_JOB, update_performance, window, owner)
+    if settings.ARCHIVE_AFTER_DAYS is not None:
+        run_windowed_job(ARCHIVE_JOB, archive_closed_purchase_orders, window, owner)
+    if settings.METRICS_MODE == 'async':
+        monitoring.timed_job('process_metrics_queue')(run_worker)()
+    return True
+
+
+def tick_interval():
+    """
+    Seconds between ticks; the async metrics outbox is drained twice per
+    staleness window"""
+    if settings.METRICS_MODE == 'async':
+        return min(settings.SCHEDULER_TICK_SECONDS, settings.METRICS_MAX_STALENESS / 2)
+    return settings.SCHEDULER_TICK_SECONDS
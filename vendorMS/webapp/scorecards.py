@@ -0,0 +1,80 @@
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+
+from .metrics import SECONDS_PER_DAY, SecondsBetween
+from .models import METRIC_FIELDS, ArchivedPurchaseOrder, Performance, PurchaseOrder, Vendor
+
+# Vendor scorecards: the live metrics of a vendor next to its purchase order
+# statistics and its latest Performance snapshot. A page of scorecards costs
+# four queries whatever its size: the vendors, annotated with the id of
+# their latest snapshot through a correlated subquery on the (vendor, date)
+# index; one conditional aggregation over the live and one over the archived
+# purchase orders of the page; and the snapshot rows fetched by primary key.
+
+
+def scorecard_vendors():
+    """
+    Vendor queryset loading the columns of a scorecard, annotated with
+    latest_performance_id"""
+    latest = (Performance.objects.filter(vendor=OuterRef('pk'))
+              .order_by('-date', '-pk').values('pk')[:1])
+    return (Vendor.objects.only('id', 'name', 'vendor_code', *METRIC_FIELDS)
+            .annotate(latest_performance_id=Subquery(latest)))
+
+
+def purchase_order_stats(vendor_ids):
+    """
+    Return {vendor id: purchase order statistics} for the given vendors,
+    computed with one GROUP BY query over the live and one over the archived
+    purchase orders. Lead time is the mean time from order_date to
+    delivery_date in days of the completed purchase orders, the only ones
+    whose delivery_date is the actual delivery rather than the promised
+    one, and None without any."""
+    stats = {}
+    for model in (PurchaseOrder, ArchivedPurchaseOrder):
+        rows = (model.objects.filter(vendor_id__in=vendor_ids).order_by()
+                .values('vendor_id').annotate(
+                    open=Count('pk', filter=Q(status='pending')),
+                    completed=Count('pk', filter=Q(status='completed')),
+                    canceled=Count('pk', filter=Q(status='canceled')),
+                    total=Count('pk'),
+                    total_quantity=Sum('quantity'),
+                    lead_time_sum=Sum(SecondsBetween('delivery_date', 'order_date'),
+                                      filter=Q(status='completed')),
+                ))
+        for row in rows:
+            vendor_stats = stats.setdefault(row.pop('vendor_id'), dict.fromkeys(row, 0))
+            for field, value in row.items():
+                vendor_stats[field] += value or 0
+    for vendor_stats in stats.values():
+        lead_time_sum = vendor_stats.pop('lead_time_sum')
+        vendor_stats['average_lead_time'] = round(
+            lead_time_sum / vendor_stats['completed'] / SECONDS_PER_DAY, 2
+        ) if vendor_stats['completed'] else None
+    return stats
+
+
+def build_scorecards(vendors):
+    """
+    Build the scorecards of vendors loaded from scorecard_vendors()"""
+    vendor_ids = [vendor.pk for vendor in vendors]
+    stats = purchase_order_stats(vendor_ids)
+    performances = Performance.objects.in_bulk(
+        [vendor.latest_performance_id for vendor in vendors
+         if vendor.latest_performance_id is not None])
+    empty = {'open': 0, 'completed': 0, 'canceled': 0, 'total': 0,
+             'total_quantity': 0, 'average_lead_time': None}
+    scorecards = []
+    for vendor in vendors:
+        performance = performances.get(vendor.latest_performance_id)
+        scorecards.append({
+            'id': vendor.pk,
+            'name': vendor.name,
+            'vendor_code': vendor.vendor_code,
+            'metrics': {field: getattr(vendor, field) for field in METRIC_FIELDS},
+            'purchase_orders': stats.get(vendor.pk, empty),
+            'latest_performance': {
+                'date': performance.date,
+                **{field: getattr(performance, field) for field in METRIC_FIELDS},
+            } if performance else None,
+        })
+    return scorecards
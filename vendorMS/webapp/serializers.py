@@ -1,26 +1,172 @@
 from rest_framework import serializers
-from .models import Vendor, PurchaseOrder, Performance
+from rest_framework.validators import UniqueValidator
+from .models import ArchivedPurchaseOrder, Vendor, PurchaseOrder, Performance
+from . import metrics
+from .metrics import COUNTER_FIELDS
 
 
-class VendorSerializer(serializers.ModelSerializer):
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer taking an optional 'fields' argument which limits the
+    serialized fields to the given names"""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class VendorSerializer(DynamicFieldsModelSerializer):
     """
     Serializer for Vendor model"""
     class Meta:
         model = Vendor
-        fields = '__all__'
+        exclude = COUNTER_FIELDS
         read_only_fields = ('on_time_delivery_rate',
                             'quality_rating_avg',
                             'average_response_time',
                             'fulfillment_rate',)
 
 
-class PurchaseOrderSerializer(serializers.ModelSerializer):
+class VendorLookupField(serializers.PrimaryKeyRelatedField):
+    """
+    Vendor primary key field which resolves vendors from the preloaded
+    'vendors' map in the serializer context when there is one"""
+
+    def to_internal_value(self, data):
+        vendors = self.context.get('vendors')
+        if vendors is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return vendors[int(data)]
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+
+class PurchaseOrderListSerializer(serializers.ListSerializer):
+    """
+    Serializer for bulk upserts of PurchaseOrder rows keyed on po_number.
+
+    Rows are validated independently so invalid rows can be rejected
+    without failing the whole batch. Existing purchase orders and vendors
+    are loaded up front instead of once per row."""
+
+    UPSERT_FIELDS = ('vendor', 'order_date', 'delivery_date', 'items', 'quantity',
+                     'status', 'quality_rating', 'issue_date', 'delivered_on_time')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.existing = {}
+
+    def run_child_validation(self, data):
+        po_number = data.get('po_number') if isinstance(data, dict) else None
+        # existing is keyed on the po_number strings, as upsert looks them up
+        self.child.instance = (self.existing.get(str(po_number))
+                               if po_number is not None else None)
+        self.child.initial_data = data
+        return super().run_child_validation(data)
+
+    def validate_rows(self):
+        """
+        Validate every row and return (valid, rejected).
+
+        valid is a list of validated data, rejected a list of
+        {'index', 'po_number', 'errors'} reports."""
+        rows = self.initial_data
+        if not isinstance(rows, list):
+            raise serializers.ValidationError(
+                self.error_messages['not_a_list'].format(input_type=type(rows).__name__))
+
+        mappings = [row for row in rows if isinstance(row, dict)]
+        po_numbers = {str(row['po_number']) for row in mappings
+                      if row.get('po_number') is not None}
+        self.existing = PurchaseOrder.objects.in_bulk(po_numbers, field_name='po_number')
+        self.context['archived_po_numbers'] = set(
+            ArchivedPurchaseOrder.objects.filter(po_number__in=po_numbers)
+            .values_list('po_number', flat=True))
+        self.context['vendors'] = Vendor.objects.in_bulk(
+            {int(row['vendor']) for row in mappings if str(row.get('vendor')).isdigit()})
+        # po_number uniqueness is resolved against self.existing instead
+        po_number = self.child.fields['po_number']
+        po_number.validators = [v for v in po_number.validators
+                                if not isinstance(v, UniqueValidator)]
+
+        valid, rejected, seen = [], [], set()
+        for index, row in enumerate(rows):
+            try:
+                data = self.run_child_validation(row)
+                if data['po_number'] in seen:
+                    raise serializers.ValidationError(
+                        {'po_number': ["Duplicate po_number in request."]})
+            except serializers.ValidationError as exc:
+                rejected.append({'index': index,
+                                 'po_number': row.get('po_number') if isinstance(row, dict) else None,
+                                 'errors': exc.detail})
+                continue
+            seen.add(data['po_number'])
+            valid.append(data)
+        return valid, rejected
+
+    def upsert(self, rows, chunk_size):
+        """
+        Write validated rows with bulk_create/bulk_update in chunks and update
+        vendor metrics once per chunk. Returns (created, updated) po_numbers."""
+        created, updated = [], []
+        for start in range(0, len(rows), chunk_size):
+            new, changed, changes = [], [], []
+            for data in rows[start:start + chunk_size]:
+                instance = self.existing.get(data['po_number'])
+                if instance is None:
+                    before = None
+                    instance = PurchaseOrder(**data)
+                    new.append(instance)
+                else:
+                    before = metrics.snapshot_of(instance)
+                    for field, value in data.items():
+                        setattr(instance, field, value)
+                    changed.append(instance)
+                metrics.prepare_save(instance, before)
+                changes.append((before, instance))
+
+            PurchaseOrder.objects.bulk_create(new)
+            PurchaseOrder.objects.bulk_update(changed, self.UPSERT_FIELDS)
+            metrics.apply_changes((before, metrics.snapshot_of(instance))
+                                  for before, instance in changes)
+            created += [instance.po_number for instance in new]
+            updated += [instance.po_number for instance in changed]
+        return created, updated
+
+
+class PurchaseOrderSerializer(DynamicFieldsModelSerializer):
     """
     Serializer for PurchaseOrder model"""
+    vendor = VendorLookupField(queryset=Vendor.objects.all())
+    items = serializers.JSONField()
+
     class Meta:
         model = PurchaseOrder
         fields = '__all__'
-        read_only_fields = ('acknowledgment_date',)
+        read_only_fields = ('acknowledgment_date', 'delivered_on_time',)
+        list_serializer_class = PurchaseOrderListSerializer
+
+    def validate_po_number(self, value):
+        # po_numbers of archived purchase orders stay taken, looked up in the
+        # preloaded 'archived_po_numbers' set of a bulk request if there is one.
+        # Checked on updates too, or a rename could take an archived number
+        if self.instance is not None and value == self.instance.po_number:
+            return value
+        archived = self.context.get('archived_po_numbers')
+        if (value in archived if archived is not None
+                else ArchivedPurchaseOrder.objects.filter(po_number=value).exists()):
+            raise serializers.ValidationError(
+                "A purchase order with this po_number is archived.")
+        return value
 
     def validate_quantity(self, value):
         if value <= 0:
@@ -34,6 +180,26 @@ class PurchaseOrderSerializer(serializers.ModelSerializer):
         return value
 
 
+class PurchaseOrderSelectionSerializer(serializers.Serializer):
+    """
+    Serializer for selecting purchase orders by ids or po_numbers"""
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False,
+                                allow_empty=False)
+    po_numbers = serializers.ListField(child=serializers.CharField(), required=False,
+                                       allow_empty=False)
+
+    def validate(self, attrs):
+        if len(attrs) != 1:
+            raise serializers.ValidationError(
+                "Provide either ids or po_numbers.")
+        return attrs
+
+    def get_queryset(self):
+        if 'ids' in self.validated_data:
+            return PurchaseOrder.objects.filter(pk__in=self.validated_data['ids'])
+        return PurchaseOrder.objects.filter(po_number__in=self.validated_data['po_numbers'])
+
+
 class PerformanceSerializer(serializers.ModelSerializer):
     """
     Serializer for Performance model"""
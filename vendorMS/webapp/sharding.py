@@ -0,0 +1,156 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.conf import settings
+from django.db import connections, transaction
+
+from .metrics import add_carry_overs, aggregate_counters, recompute_vendors
+from .models import ArchiveCarryOver, Vendor, PurchaseOrder
+from .ranking import rebuild_rankings
+from .snapshots import take_performance_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Parallel weekly snapshot and metric recompute. Vendors are split into
+# shards of consecutive ids, each processed by a worker process with its
+# own database connection. The coordinator merges the shard results,
+# reports progress and resubmits failed shards. Both shard tasks are
+# idempotent, so a retried shard cannot write anything twice.
+#
+# Workers are spawned rather than forked: the scheduler runs in threads of
+# web workers, where a fork may copy a lock held by another thread. With a
+# single worker the shards run in the calling process, e.g. in the tests,
+# whose in-memory database other processes cannot open.
+
+
+class ShardError(Exception):
+    """
+    Raised when shards still fail after their retries"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__("{} shards failed: {}".format(len(failures), '; '.join(
+            f'vendors {first}-{last}: {error}' for (first, last), error in failures.items())))
+
+
+def vendor_shards(shard_size=None):
+    """
+    Return (first id, last id) ranges of shard_size vendors each"""
+    shard_size = shard_size or settings.PARALLEL_SHARD_SIZE
+    ids = list(Vendor.objects.order_by('pk').values_list('pk', flat=True))
+    return [(ids[start], ids[min(start + shard_size, len(ids)) - 1])
+            for start in range(0, len(ids), shard_size)]
+
+
+def _run_in_worker(task, shard, kwargs):
+    try:
+        return task(shard, **kwargs)
+    finally:
+        connections.close_all()
+
+
+def snapshot_shard(vendor_range, window=None):
+    """
+    Snapshot task: record the Performance rows of a vendor range"""
+    return take_performance_snapshot(vendor_range=vendor_range, window=window)
+
+
+def recompute_shard(vendor_range, write=True):
+    """
+    Recompute task: aggregate the counters of a vendor range and, with
+    write, store them with the derived metrics. Returns the counters."""
+    vendor_ids = list(Vendor.objects.filter(pk__range=vendor_range)
+                      .order_by('pk').values_list('pk', flat=True))
+    first, last = vendor_range
+    in_range = {'vendor_id__gte': first, 'vendor_id__lte': last}
+    counters = add_carry_overs(aggregate_counters(PurchaseOrder.objects.filter(**in_range)),
+                               ArchiveCarryOver.objects.filter(**in_range))
+    if write:
+        with transaction.atomic():
+            counters = recompute_vendors(vendor_ids, counters=counters, rankings=False)
+    return counters
+
+
+def run_sharded(task, shards, workers=None, retries=None, progress=None, **kwargs):
+    """
+    Run task(shard, **kwargs) for every shard on a pool of workers and
+    return {shard: result}. Failed shards are resubmitted up to retries
+    times, then ShardError is raised. progress(done, total) is called after
+    each finished shard. With workers <= 1 the shards run in this process."""
+    workers = workers or settings.PARALLEL_WORKERS
+    retries = settings.PARALLEL_SHARD_RETRIES if retries is None else retries
+    results, attempts, failures = {}, dict.fromkeys(shards, 0), {}
+
+    def finished(shard, outcome, error):
+        attempts[shard] += 1
+        if error is None:
+            results[shard] = outcome
+            if progress:
+                progress(len(results), len(shards))
+            return False
+        logger.warning("Shard %s failed (attempt %d): %s", shard, attempts[shard], error)
+        if attempts[shard] > retries:
+            failures[shard] = error
+            return False
+        return True
+
+    # Failed shards are retried in a new round, on a new pool in case a
+    # worker died and broke the old one
+    pending = list(shards)
+    while pending:
+        shards_of_round, pending = pending, []
+        if workers <= 1:
+            for shard in shards_of_round:
+                try:
+                    outcome, error = task(shard, **kwargs), None
+                except Exception as exc:
+                    outcome, error = None, exc
+                if finished(shard, outcome, error):
+                    pending.append(shard)
+            continue
+        # Connections must not be shared with the workers
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards_of_round)),
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 # by reference: unpickling a function of this
+                                 # module would import the models before setup
+                                 initializer=django.setup) as executor:
+            futures = {executor.submit(_run_in_worker, task, shard, kwargs): shard
+                       for shard in shards_of_round}
+            for future in as_completed(futures):
+                error = future.exception()
+                if finished(futures[future], None if error else future.result(), error):
+                    pending.append(futures[future])
+    if failures:
+        raise ShardError(failures)
+    return results
+
+
+def parallel_snapshot(workers=None, shard_size=None, progress=None, window=None):
+    """
+    Take the weekly Performance snapshot shard by shard and return the
+    number of rows written. window is passed on to take_performance_snapshot."""
+    started = time.monotonic()
+    shards = vendor_shards(shard_size)
+    written = sum(run_sharded(snapshot_shard, shards, workers, progress=progress,
+                              window=window).values())
+    logger.info("Parallel performance snapshot wrote %d rows in %d shards in %.2fs",
+                written, len(shards), time.monotonic() - started)
+    return written
+
+
+def parallel_recompute(workers=None, shard_size=None, write=True, progress=None):
+    """
+    Rebuild the counters and metrics of every vendor shard by shard and
+    return the merged counters keyed by vendor id. The vendor rankings are
+    rebuilt once all shards are written."""
+    counters = {}
+    for shard_counters in run_sharded(recompute_shard, vendor_shards(shard_size), workers,
+                                      progress=progress, write=write).values():
+        counters.update(shard_counters)
+    if write:
+        rebuild_rankings()
+    return counters
@@ -1,9 +1,16 @@
-from .models import PurchaseOrder, Performance
-from django.db.models.signals import pre_save, post_save
+from .models import Vendor, PurchaseOrder
+from . import metrics
+from .cache import invalidate_vendor_metrics
+from .monitoring import timed_handler
+from .ranking import schedule_refresh
+from .authentication import token_cache
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from django.db.models import Sum
-from django.utils import timezone
 from rest_framework.authtoken.models import Token
 
 
@@ -11,64 +18,84 @@ from rest_framework.authtoken.models import Token
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
+    else:
+        # Cached credentials hold is_active, which may have changed. Dropped
+        # once committed, or a concurrent request could cache the old row again
+        for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+            transaction.on_commit(lambda key=key: token_cache.delete(key))
+
+
+@receiver(post_delete, sender=Token)
+def drop_cached_token(sender, instance, **kwargs):
+    # key is the primary key, which delete() clears on the instance
+    transaction.on_commit(lambda key=instance.key: token_cache.delete(key))
 
 
 @receiver(pre_save, sender=PurchaseOrder)
-def update_metrics_completed_orders(sender, instance, **kwargs):
-    try:
-        sender.objects.get(id=instance.id)
-    except sender.DoesNotExist:
+@timed_handler
+def capture_metrics_snapshot(sender, instance, raw=False, **kwargs):
+    if raw:
         return
+    # Fetch the stored row once; post_save diffs against it
+    before = metrics.fetch_snapshot(instance)
+    instance._metrics_snapshot = before
 
-    # Update quality rating
-    if (instance.quality_rating is not None and instance.status == 'completed'):
-        vendor = instance.vendor
-        new_quality_rating_avg = ((sender.objects.filter(vendor=instance.vendor, quality_rating__isnull=False).aggregate(Sum('quality_rating'))['quality_rating__sum']
-                                   + instance.quality_rating)
-                                  / sender.objects.filter(vendor=instance.vendor,
-                                                          quality_rating__isnull=False).count()+1)
-        vendor.quality_rating_avg = round(new_quality_rating_avg, 2)
-        vendor.save()
-
-    if ((sender.objects.get(id=instance.id).status != instance.status)
-            and instance.status == 'completed'):
-        number_of_total_po = sender.objects.filter(
-            vendor=instance.vendor).count()
-        vendor = instance.vendor
-
-        # Update on-time delivery rate in Percentage
-        prev_on_time_delivery = (
-            vendor.on_time_delivery_rate * number_of_total_po)/100
-        current_delivery = 1 if (sender.objects.get(
-            id=instance.id).delivery_date >= instance.delivery_date) else 0
-        vendor.on_time_delivery_rate = round(((prev_on_time_delivery + current_delivery)
-                                              / number_of_total_po)*100, 2)
-
-        # Update fulfillment rate in Percentage
-        number_of_completed_po = sender.objects.filter(
-            vendor=instance.vendor, status='completed').count()+1
-        vendor.fulfillment_rate = round(
-            (number_of_completed_po/number_of_total_po)*100, 2)
-
-        vendor.save()
-        # Update Delivery date as order is completed
-        instance.delivery_date = timezone.now()
+    # Update Delivery date as order is completed
+    metrics.prepare_save(instance, before)
 
 
-@receiver(pre_save, sender=PurchaseOrder)
-def update_response_time(sender, instance, **kwargs):
-    try:
-        sender.objects.get(id=instance.id)
-    except sender.DoesNotExist:
+@receiver(post_save, sender=PurchaseOrder)
+@timed_handler
+def update_vendor_metrics(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    metrics.apply_change(getattr(instance, '_metrics_snapshot', None),
+                         metrics.snapshot_of(instance))
+
+
+@receiver(post_delete, sender=PurchaseOrder)
+@timed_handler
+def remove_vendor_metrics(sender, instance, origin=None, **kwargs):
+    # A vendor delete cascades to its purchase orders before the vendor row
+    # goes. Its counters go with it, and an outbox event queued for it now
+    # would fail the foreign key when the vendor row is deleted
+    if instance.vendor_id in deleted_vendor_ids(origin):
+        return
+    metrics.apply_change(metrics.snapshot_of(instance), None)
+
+
+def deleted_vendor_ids(origin):
+    """
+    Primary keys of the vendors deleted by origin, the instance or queryset
+    whose delete() started the cascade"""
+    if isinstance(origin, Vendor):
+        return {origin.pk}
+    if isinstance(origin, QuerySet) and origin.model is Vendor:
+        # Queried once per delete(), the queryset is shared by the cascade
+        if not hasattr(origin, '_deleted_vendor_ids'):
+            origin._deleted_vendor_ids = set(origin.values_list('pk', flat=True))
+        return origin._deleted_vendor_ids
+    return set()
+
+
+@receiver(post_save, sender=Vendor)
+@receiver(post_delete, sender=Vendor)
+@timed_handler
+def drop_cached_vendor_metrics(sender, instance, **kwargs):
+    invalidate_vendor_metrics([instance.pk])
+
+
+@receiver(post_delete, sender=Vendor)
+@timed_handler
+def drop_vendor_ranks(sender, instance, **kwargs):
+    # VendorRank rows are not cascaded, the refresh needs their scores
+    schedule_refresh([instance.pk])
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRAGMAS:
         return
-    if ((sender.objects.get(id=instance.id).acknowledgment_date != instance.acknowledgment_date)
-            and instance.acknowledgment_date is not None):
-        current_response_time = (
-            instance.acknowledgment_date - instance.issue_date).total_seconds() / (24 * 60 * 60)
-        vendor = instance.vendor
-        new_response_time = ((vendor.average_response_time
-                              + current_response_time)
-                             / (sender.objects.filter(vendor=instance.vendor,
-                                                      acknowledgment_date__isnull=False).count() + 1))
-        vendor.average_response_time = round(new_response_time, 2)
-        vendor.save()
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,61 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import METRIC_FIELDS, Vendor, Performance
+
+logger = logging.getLogger(__name__)
+
+
+def week_start(moment):
+    """
+    Return local midnight of the Monday starting the week of moment"""
+    local = timezone.localtime(moment)
+    return (local - timedelta(days=local.weekday())).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+
+
+def take_performance_snapshot(batch_size=None, vendor_range=None, window=None):
+    """
+    Record the current metrics of every vendor in the Performance table.
+
+    Vendors are read in primary key order in batches of batch_size and
+    written with one bulk_create per batch, so memory stays bounded and the
+    write lock is released between batches. Vendors that already have a
+    Performance row dated within window, a (start, end) pair defaulting to
+    the current week, are skipped, which makes a rerun after a crash resume
+    where it stopped. vendor_range limits the snapshot to vendors with ids
+    from its first to its last value, inclusive.
+    Returns the number of rows written."""
+    batch_size = batch_size or settings.PERFORMANCE_SNAPSHOT_BATCH_SIZE
+    if window is None:
+        start = week_start(timezone.now())
+        window = (start, start + timedelta(days=7))
+    start, end = window
+    vendors = Vendor.objects.order_by('pk').values_list('pk', *METRIC_FIELDS)
+    if vendor_range:
+        vendors = vendors.filter(pk__range=vendor_range)
+
+    written = 0
+    last_pk = 0
+    started = time.monotonic()
+    while True:
+        batch = list(vendors.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+        done = set(Performance.objects.filter(
+            vendor_id__in=[row[0] for row in batch], date__gte=start, date__lt=end,
+        ).values_list('vendor_id', flat=True))
+        rows = [Performance(vendor_id=row[0], **dict(zip(METRIC_FIELDS, row[1:])))
+                for row in batch if row[0] not in done]
+        Performance.objects.bulk_create(rows)
+        written += len(rows)
+
+    elapsed = time.monotonic() - started
+    logger.info("Performance snapshot wrote %d rows in %.2fs (%.0f rows/s)",
+                written, elapsed, written / elapsed if elapsed else 0)
+    return written
@@ -1,11 +1,46 @@
-from django.urls import reverse
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import connection, connections, transaction
+from django.db.models import BinaryField, ExpressionWrapper, F, QuerySet
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import (RequestFactory, TestCase, TransactionTestCase, modify_settings,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
-from .models import Vendor, PurchaseOrder, Performance
+from .models import (METRIC_FIELDS, Vendor, PurchaseOrder, Performance, MetricsOutbox, JobRun,
+                     VendorRank, ArchivedPurchaseOrder)
+from .archive import archive_purchase_orders
+from .fields import decompress_json
+from .metrics import COUNTER_FIELDS, recompute_vendors
+from .metrics_queue import drain_outbox
+from .benchmarks import check_budgets, run_benchmarks, seed
+from .snapshots import take_performance_snapshot
+from .async_api import AsyncAPIMiddleware
+from .views.async_views import async_api_view
+from .authentication import CachedTokenAuthentication, token_cache
+from .cache import aget_vendor_metrics, cache_stats, get_vendor_metrics
+from .profiling import ProfilingMiddleware, reset_profiling_stats
+from .ranking import rebuild_rankings
+from .replicas import ReplicaRouter, ReplicaRoutingMiddleware
+from . import monitoring, profiling
+from .scheduling import SNAPSHOT_JOB, acquire_lease, snapshot_window, tick
+from .sharding import (ShardError, parallel_recompute, parallel_snapshot, run_sharded,
+                       vendor_shards)
 from django.utils import timezone
 from datetime import timedelta
+from io import StringIO
+import os
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+from unittest import mock
+import csv
+import json
 
 
 class VendorViewSetTestCase(APITestCase):
@@ -25,13 +60,28 @@ class VendorViewSetTestCase(APITestCase):
     def test_list_vendors(self):
         response = self.client.get(reverse('vendor-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], self.vendor.name)
+        results = response.data['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['name'], self.vendor.name)
         self.assertEqual(
-            response.data[0]['contact_details'], self.vendor.contact_details)
-        self.assertEqual(response.data[0]['address'], self.vendor.address)
+            results[0]['contact_details'], self.vendor.contact_details)
+        self.assertEqual(results[0]['address'], self.vendor.address)
         self.assertEqual(
-            response.data[0]['vendor_code'], self.vendor.vendor_code)
+            results[0]['vendor_code'], self.vendor.vendor_code)
+
+    def test_list_vendors_cursor_pagination(self):
+        for i in range(4):
+            Vendor.objects.create(name=f'Vendor {i}', contact_details='Details',
+                                  address='Address', vendor_code=f'Code {i}')
+        response = self.client.get(reverse('vendor-list'), {'page_size': 2})
+        self.assertEqual([row['id'] for row in response.data['results']],
+                         list(Vendor.objects.order_by('id').values_list('id', flat=True)[:2]))
+        seen = []
+        while response.data['next']:
+            seen += [row['id'] for row in response.data['results']]
+            response = self.client.get(response.data['next'])
+        seen += [row['id'] for row in response.data['results']]
+        self.assertEqual(seen, list(Vendor.objects.order_by('id').values_list('id', flat=True)))
 
     def test_retrieve_vendor(self):
         response = self.client.get(
@@ -76,6 +126,69 @@ class VendorViewSetTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Vendor.objects.count(), 0)
 
+    def test_vendor_performance_is_cached(self):
+        cache.clear()
+        url = reverse('vendor-performance', kwargs={'pk': self.vendor.pk})
+        before = cache_stats()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['fulfillment_rate'], 0.0)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        after = cache_stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PurchaseOrder.objects.create(
+                po_number='PO1', vendor=self.vendor, order_date=timezone.now(),
+                delivery_date=timezone.now(), items={}, quantity=1,
+                status='completed', issue_date=timezone.now())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['fulfillment_rate'], 100.0)
+
+    def test_token_authentication_is_cached(self):
+        url = reverse('vendor-detail', kwargs={'pk': self.vendor.pk})
+        self.client.get(url)
+        with self.assertNumQueries(1):  # vendor lookup only
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.user.is_active = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(AUTH_TOKEN_CACHE_ALIAS='default')
+    def test_token_cache_holds_ids_only(self):
+        url = reverse('vendor-detail', kwargs={'pk': self.vendor.pk})
+        self.client.get(url)
+        self.assertEqual(cache.get(f'auth-token:{self.token.key}'), (self.user.pk, True))
+
+        first = self.client.get(url).wsgi_request.user
+        second = self.client.get(url).wsgi_request.user
+        self.assertIsNot(first, second)
+        self.assertEqual(first.pk, self.user.pk)
+        # deferred fields are loaded from the database
+        self.assertEqual(second.username, self.user.username)
+
+    def test_vendor_performance_not_found(self):
+        response = self.client.get(
+            reverse('vendor-performance', kwargs={'pk': 123456}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_delete_vendor_not_found(self):
         non_existent_id = 123456
         response = self.client.delete(
@@ -111,10 +224,22 @@ class PurchaseOrderViewSetTestCase(APITestCase):
     def test_list_purchase_orders(self):
         response = self.client.get(reverse('purchaseorder-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        results = response.data['results']
+        self.assertEqual(len(results), 1)
         self.assertEqual(
-            response.data[0]['po_number'], self.purchase_order.po_number)
-        self.assertEqual(response.data[0]['items'], self.purchase_order.items)
+            results[0]['po_number'], self.purchase_order.po_number)
+        self.assertNotIn('items', results[0])
+
+    def test_list_purchase_orders_with_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('purchaseorder-list'), {'fields': 'id,status'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0],
+                         {'id': self.purchase_order.id, 'status': 'pending'})
+        self.assertNotIn('"items"', queries.captured_queries[-1]['sql'])
+
+        response = self.client.get(reverse('purchaseorder-list'), {'fields': 'id,unknown'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_create_purchase_order(self):
         data = {
@@ -143,6 +268,34 @@ class PurchaseOrderViewSetTestCase(APITestCase):
         self.assertEqual(response.data['quantity'],
                          self.purchase_order.quantity)
 
+    def test_purchase_order_items_are_loaded_on_demand(self):
+        lines = {'lines': [{'sku': f'SKU-{i}', 'description': 'Hex bolt M8', 'quantity': i}
+                           for i in range(50)]}
+        PurchaseOrder.objects.filter(pk=self.purchase_order.pk).update(items=lines)
+        stored = PurchaseOrder.objects.filter(pk=self.purchase_order.pk).values_list(
+            ExpressionWrapper(F('items'), output_field=BinaryField()), flat=True).get()
+        self.assertLess(len(stored), len(json.dumps(lines)) / 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('purchaseorder-list'))
+        self.assertNotIn('items', response.data['results'][0])
+        self.assertFalse(any('"items"' in query['sql'] for query in queries.captured_queries))
+        response = self.client.get(reverse('purchaseorder-list'), {'fields': 'items'})
+        self.assertEqual(response.data['results'][0]['items'], lines)
+
+        url = reverse('purchaseorder-detail', kwargs={'pk': self.purchase_order.pk})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).data['items'], lines)
+        response = self.client.get(
+            reverse('purchaseorder-items', kwargs={'pk': self.purchase_order.pk}))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), lines)
+        response = self.client.get(reverse('purchaseorder-items', kwargs={'pk': 123456}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # JSON text stored before the items were compressed is still read
+        self.assertEqual(decompress_json('{"item1": "my item1"}'), {'item1': 'my item1'})
+
     def test_retrieve_purchase_order_not_found(self):
         non_existent_id = 123456
         response = self.client.get(
@@ -178,6 +331,310 @@ class PurchaseOrderViewSetTestCase(APITestCase):
         self.purchase_order.refresh_from_db()
         self.assertIsNotNone(self.purchase_order.acknowledgment_date)
 
+    def purchase_order_data(self, po_number, **kwargs):
+        data = {
+            'po_number': po_number,
+            'vendor': self.vendor.id,
+            'order_date': timezone.now() - timedelta(days=2),
+            'delivery_date': timezone.now() + timedelta(days=1),
+            'items': {'item1': 'my item'},
+            'quantity': 10,
+            'status': 'pending',
+            'issue_date': timezone.now() - timedelta(days=2),
+        }
+        data.update(kwargs)
+        return data
+
+    def test_bulk_upsert_purchase_orders(self):
+        data = [
+            self.purchase_order_data('PO123', status='completed', quality_rating=4.0),
+            self.purchase_order_data('PO456'),
+            self.purchase_order_data('PO789', quantity=0),
+            self.purchase_order_data('PO456'),
+        ]
+        response = self.client.post(
+            reverse('purchaseorder-bulk') + '?chunk_size=1', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], ['PO456'])
+        self.assertEqual(response.data['updated'], ['PO123'])
+        self.assertEqual([row['index'] for row in response.data['rejected']], [2, 3])
+        self.assertEqual(PurchaseOrder.objects.count(), 2)
+
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.total_po_count, 2)
+        self.assertEqual(self.vendor.fulfillment_rate, 50.0)
+        self.assertEqual(self.vendor.quality_rating_avg, 4.0)
+        self.assertEqual(self.vendor.on_time_delivery_rate, 100.0)
+
+    def test_bulk_keeps_numeric_po_numbers_of_completed_orders(self):
+        PurchaseOrder.objects.create(**dict(
+            self.purchase_order_data('1001', status='completed'), vendor=self.vendor))
+        response = self.client.post(
+            reverse('purchaseorder-bulk'),
+            [self.purchase_order_data(1001, status='pending')], format='json')
+        self.assertIn('status', response.data['rejected'][0]['errors'])
+        self.assertEqual(PurchaseOrder.objects.get(po_number='1001').status, 'completed')
+
+    def test_bulk_rejects_unknown_vendor(self):
+        response = self.client.post(
+            reverse('purchaseorder-bulk'),
+            [self.purchase_order_data('PO456', vendor=123456)], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('vendor', response.data['rejected'][0]['errors'])
+        self.assertEqual(PurchaseOrder.objects.count(), 1)
+
+    def test_bulk_acknowledge_and_complete(self):
+        other = PurchaseOrder.objects.create(**dict(
+            self.purchase_order_data('PO456', delivery_date=timezone.now() - timedelta(days=1)),
+            vendor=self.vendor))
+        response = self.client.post(
+            reverse('purchaseorder-bulk-acknowledge'),
+            {'ids': [self.purchase_order.pk, other.pk]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.data['purchase_orders']),
+                         [self.purchase_order.pk, other.pk])
+        self.assertEqual(PurchaseOrder.objects.filter(
+            acknowledgment_date__isnull=True).count(), 0)
+
+        response = self.client.post(
+            reverse('purchaseorder-bulk-complete'),
+            {'po_numbers': ['PO123', 'PO456', 'PO999']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['purchase_orders']), 2)
+        self.purchase_order.refresh_from_db()
+        self.assertTrue(self.purchase_order.delivered_on_time)
+
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.fulfillment_rate, 100.0)
+        self.assertEqual(self.vendor.on_time_delivery_rate, 50.0)
+        self.assertEqual(self.vendor.acknowledged_po_count, 2)
+
+    def test_bulk_acknowledge_skips_rows_changed_concurrently(self):
+        other = PurchaseOrder.objects.create(**dict(
+            self.purchase_order_data('PO456'), vendor=self.vendor))
+        update = QuerySet.update
+
+        def racing_update(queryset, **kwargs):
+            # another request acknowledges other between the read and the UPDATE
+            if queryset.model is PurchaseOrder and 'acknowledgment_date' in kwargs:
+                update(PurchaseOrder.objects.filter(pk=other.pk),
+                       acknowledgment_date=timezone.now() - timedelta(hours=1))
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', racing_update):
+            response = self.client.post(
+                reverse('purchaseorder-bulk-acknowledge'),
+                {'ids': [self.purchase_order.pk, other.pk]}, format='json')
+        self.assertEqual(response.data['purchase_orders'], [self.purchase_order.pk])
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.acknowledged_po_count, 1)
+
+    def test_bulk_acknowledge_requires_selection(self):
+        response = self.client.post(
+            reverse('purchaseorder-bulk-acknowledge'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_and_order_purchase_orders(self):
+        other_vendor = Vendor.objects.create(
+            name='Other Vendor', contact_details='Details', address='Address',
+            vendor_code='Other Code')
+        PurchaseOrder.objects.create(**dict(
+            self.purchase_order_data('PO456', issue_date=timezone.now() - timedelta(days=30)),
+            vendor=self.vendor))
+        PurchaseOrder.objects.create(**dict(
+            self.purchase_order_data('PO789'), vendor=other_vendor))
+        PurchaseOrder.objects.filter(po_number='PO456').update(
+            acknowledgment_date=timezone.now())
+
+        url = reverse('purchaseorder-list')
+        response = self.client.get(url, {
+            'vendor': self.vendor.id, 'status': 'pending',
+            'issue_date_after': (timezone.now() - timedelta(days=7)).isoformat()})
+        self.assertEqual([row['po_number'] for row in response.data['results']], ['PO123'])
+
+        response = self.client.get(url, {'vendor': self.vendor.id, 'acknowledged': 'false'})
+        self.assertEqual([row['po_number'] for row in response.data['results']], ['PO123'])
+
+        response = self.client.get(url, {'ordering': 'issue_date'})
+        self.assertEqual([row['po_number'] for row in response.data['results']],
+                         ['PO456', 'PO789', 'PO123'])
+
+        response = self.client.get(url, {'status': 'unknown'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_pages_cover_every_purchase_order(self):
+        for i in range(4):
+            PurchaseOrder.objects.create(**dict(
+                self.purchase_order_data(f'PO{i}'), vendor=self.vendor,
+                acknowledgment_date=timezone.now() if i % 2 else None))
+        po_numbers = []
+        url = reverse('purchaseorder-list') + '?ordering=-acknowledgment_date&page_size=2'
+        while url:
+            response = self.client.get(url)
+            po_numbers += [row['po_number'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(po_numbers, ['PO123', 'PO0', 'PO1', 'PO2', 'PO3'])
+
+    def test_export_purchase_orders(self):
+        other_vendor = Vendor.objects.create(
+            name='Other Vendor', contact_details='Details', address='Address',
+            vendor_code='Other Code')
+        PurchaseOrder.objects.create(**dict(self.purchase_order_data('PO456'),
+                                            vendor=other_vendor))
+
+        response = self.client.get(
+            reverse('export-purchase-orders', kwargs={'file_format': 'ndjson'}),
+            {'vendor': self.vendor.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in
+                b''.join(response.streaming_content).decode().splitlines()]
+        detail = self.client.get(
+            reverse('purchaseorder-detail', kwargs={'pk': self.purchase_order.pk}))
+        self.assertEqual(rows, [detail.json()])
+
+        response = self.client.get(
+            reverse('export-purchase-orders', kwargs={'file_format': 'csv'}))
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:3], ['id', 'po_number', 'vendor'])
+        self.assertEqual([row[1] for row in rows[1:]], ['PO123', 'PO456'])
+        self.assertEqual(json.loads(rows[1][5]), {'item1': 'my item1'})
+
+        response = self.client.get(
+            reverse('export-purchase-orders', kwargs={'file_format': 'csv'}),
+            {'order_date_after': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncAPITestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='test')
+        self.token, _ = Token.objects.get_or_create(user=self.user)
+        self.headers = {'authorization': 'Token ' + self.token.key}
+        self.vendors = [Vendor.objects.create(name=f'Vendor {i}', contact_details='Contact',
+                                              address='Address', vendor_code=f'V{i}')
+                        for i in range(3)]
+        for i, po_status in enumerate(['pending', 'completed', 'pending']):
+            PurchaseOrder.objects.create(
+                po_number=f'PO{i}', vendor=self.vendors[0], order_date=timezone.now(),
+                delivery_date=timezone.now(), items={'item': i}, quantity=1,
+                status=po_status, issue_date=timezone.now())
+
+    async def test_vendor_list_is_keyset_paginated(self):
+        url = reverse('async-vendor-list')
+        response = await self.async_client.get(url, {'page_size': 2, 'fields': 'name'},
+                                               headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        page = response.json()
+        self.assertEqual(page['results'], [{'name': 'Vendor 0'}, {'name': 'Vendor 1'}])
+        response = await self.async_client.get(page['next'], headers=self.headers)
+        self.assertEqual(response.json(), {'next': None,
+                                           'results': [{'name': 'Vendor 2'}]})
+
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.async_client.get(url, headers={'authorization': 'Token bad'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.async_client.get(url, {'fields': 'nope'}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_vendor_detail_and_metrics(self):
+        vendor = self.vendors[0]
+        response = await self.async_client.get(
+            reverse('async-vendor-detail', kwargs={'vendor_id': vendor.pk}), headers=self.headers)
+        self.assertEqual(response.json()['vendor_code'], 'V0')
+        response = await self.async_client.get(
+            reverse('async-vendor-detail', kwargs={'vendor_id': 123456}), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        await cache.aclear()
+        url = reverse('async-vendor-metrics', kwargs={'vendor_id': vendor.pk})
+        response = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual(response.json()['fulfillment_rate'], 33.33)
+        response = await self.async_client.get(
+            url, headers={**self.headers, 'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_purchase_order_list_filters_and_detail(self):
+        response = await self.async_client.get(
+            reverse('async-purchaseorder-list'), {'status': 'pending'}, headers=self.headers)
+        self.assertEqual([po['po_number'] for po in response.json()['results']], ['PO0', 'PO2'])
+        self.assertNotIn('items', response.json()['results'][0])
+        response = await self.async_client.get(
+            reverse('async-purchaseorder-list'), {'status': 'lost'}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        purchase_order = await PurchaseOrder.objects.aget(po_number='PO1')
+        response = await self.async_client.get(
+            reverse('async-purchaseorder-detail', kwargs={'po_id': purchase_order.pk}),
+            headers=self.headers)
+        self.assertEqual(response.json()['vendor'], self.vendors[0].pk)
+        self.assertEqual(response.json()['items'], {'item': 1})
+        self.assertTrue(response.json()['delivered_on_time'])
+
+    async def test_vendor_performance_history(self):
+        vendor = self.vendors[0]
+        await Performance.objects.acreate(vendor=vendor, on_time_delivery_rate=50.0,
+                                          quality_rating_avg=4.0, average_response_time=1.0,
+                                          fulfillment_rate=33.33)
+        url = reverse('async-vendor-performance', kwargs={'vendor_id': vendor.pk})
+        response = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual([row['fulfillment_rate'] for row in response.json()], [33.33])
+        response = await self.async_client.get(url, {'bucket': 'year'}, headers=self.headers)
+        self.assertEqual((response.json()[0]['samples'],
+                          response.json()[0]['quality_rating_avg']['max']), (1, 4.0))
+        response = await self.async_client.get(url, {'bucket': 'week'}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.async_client.get(
+            reverse('async-vendor-performance', kwargs={'vendor_id': 123456}),
+            headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_cached_requests_do_not_switch_threads(self):
+        passed_on = []
+
+        async def rest_of_stack(request):
+            passed_on.append(request.path)
+            return HttpResponse()
+
+        @async_api_view
+        async def whoami(request):
+            return HttpResponse(request.user.pk)
+
+        class urlconf:
+            urlpatterns = [path('api/async/whoami/', whoami)]
+
+        def get(url):
+            request = RequestFactory().get(url, HTTP_AUTHORIZATION='Token ' + self.token.key)
+            request.urlconf = urlconf
+            return request
+
+        handler = AsyncAPIMiddleware(rest_of_stack)
+        token_cache.clear()
+        await handler(get('/api/async/whoami/'))
+
+        # the token is cached now: nothing may use sync_to_async (the cache
+        # backends' own async methods do, so the view reads no cache)
+        with mock.patch('asgiref.sync.SyncToAsync.__init__',
+                        side_effect=AssertionError('thread switch')):
+            response = await handler(get('/api/async/whoami/'))
+        self.assertEqual(response.content, str(self.user.pk).encode())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+        await handler(get('/api/async/unknown/'))
+        await handler(get('/api/vendors/'))
+        self.assertEqual(passed_on, ['/api/async/unknown/', '/api/vendors/'])
+
+    async def test_session_writes_under_asgi(self):
+        # the sync views keep Django's middleware, whose session save queries
+        await sync_to_async(User.objects.create_superuser)('admin', password='admin')
+        response = await self.async_client.post(
+            '/admin/login/', {'username': 'admin', 'password': 'admin', 'next': '/admin/'})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(response['Location'], '/admin/')
+
 
 class PerformanceViewSetTestCase(APITestCase):
     def setUp(self):
@@ -215,8 +672,872 @@ class PerformanceViewSetTestCase(APITestCase):
         self.assertEqual(
             response.data[0]['fulfillment_rate'], self.performance.fulfillment_rate)
 
+    def test_vendor_performance_range_and_buckets(self):
+        for day, rate in ((40, 80.0), (35, 60.0), (5, 100.0)):
+            performance = Performance.objects.create(
+                vendor=self.vendor, on_time_delivery_rate=rate)
+            Performance.objects.filter(pk=performance.pk).update(
+                date=timezone.now() - timedelta(days=day))
+        url = reverse('vendor_performance', kwargs={'vendor_id': self.vendor.id})
+
+        response = self.client.get(url, {
+            'from': (timezone.now() - timedelta(days=38)).isoformat(),
+            'to': (timezone.now() - timedelta(days=1)).isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['on_time_delivery_rate'] for row in response.data],
+                         [60.0, 100.0])
+
+        response = self.client.get(url, {
+            'bucket': 'year', 'to': (timezone.now() - timedelta(days=1)).isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        samples = sum(row['samples'] for row in response.data)
+        self.assertEqual(samples, 3)
+        rates = [row['on_time_delivery_rate'] for row in response.data]
+        self.assertEqual(min(rate['min'] for rate in rates), 60.0)
+        self.assertEqual(max(rate['max'] for rate in rates), 100.0)
+
+        response = self.client.get(url, {'bucket': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_performances(self):
+        other_vendor = Vendor.objects.create(
+            name='Other Vendor', contact_details='Details', address='Address',
+            vendor_code='Other Code')
+        Performance.objects.create(vendor=other_vendor, on_time_delivery_rate=50.0)
+        old = Performance.objects.create(vendor=self.vendor, on_time_delivery_rate=80.0)
+        Performance.objects.filter(pk=old.pk).update(date=timezone.now() - timedelta(days=40))
+        url = reverse('export-performances', kwargs={'file_format': 'csv'})
+
+        response = self.client.get(url, {
+            'vendor': self.vendor.id,
+            'from': (timezone.now() - timedelta(days=7)).isoformat()})
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([(row['id'], row['on_time_delivery_rate']) for row in rows],
+                         [(str(self.performance.id), '0.9')])
+
+        response = self.client.get(
+            reverse('export-performances', kwargs={'file_format': 'ndjson'}))
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+
     def test_retrieve_vendor_performance_not_found(self):
         non_existent_id = 123456
         response = self.client.get(
             reverse('vendor_performance', kwargs={'vendor_id': non_existent_id}))
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class VendorMetricsTestCase(TestCase):
+    def setUp(self):
+        self.vendor = Vendor.objects.create(
+            name='Test Vendor',
+            contact_details='Test Contact Details',
+            address='Test Address',
+            vendor_code='Test Code',
+        )
+        now = timezone.now()
+        self.on_time = self.create_purchase_order('PO1', now + timedelta(days=5))
+        self.late = self.create_purchase_order('PO2', now - timedelta(days=1))
+        self.pending = self.create_purchase_order('PO3', now + timedelta(days=5))
+
+    def create_purchase_order(self, po_number, delivery_date):
+        return PurchaseOrder.objects.create(
+            po_number=po_number,
+            vendor=self.vendor,
+            order_date=timezone.now() - timedelta(days=3),
+            delivery_date=delivery_date,
+            items={'item1': 'my item1'},
+            quantity=15,
+            status='pending',
+            issue_date=timezone.now() - timedelta(days=2),
+        )
+
+    def complete(self, purchase_order, quality_rating):
+        purchase_order.status = 'completed'
+        purchase_order.quality_rating = quality_rating
+        purchase_order.save()
+
+    def test_metrics_follow_purchase_orders(self):
+        self.complete(self.on_time, 4.0)
+        self.complete(self.late, 3.0)
+        self.pending.acknowledgment_date = self.pending.issue_date + timedelta(days=1)
+        self.pending.save()
+
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.on_time_delivery_rate, 50.0)
+        self.assertEqual(self.vendor.quality_rating_avg, 3.5)
+        self.assertEqual(self.vendor.average_response_time, 1.0)
+        self.assertEqual(self.vendor.fulfillment_rate, 66.67)
+        self.on_time.refresh_from_db()
+        self.assertTrue(self.on_time.delivered_on_time)
+
+    def test_completion_uses_constant_queries(self):
+        # snapshot select, purchase order update, vendor counter update
+        with self.assertNumQueries(3):
+            self.complete(self.on_time, 5.0)
+
+    def test_delete_removes_contribution(self):
+        self.complete(self.on_time, 4.0)
+        self.on_time.delete()
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.total_po_count, 2)
+        self.assertEqual(self.vendor.fulfillment_rate, 0.0)
+        self.assertEqual(self.vendor.quality_rating_avg, 0.0)
+
+    def test_recompute_matches_incremental_counters(self):
+        self.complete(self.on_time, 4.0)
+        self.complete(self.late, 2.5)
+        self.pending.acknowledgment_date = self.pending.issue_date + timedelta(hours=30)
+        self.pending.save()
+        self.vendor.refresh_from_db()
+        incremental = [getattr(self.vendor, f) for f in COUNTER_FIELDS + METRIC_FIELDS]
+
+        Vendor.objects.filter(pk=self.vendor.pk).update(
+            total_po_count=0, quality_rating_avg=0.0)
+        call_command('recompute_metrics', stdout=StringIO())
+        self.vendor.refresh_from_db()
+        self.assertEqual(
+            [getattr(self.vendor, f) for f in COUNTER_FIELDS + METRIC_FIELDS], incremental)
+        call_command('recompute_metrics', '--check', stdout=StringIO())
+
+    def test_recompute_reports_metric_drift(self):
+        self.complete(self.on_time, 4.0)
+        Vendor.objects.filter(pk=self.vendor.pk).update(quality_rating_avg=2.0)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('recompute_metrics', '--check', stdout=out)
+        self.assertIn('quality_rating_avg: 1 vendors drifted, max 2.00', out.getvalue())
+        self.assertIn(f'Vendor {self.vendor.pk}: ', out.getvalue())
+
+        call_command('recompute_metrics', stdout=StringIO())
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.quality_rating_avg, 4.0)
+
+    @override_settings(METRICS_MODE='async')
+    @mock.patch.dict('webapp.metrics._lag_checked', at=None)
+    def test_async_mode_queues_and_coalesces_vendors(self):
+        self.complete(self.on_time, 4.0)
+        self.complete(self.late, 3.0)
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.fulfillment_rate, 0.0)
+        self.assertEqual(MetricsOutbox.objects.filter(vendor=self.vendor).count(), 2)
+
+        self.assertEqual(drain_outbox(), 1)
+        self.assertFalse(MetricsOutbox.objects.exists())
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.on_time_delivery_rate, 50.0)
+        self.assertEqual(self.vendor.quality_rating_avg, 3.5)
+        self.assertEqual(self.vendor.fulfillment_rate, 66.67)
+
+    @override_settings(METRICS_MODE='async', METRICS_MAX_STALENESS=60,
+                       METRICS_LAG_CHECK_INTERVAL=0)
+    @mock.patch.dict('webapp.metrics._lag_checked', at=None)
+    def test_async_mode_falls_back_to_sync_when_stale(self):
+        self.complete(self.on_time, 4.0)
+        MetricsOutbox.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        self.complete(self.late, 3.0)
+        self.vendor.refresh_from_db()
+        self.assertEqual(self.vendor.fulfillment_rate, 66.67)
+        # the recompute covered the queued event
+        self.assertFalse(MetricsOutbox.objects.exists())
+
+    @override_settings(METRICS_MODE='async')
+    @mock.patch.dict('webapp.metrics._lag_checked', at=None)
+    def test_async_mode_deletes_vendor_with_purchase_orders(self):
+        other = Vendor.objects.create(name='Other', contact_details='Other Contact',
+                                      address='Other Address', vendor_code='Other Code')
+        PurchaseOrder.objects.filter(pk=self.late.pk).update(vendor=other)
+        self.vendor.delete()
+        Vendor.objects.filter(pk=other.pk).delete()
+        connection.check_constraints()
+        self.assertFalse(PurchaseOrder.objects.exists())
+        self.assertFalse(MetricsOutbox.objects.exists())
+
+    @override_settings(METRICS_MODE='async', METRICS_LAG_CHECK_INTERVAL=60)
+    @mock.patch.dict('webapp.metrics._lag_checked', at=None)
+    def test_async_mode_checks_outbox_lag_once_per_interval(self):
+        with mock.patch('webapp.metrics.outbox_lag', return_value=0.0) as outbox_lag:
+            self.complete(self.on_time, 4.0)
+            self.complete(self.late, 3.0)
+        outbox_lag.assert_called_once_with()
+        self.assertEqual(MetricsOutbox.objects.count(), 2)
+
+
+class ImportDataTestCase(TestCase):
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(text)
+        return path
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.vendors = self.write('vendors.csv', (
+            'name,contact_details,address,vendor_code\n'
+            'Vendor A,Contact,Address,A\n'
+            'Vendor B,Contact,Address,B\n'
+            'Vendor A again,Contact,Address,A\n'))
+        issue_date = (timezone.now() - timedelta(days=3)).isoformat()
+        rows = [
+            {'po_number': 'PO1', 'vendor_code': 'A', 'status': 'completed',
+             'quality_rating': 4.0, 'acknowledgment_date': timezone.now().isoformat()},
+            {'po_number': 'PO2', 'vendor_code': 'A', 'status': 'pending'},
+            {'po_number': 'PO3', 'vendor_code': 'B', 'status': 'pending', 'quantity': 0},
+            {'po_number': 'PO4', 'vendor_code': 'C', 'status': 'pending'},
+            {'po_number': 'PO5', 'vendor_code': 'B', 'status': 'lost'},
+            {'po_number': 'PO6', 'vendor_code': 'B', 'status': 'completed'},
+        ]
+        self.purchase_orders = self.write('purchase_orders.ndjson', ''.join(
+            json.dumps({'order_date': issue_date, 'delivery_date': issue_date,
+                        'issue_date': issue_date, 'items': {'item': 1}, 'quantity': 5,
+                        **row}) + '\n' for row in rows) + '{not json\n')
+
+    def test_import_validates_and_recomputes_metrics(self):
+        out = StringIO()
+        call_command('import_data', 'vendors', self.vendors, stdout=out)
+        self.assertIn('Imported 2 vendors up to line 3', out.getvalue())
+
+        rejects = os.path.join(self.directory.name, 'rejects.ndjson')
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_data', 'purchase_orders', self.purchase_orders,
+                         '--batch-size', '4', '--rejects', rejects, stdout=out)
+        # one INSERT per batch of 4 lines and no per row metric updates
+        self.assertEqual(sum(query['sql'].startswith('INSERT') for query in queries), 2)
+        self.assertEqual(sum('UPDATE' in query['sql'] for query in queries), 2)
+        # archived po_numbers are looked up per batch, not per row
+        self.assertEqual(sum(ArchivedPurchaseOrder._meta.db_table in query['sql']
+                             for query in queries), 2)
+        self.assertIn('Imported 3 purchase_orders up to line 7', out.getvalue())
+        with open(rejects) as file:
+            errors = {json.loads(line)['line']: json.loads(line)['errors'] for line in file}
+        self.assertEqual(sorted(errors), [3, 4, 5, 7])
+        self.assertIn('quantity', errors[3])
+        self.assertEqual(errors[4], {'vendor_code': ['Unknown vendor_code.']})
+        self.assertIn('status', errors[5])
+
+        vendor_a = Vendor.objects.get(vendor_code='A')
+        self.assertEqual(vendor_a.total_po_count, 2)
+        self.assertEqual(vendor_a.fulfillment_rate, 50.0)
+        self.assertEqual(vendor_a.quality_rating_avg, 4.0)
+        self.assertEqual(vendor_a.on_time_delivery_rate, 100.0)
+        self.assertEqual(Vendor.objects.get(vendor_code='B').fulfillment_rate, 100.0)
+        call_command('recompute_metrics', '--check', stdout=StringIO())
+
+    def test_import_resumes_from_line(self):
+        call_command('import_data', 'vendors', self.vendors, stdout=StringIO())
+        call_command('import_data', 'purchase_orders', self.purchase_orders,
+                     '--start-line', '5', stdout=StringIO())
+        self.assertEqual(list(PurchaseOrder.objects.values_list('po_number', flat=True)),
+                         ['PO6'])
+        self.assertEqual(Vendor.objects.get(vendor_code='B').total_po_count, 1)
+
+
+class BenchmarkTestCase(TestCase):
+    def test_operations_stay_within_query_budgets(self):
+        seed(400)
+        self.assertEqual(PurchaseOrder.objects.count(), 400)
+        self.assertEqual(Vendor.objects.count(), 2)
+        call_command('recompute_metrics', '--check', stdout=StringIO())
+
+        results = run_benchmarks(iterations=3)
+        self.assertEqual(set(results), set(settings.BENCHMARK_BUDGETS))
+        budgets = {name: {'queries': budget['queries']}
+                   for name, budget in settings.BENCHMARK_BUDGETS.items()}
+        self.assertEqual(check_budgets(results, budgets), [])
+
+        budgets['po_complete']['queries'] = results['po_complete']['queries'] - 1
+        self.assertEqual(check_budgets(results, budgets),
+                         [f"po_complete: {results['po_complete']['queries']} queries, "
+                          f"budget {results['po_complete']['queries'] - 1}"])
+
+
+@modify_settings(MIDDLEWARE={'prepend': 'webapp.profiling.ProfilingMiddleware'})
+class ProfilingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        reset_profiling_stats()
+        user = User.objects.create_user(username='test', password='test')
+        self.client = APIClient()
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.vendor = Vendor.objects.create(name='Vendor', contact_details='Contact',
+                                            address='Address', vendor_code='V1')
+
+    def test_requests_are_timed_logged_and_aggregated(self):
+        url = reverse('vendor-detail', kwargs={'pk': self.vendor.pk})
+        with tempfile.TemporaryDirectory() as directory, \
+                self.settings(PROFILING_SAMPLE_RATE=1, PROFILING_DIR=directory), \
+                self.assertLogs('webapp.profiling', 'INFO') as logs:
+            response = self.client.get(url)
+            self.assertTrue(os.listdir(directory))
+        self.assertRegex(response['Server-Timing'],
+                         r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", app;dur=')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['endpoint'], 'GET vendor-detail')
+        self.assertGreaterEqual(line['queries'], 1)
+        self.assertTrue(line['profile'].endswith('.prof'))
+
+        with self.assertLogs('webapp.profiling', 'INFO'):
+            self.client.get(url)
+            stats = self.client.get(reverse('request-stats')).json()['endpoints']
+        self.assertEqual(stats['GET vendor-detail']['count'], 2)
+        self.assertEqual(sum(stats['GET vendor-detail']['histogram'].values()), 2)
+
+        with self.assertLogs('webapp.profiling', 'INFO'):
+            self.assertEqual(self.client.delete(reverse('request-stats')).status_code,
+                             status.HTTP_403_FORBIDDEN)
+            User.objects.filter(username='test').update(is_staff=True)
+            self.assertEqual(self.client.delete(reverse('request-stats')).status_code,
+                             status.HTTP_204_NO_CONTENT)
+
+        self.client.credentials()
+        with self.assertLogs('webapp.profiling', 'INFO'):
+            self.assertEqual(self.client.get(reverse('request-stats')).status_code,
+                             status.HTTP_401_UNAUTHORIZED)
+
+    def test_one_request_is_profiled_at_a_time(self):
+        request = RequestFactory().get('/')
+        request.resolver_match = None
+        middleware = ProfilingMiddleware(lambda request: HttpResponse())
+        with self.settings(PROFILING_SAMPLE_RATE=1), \
+                self.assertLogs('webapp.profiling', 'INFO') as logs:
+            with profiling._profiler_lock:
+                middleware(request)
+            middleware(request)
+        lines = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual(['profile' in line for line in lines], [False, True])
+        self.assertFalse(profiling._profiler_lock.locked())
+
+    def test_duplicate_queries_are_counted(self):
+        # The same query twice in one request
+        def view(request):
+            Vendor.objects.filter(pk=self.vendor.pk).exists()
+            Vendor.objects.filter(pk=self.vendor.pk).exists()
+            return HttpResponse()
+        request = RequestFactory().get('/')
+        request.resolver_match = None
+        with self.assertLogs('webapp.profiling', 'INFO') as logs:
+            ProfilingMiddleware(view)(request)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['queries'], line['duplicate_queries']), (2, 1))
+
+
+class MonitoringTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='test', password='test')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.vendor = Vendor.objects.create(name='Vendor', contact_details='Contact',
+                                            address='Address', vendor_code='V1')
+
+    def test_requests_signals_and_jobs_are_exported(self):
+        requests = monitoring.http_requests.value(route='purchaseorder-list', method='POST',
+                                                  status=201)
+        handled = monitoring.signal_handler_duration.count(handler='update_vendor_metrics')
+        updates = monitoring.vendor_metric_updates.value(mode='incremental')
+        now = timezone.now().isoformat()
+        response = self.client.post(reverse('purchaseorder-list'), {
+            'po_number': 'PO1', 'vendor': self.vendor.pk, 'order_date': now,
+            'delivery_date': now, 'issue_date': now, 'items': {}, 'quantity': 1,
+            'status': 'pending'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(monitoring.http_requests.value(
+            route='purchaseorder-list', method='POST', status=201), requests + 1)
+        self.assertEqual(monitoring.signal_handler_duration.count(
+            handler='update_vendor_metrics'), handled + 1)
+        self.assertEqual(monitoring.vendor_metric_updates.value(mode='incremental'),
+                         updates + 1)
+
+        # vendor metrics cache lookups
+        cache.clear()
+        for _ in range(2):
+            self.client.get(reverse('vendor-performance', kwargs={'pk': self.vendor.pk}))
+        self.assertGreaterEqual(cache_stats()['hits'], 1)
+
+        # the job gauges come from the JobRun rows, whichever process ran them
+        tick('scheduler')
+        run = JobRun.objects.get()
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        with self.settings(PROMETHEUS_ALLOWED_IPS=['127.0.0.1']):
+            body = self.client.get('/metrics').content.decode()
+        self.assertIn('vendorms_job_last_rows{job="update_performance"} 1\n', body)
+        self.assertIn('vendorms_job_last_success_timestamp_seconds{job="update_performance"} '
+                      f'{run.finished_at.timestamp()!r}\n', body)
+        self.assertIn('vendorms_metrics_outbox_lag_seconds 0.0\n', body)
+        self.assertIn(f'vendorms_vendor_metrics_cache_hits_total {cache_stats()["hits"]}\n',
+                      body)
+        self.assertIn('# TYPE vendorms_vendor_metrics_cache_misses_total counter\n', body)
+        self.assertIn('vendorms_http_request_duration_seconds_bucket'
+                      '{route="purchaseorder-list",method="POST",le="+Inf"}', body)
+
+        scraper = APIClient()
+        with self.settings(PROMETHEUS_BEARER_TOKEN='secret'):
+            self.assertEqual(scraper.get('/metrics').status_code, 401)
+            scraper.credentials(HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(scraper.get('/metrics').status_code, 200)
+
+    def test_counters_are_thread_safe(self):
+        counter = monitoring.Counter('test_total', 'Test counter.', ('name',))
+        histogram = monitoring.Histogram('test_seconds', 'Test histogram.')
+
+        def work(_):
+            for _ in range(10000):
+                counter.inc(name='a')
+                histogram.observe(0.001)
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(work, range(8)))
+        self.assertEqual(counter.value(name='a'), 80000)
+        self.assertIn('test_seconds_count 80000', histogram.render())
+
+    def test_gauge_is_not_a_counter(self):
+        gauge = monitoring.Gauge('test_leader', 'Test gauge.')
+        gauge.set(1)
+        gauge.inc(-1)
+        self.assertEqual(gauge.value(), 0)
+        self.assertNotIsInstance(gauge, monitoring.Counter)
+        self.assertIn('# TYPE test_leader gauge', gauge.render())
+
+
+class PerformanceSnapshotTestCase(TestCase):
+    def setUp(self):
+        for i in range(5):
+            Vendor.objects.create(
+                name=f'Vendor {i}',
+                contact_details='Test Contact Details',
+                address='Test Address',
+                vendor_code=f'Code {i}',
+                on_time_delivery_rate=i * 10.0,
+            )
+
+    def test_snapshot_is_batched_and_idempotent(self):
+        with self.assertLogs('webapp.snapshots', level='INFO'):
+            written = take_performance_snapshot(batch_size=2)
+        self.assertEqual(written, 5)
+        self.assertEqual(Performance.objects.count(), 5)
+        self.assertEqual(
+            sorted(Performance.objects.values_list('on_time_delivery_rate', flat=True)),
+            [0.0, 10.0, 20.0, 30.0, 40.0])
+
+        # A rerun in the same week only fills in missing vendors
+        Performance.objects.filter(vendor__vendor_code='Code 3').delete()
+        with self.assertLogs('webapp.snapshots', level='INFO'):
+            self.assertEqual(take_performance_snapshot(batch_size=2), 1)
+        self.assertEqual(Performance.objects.count(), 5)
+
+
+class ShardingTestCase(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for i in range(5):
+            vendor = Vendor.objects.create(name=f'Vendor {i}', contact_details='Contact',
+                                           address='Address', vendor_code=f'V{i}')
+            PurchaseOrder.objects.create(
+                po_number=f'PO{i}', vendor=vendor, order_date=now, issue_date=now,
+                delivery_date=now + timedelta(days=1), items={}, quantity=1,
+                status='completed', quality_rating=float(i))
+
+    def test_recompute_and_snapshot_in_shards(self):
+        self.assertEqual(len(vendor_shards(2)), 3)
+        expected = list(Vendor.objects.order_by('pk').values(*COUNTER_FIELDS, *METRIC_FIELDS))
+        Vendor.objects.update(total_po_count=9, fulfillment_rate=1.0)
+        progress = []
+        counters = parallel_recompute(workers=1, shard_size=2,
+                                      progress=lambda done, total: progress.append(done))
+        self.assertEqual(len(counters), 5)
+        self.assertEqual(progress, [1, 2, 3])
+        self.assertEqual(list(Vendor.objects.order_by('pk')
+                              .values(*COUNTER_FIELDS, *METRIC_FIELDS)), expected)
+
+        self.assertEqual(parallel_snapshot(workers=1, shard_size=2), 5)
+        self.assertEqual(parallel_snapshot(workers=1, shard_size=2), 0)
+
+    def test_failed_shards_are_retried(self):
+        attempts = []
+
+        def flaky(shard):
+            attempts.append(shard)
+            if attempts.count(shard) == 1:
+                raise RuntimeError('lost connection')
+            return shard[0]
+        with self.assertLogs('webapp.sharding', 'WARNING'):
+            self.assertEqual(run_sharded(flaky, [(1, 2), (3, 4)], workers=1, retries=1),
+                             {(1, 2): 1, (3, 4): 3})
+            with self.assertRaises(ShardError):
+                run_sharded(flaky, [(5, 6)], workers=1, retries=0)
+
+
+class RankingTestCase(APITestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='test', password='test')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        now = timezone.now()
+        self.vendors = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, rating in enumerate([3.0, 5.0, 3.0, 1.0]):
+                vendor = Vendor.objects.create(name=f'Vendor {i}', contact_details='Contact',
+                                               address='Address', vendor_code=f'V{i}')
+                PurchaseOrder.objects.create(
+                    po_number=f'PO{i}', vendor=vendor, order_date=now, issue_date=now,
+                    delivery_date=now + timedelta(days=1), items={}, quantity=1,
+                    status='completed', quality_rating=rating)
+                self.vendors.append(vendor)
+            # ranked only by fulfillment rate until it completes an order
+            self.pending = Vendor.objects.create(name='Pending', contact_details='Contact',
+                                                 address='Address', vendor_code='P1')
+            PurchaseOrder.objects.create(
+                po_number='PO9', vendor=self.pending, order_date=now, issue_date=now,
+                delivery_date=now + timedelta(days=1), items={}, quantity=1)
+
+    def ranks(self):
+        return sorted(VendorRank.objects.values_list('vendor_id', 'metric', 'score', 'rank'))
+
+    def assertRanksMatchRebuild(self):
+        incremental = self.ranks()
+        rebuild_rankings()
+        self.assertEqual(incremental, self.ranks())
+
+    def test_incremental_ranks_match_rebuild(self):
+        self.assertRanksMatchRebuild()
+        quality = dict(VendorRank.objects.filter(metric='quality_rating_avg')
+                       .values_list('vendor_id', 'rank'))
+        self.assertEqual([quality[vendor.pk] for vendor in self.vendors], [2, 1, 2, 4])
+        self.assertEqual(VendorRank.objects.filter(vendor=self.pending).count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PurchaseOrder.objects.get(po_number='PO3').delete()
+            po = PurchaseOrder.objects.get(po_number='PO1')
+            po.quality_rating = 2.0
+            po.save()
+            po = PurchaseOrder.objects.get(po_number='PO9')
+            po.status = 'completed'
+            po.quality_rating = 4.0
+            po.save()
+        self.assertRanksMatchRebuild()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vendors[0].delete()
+        self.assertRanksMatchRebuild()
+
+    def test_ranking_and_rank_endpoints(self):
+        response = self.client.get(reverse('vendor-ranking'),
+                                   {'metric': 'quality_rating_avg', 'limit': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['ranked_vendors'], 4)
+        self.assertEqual([(row['id'], row['rank'], row['percentile'])
+                          for row in response.data['results']],
+                         [(self.vendors[1].pk, 1, 100.0), (self.vendors[0].pk, 2, 66.67),
+                          (self.vendors[2].pk, 2, 66.67)])
+
+        response = self.client.get(reverse('vendor-ranking'),
+                                   {'metric': 'quality_rating_avg', 'max_value': 3})
+        self.assertEqual([row['value'] for row in response.data['results']], [3.0, 3.0, 1.0])
+        response = self.client.get(reverse('vendor-ranking'), {'metric': 'name'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse('vendor-rank', args=[self.vendors[3].pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['quality_rating_avg'],
+                         {'value': 1.0, 'rank': 4, 'percentile': 0.0, 'out_of': 4})
+        response = self.client.get(reverse('vendor-rank', args=[self.pending.pk]))
+        self.assertEqual(response.data['on_time_delivery_rate']['rank'], None)
+        self.assertEqual(response.data['fulfillment_rate']['out_of'], 5)
+
+
+class ScorecardTestCase(APITestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='test', password='test')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        now = timezone.now()
+        for i in range(6):
+            vendor = Vendor.objects.create(name=f'Vendor {i}', contact_details='Contact',
+                                           address='Address', vendor_code=f'V{i}')
+            for j, po_status in enumerate(['pending', 'completed', 'canceled', 'completed']):
+                PurchaseOrder.objects.create(
+                    po_number=f'PO{i}-{j}', vendor=vendor, order_date=now, issue_date=now,
+                    delivery_date=now + timedelta(days=j + 1), items={}, quantity=10 * j,
+                    status=po_status, quality_rating=4.0 if po_status == 'completed' else None)
+        take_performance_snapshot()
+        self.vendor = Vendor.objects.order_by('pk').first()
+
+    def test_scorecard(self):
+        response = self.client.get(reverse('vendor-scorecard', args=[self.vendor.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['purchase_orders'], {
+            'open': 1, 'completed': 2, 'canceled': 1, 'total': 4,
+            'total_quantity': 60, 'average_lead_time': 3.0})
+        self.assertEqual(response.data['metrics']['fulfillment_rate'], 50.0)
+
+        # only completed purchase orders have an actual delivery date
+        now = timezone.now()
+        PurchaseOrder.objects.create(
+            po_number='PO-open', vendor=self.vendor, order_date=now, issue_date=now,
+            delivery_date=now + timedelta(days=30), items={}, quantity=1, status='pending')
+        response = self.client.get(reverse('vendor-scorecard', args=[self.vendor.pk]))
+        self.assertEqual(response.data['purchase_orders']['average_lead_time'], 3.0)
+        PurchaseOrder.objects.filter(vendor=self.vendor, status='completed').delete()
+        response = self.client.get(reverse('vendor-scorecard', args=[self.vendor.pk]))
+        self.assertIsNone(response.data['purchase_orders']['average_lead_time'])
+        latest = Performance.objects.filter(vendor=self.vendor).latest('date')
+        self.assertEqual(response.data['latest_performance']['fulfillment_rate'],
+                         latest.fulfillment_rate)
+        self.assertEqual(
+            self.client.get(reverse('vendor-scorecard', args=['x'])).status_code,
+            status.HTTP_404_NOT_FOUND)
+
+    def test_scorecard_queries_do_not_grow_with_page_size(self):
+        url = reverse('vendor-scorecards')
+        self.client.get(url)  # caches the token
+        # vendors with their latest snapshot id, live and archived purchase
+        # order stats, snapshots
+        for page_size in (1, 3, 6):
+            with self.assertNumQueries(4):
+                response = self.client.get(url, {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+        self.assertEqual(response.data['results'][5]['purchase_orders']['total'], 4)
+
+
+class ArchiveTestCase(APITestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='test', password='test')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.vendor = Vendor.objects.create(name='Vendor', contact_details='Contact',
+                                            address='Address', vendor_code='V1')
+        now = timezone.now()
+        for i, (po_status, age) in enumerate([('completed', 400), ('canceled', 500),
+                                               ('pending', 600), ('completed', 10),
+                                               ('completed', 700)]):
+            order_date = now - timedelta(days=age)
+            po = PurchaseOrder.objects.create(
+                po_number=f'PO{i}', vendor=self.vendor, order_date=order_date,
+                issue_date=order_date, delivery_date=order_date + timedelta(days=3),
+                items={'sku': f'SKU-{i}', 'lines': [1, 2]}, quantity=i + 1,
+                status=po_status, quality_rating=float(i) if po_status == 'completed' else None)
+            if i == 4:
+                po.acknowledgment_date = order_date + timedelta(hours=5)
+                po.save()
+
+    def metrics(self):
+        return Vendor.objects.filter(pk=self.vendor.pk).values(
+            *COUNTER_FIELDS, *METRIC_FIELDS).get()
+
+    def test_archive_keeps_metrics_exact(self):
+        before = self.metrics()
+        self.assertEqual(archive_purchase_orders(older_than_days=365, batch_size=2), 3)
+        self.assertEqual(sorted(PurchaseOrder.objects.values_list('po_number', flat=True)),
+                         ['PO2', 'PO3'])
+        self.assertEqual(self.metrics(), before)
+        self.assertEqual(archive_purchase_orders(older_than_days=365), 0)
+
+        # counters rebuilt from the live purchase orders plus the carry-over
+        Vendor.objects.filter(pk=self.vendor.pk).update(total_po_count=0, fulfillment_rate=0)
+        recompute_vendors()
+        self.assertEqual(self.metrics(), before)
+        call_command('recompute_metrics', '--check', stdout=StringIO())
+
+        archived = ArchivedPurchaseOrder.objects.get(po_number='PO4')
+        self.assertEqual(archived.period, timezone.localtime(archived.order_date).date()
+                         .replace(day=1))
+        self.assertEqual(archived.items, {'sku': 'SKU-4', 'lines': [1, 2]})
+
+    def test_export_includes_archived_purchase_orders(self):
+        archive_purchase_orders(older_than_days=365)
+        url = reverse('export-purchase-orders', kwargs={'file_format': 'ndjson'})
+
+        response = self.client.get(url)
+        rows = [json.loads(line) for line in
+                b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['po_number'] for row in rows], ['PO2', 'PO3'])
+        self.assertNotIn('archived', rows[0])
+
+        response = self.client.get(url, {'include_archived': 1})
+        rows = [json.loads(line) for line in
+                b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['po_number'], row['archived']) for row in rows],
+                         [('PO0', True), ('PO1', True), ('PO2', False), ('PO3', False),
+                          ('PO4', True)])
+        self.assertEqual(rows[4]['items'], {'sku': 'SKU-4', 'lines': [1, 2]})
+
+        # the list filters apply to the archived rows too
+        response = self.client.get(
+            reverse('export-purchase-orders', kwargs={'file_format': 'csv'}),
+            {'include_archived': 'true', 'status': 'completed'})
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][-1], 'archived')
+        self.assertEqual([(row[1], row[-1]) for row in rows[1:]],
+                         [('PO0', 'True'), ('PO3', 'False'), ('PO4', 'True')])
+
+        response = self.client.get(url, {'include_archived': 'maybe'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_archived_purchase_orders_are_read_through(self):
+        archive_purchase_orders(older_than_days=365)
+        response = self.client.get(reverse('purchaseorder-by-number', args=['PO4']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['archived'], response.data['items'],
+                          response.data['quantity']),
+                         (True, {'sku': 'SKU-4', 'lines': [1, 2]}, 5))
+        response = self.client.get(reverse('purchaseorder-by-number', args=['PO3']))
+        self.assertEqual(response.data['archived'], False)
+        response = self.client.get(reverse('purchaseorder-by-number', args=['PO9']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        now = timezone.now().isoformat()
+        data = {'po_number': 'PO4', 'vendor': self.vendor.pk, 'order_date': now,
+                'delivery_date': now, 'issue_date': now, 'items': {}, 'quantity': 1,
+                'status': 'pending'}
+        response = self.client.post(reverse('purchaseorder-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('po_number', response.data)
+        response = self.client.post(reverse('purchaseorder-bulk'), [data], format='json')
+        self.assertEqual(response.data['rejected'][0]['po_number'], 'PO4')
+
+        # nor can a live purchase order be renamed to it
+        live = PurchaseOrder.objects.get(po_number='PO3')
+        url = reverse('purchaseorder-detail', args=[live.pk])
+        response = self.client.patch(url, {'po_number': 'PO4'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(url, {'po_number': 'PO3', 'quantity': 7}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SchedulerTestCase(TestCase):
+    def setUp(self):
+        Vendor.objects.create(name='Vendor', contact_details='Contact', address='Address',
+                              vendor_code='V1')
+        self.window = snapshot_window(timezone.now())
+
+    def test_one_process_holds_the_lease(self):
+        self.assertTrue(acquire_lease('a', 60))
+        self.assertTrue(acquire_lease('a', 60))
+        self.assertFalse(acquire_lease('b', 60))
+        self.assertTrue(acquire_lease('a', -1))
+        self.assertTrue(acquire_lease('b', 60))
+
+    def test_each_window_runs_once(self):
+        self.assertTrue(tick('a'))
+        self.assertTrue(tick('a'))
+        self.assertFalse(tick('b'))
+        run = JobRun.objects.get()
+        self.assertEqual((run.job, run.window, run.status, run.rows, run.attempts),
+                         (SNAPSHOT_JOB, self.window, 'succeeded', 1, 1))
+        self.assertEqual(Performance.objects.count(), 1)
+
+    def test_missed_windows_are_caught_up(self):
+        JobRun.objects.create(job=SNAPSHOT_JOB, window=self.window - timedelta(days=21),
+                              status='succeeded')
+        tick('a')
+        runs = list(JobRun.objects.order_by('window').values_list('status', flat=True))
+        self.assertEqual(runs, ['succeeded', 'skipped', 'skipped', 'succeeded'])
+        self.assertEqual(Performance.objects.count(), 1)
+
+    def test_catch_up_does_not_cover_the_next_window(self):
+        # the previous window is caught up on the Monday after it
+        with mock.patch('django.utils.timezone.now',
+                        return_value=self.window - timedelta(days=6)):
+            tick('a')
+        with mock.patch('django.utils.timezone.now',
+                        return_value=self.window + timedelta(hours=1)):
+            tick('a')
+        runs = list(JobRun.objects.order_by('window').values_list('window', 'rows'))
+        self.assertEqual(runs, [(self.window - timedelta(days=7), 1), (self.window, 1)])
+        self.assertEqual(Performance.objects.count(), 2)
+
+    def test_failed_run_is_retried(self):
+        with mock.patch('webapp.scheduling.take_performance_snapshot',
+                        side_effect=RuntimeError('disk full')), \
+                self.assertLogs('webapp.scheduling', 'ERROR'):
+            tick('a')
+        run = JobRun.objects.get()
+        self.assertEqual((run.status, run.error), ('failed', 'RuntimeError: disk full'))
+        tick('a')
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.attempts), ('succeeded', 2))
+
+
+class SQLiteProfileTestCase(TestCase):
+    def test_pragmas_are_applied_on_connect(self):
+        with self.settings(SQLITE_PRAGMAS={'cache_size': -1234}):
+            new_connection = connections.create_connection('default')
+            try:
+                with new_connection.cursor() as cursor:
+                    cursor.execute('PRAGMA cache_size')
+                    self.assertEqual(cursor.fetchone()[0], -1234)
+            finally:
+                new_connection.close()
+
+    def test_stress_command_reports_each_profile(self):
+        out = StringIO()
+        call_command('sqlite_stress', '--seconds', '0.2', '--writers', '2',
+                     '--readers', '1', stdout=out)
+        for profile in ('default', 'production'):
+            self.assertIn(profile, out.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'], REPLICA_STICKY_SECONDS=60)
+class ReplicaRoutingTestCase(TransactionTestCase):
+    # not TestCase: reads inside its transaction on the primary stay there
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+        self.routes = []
+
+    def view(self, request):
+        self.routes.append(self.router.db_for_read(Vendor))
+        return HttpResponse()
+
+    def call(self, method, token):
+        request = getattr(RequestFactory(), method)('/', HTTP_AUTHORIZATION=f'Token {token}')
+        return ReplicaRoutingMiddleware(self.view)(request)
+
+    def test_reads_go_to_replicas_until_the_client_writes(self):
+        self.call('get', 'a')
+        self.call('post', 'a')
+        self.call('get', 'a')
+        self.call('get', 'b')
+        self.assertEqual(self.routes, ['replica_0', 'default', 'default', 'replica_0'])
+        # outside a request and for writes, always the primary
+        self.assertEqual(self.router.db_for_read(Vendor), 'default')
+        self.assertEqual(self.router.db_for_write(Vendor), 'default')
+        self.assertFalse(self.router.allow_migrate('replica_0', 'webapp'))
+
+    def test_transactions_and_streamed_bodies(self):
+        def view(request):
+            with transaction.atomic():
+                self.routes.append(self.router.db_for_read(Vendor))
+
+            def body():
+                self.routes.append(self.router.db_for_read(Vendor))
+                yield b''
+            return StreamingHttpResponse(body())
+
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION='Token a')
+        response = ReplicaRoutingMiddleware(view)(request)
+        b''.join(response.streaming_content)
+        self.assertEqual(self.routes, ['default', 'replica_0'])
+
+    def test_token_and_metrics_cache_misses_read_the_primary(self):
+        # replica_0 has no connection here, a read routed to it would fail
+        token = Token.objects.get(user=User.objects.create_user('user', password='pass'))
+        vendor = Vendor.objects.create(name='Vendor', contact_details='Contact',
+                                       address='Address', vendor_code='V1')
+        token_cache.clear()
+
+        def view(request):
+            self.routes.append(self.router.db_for_read(Vendor))
+            user, _ = CachedTokenAuthentication().authenticate_credentials(token.key)
+            self.assertEqual(user.pk, token.user_id)
+            self.assertIsNotNone(get_vendor_metrics(vendor.pk))
+            return HttpResponse()
+
+        ReplicaRoutingMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(self.routes, ['replica_0'])
+
+        async def aview(request):
+            cache.clear()
+            return HttpResponse(str(await aget_vendor_metrics(vendor.pk) is not None))
+
+        response = async_to_sync(ReplicaRoutingMiddleware(aview))(RequestFactory().get('/'))
+        self.assertEqual(response.content, b'True')
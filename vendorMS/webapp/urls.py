@@ -1,7 +1,10 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from .views.vendor_views import VendorViewSet
 from .views.purchase_order_views import PurchaseOrderViewSet
 from .views.performance_views import vendor_performance
+from .views import async_views
+from .views.export_views import export_purchase_orders, export_performances
+from .views.stats_views import request_stats
 from rest_framework.routers import DefaultRouter
 from rest_framework.authtoken.views import obtain_auth_token
 
@@ -9,9 +12,29 @@ router = DefaultRouter()
 router.register(r'vendors', VendorViewSet)
 router.register(r'purchase_orders', PurchaseOrderViewSet)
 
+# Read-only async endpoints, see views/async_views.py
+async_urlpatterns = [
+    path('vendors/', async_views.vendor_list, name='async-vendor-list'),
+    path('vendors/<int:vendor_id>/', async_views.vendor_detail, name='async-vendor-detail'),
+    path('vendors/<int:vendor_id>/performance/', async_views.vendor_metrics,
+         name='async-vendor-metrics'),
+    path('vendors/<int:vendor_id>/performances', async_views.vendor_performance,
+         name='async-vendor-performance'),
+    path('purchase_orders/', async_views.purchase_order_list,
+         name='async-purchaseorder-list'),
+    path('purchase_orders/<int:po_id>/', async_views.purchase_order_detail,
+         name='async-purchaseorder-detail'),
+]
+
 urlpatterns = [
     path('', include(router.urls)),
     path('token/', obtain_auth_token, name='api_token_auth'),
     path('vendors/<int:vendor_id>/performances',
          vendor_performance, name='vendor_performance'),
+    path('async/', include(async_urlpatterns)),
+    re_path(r'^export/purchase_orders\.(?P<file_format>ndjson|csv)$',
+            export_purchase_orders, name='export-purchase-orders'),
+    re_path(r'^export/performances\.(?P<file_format>ndjson|csv)$',
+            export_performances, name='export-performances'),
+    path('stats/requests/', request_stats, name='request-stats'),
 ]
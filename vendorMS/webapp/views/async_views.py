@@ -0,0 +1,134 @@
+import functools
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET
+from rest_framework import exceptions
+from rest_framework.utils.urls import replace_query_param
+
+from ..authentication import aauthenticate
+from ..cache import aget_vendor_metrics
+from ..filters import purchase_order_filters
+from ..models import Vendor, PurchaseOrder
+from ..pagination import PrimaryKeyCursorPagination
+from ..serializers import PerformanceSerializer, VendorSerializer, PurchaseOrderSerializer
+from .mixins import project, requested_fields
+from .performance_views import bucket_row, history_params, performance_buckets, vendor_history
+from .purchase_order_views import PurchaseOrderViewSet
+
+# Read-only async variants of the vendor and purchase order endpoints, for
+# clients polling with many concurrent connections. Served under /api/async/
+# and meant to run on the ASGI application, where they use the async ORM
+# instead of holding a worker thread per request. Under ASGI they are
+# called by webapp.async_api.AsyncAPIMiddleware, which skips Django's
+# thread switching middleware; under WSGI they go through the whole stack.
+
+
+def _error(detail, status, **kwargs):
+    return JsonResponse(detail if isinstance(detail, dict) else {'detail': detail},
+                        status=status, **kwargs)
+
+
+def async_api_view(view):
+    """
+    Decorator for GET-only async views which require a valid token and
+    turn DRF API exceptions into JSON error responses"""
+    @require_GET
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            credentials = await aauthenticate(request)
+            if credentials is None:
+                raise exceptions.NotAuthenticated()
+            request.user, request.auth = credentials
+            return await view(request, *args, **kwargs)
+        except (exceptions.AuthenticationFailed, exceptions.NotAuthenticated) as exc:
+            return _error(exc.detail, 401, headers={'WWW-Authenticate': 'Token'})
+        except exceptions.APIException as exc:
+            return _error(exc.detail, exc.status_code)
+    return wrapper
+
+
+async def _list(request, queryset, serializer_class, excluded=()):
+    # Keyset page on the primary key: ?after=<id>&page_size=<n>
+    try:
+        after = int(request.GET.get('after', 0))
+        page_size = int(request.GET.get('page_size', settings.REST_FRAMEWORK['PAGE_SIZE']))
+    except ValueError:
+        raise exceptions.ValidationError({'detail': ["after and page_size must be integers."]})
+    page_size = max(1, min(page_size, PrimaryKeyCursorPagination.max_page_size))
+
+    fields = requested_fields(request.GET.get('fields'), serializer_class, excluded)
+    if fields:
+        queryset = project(queryset, fields)
+    rows = [row async for row in queryset.filter(pk__gt=after).order_by('pk')[:page_size + 1]]
+    next_url = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_url = replace_query_param(request.build_absolute_uri(), 'after', rows[-1].pk)
+    return JsonResponse({'next': next_url,
+                         'results': serializer_class(rows, many=True, fields=fields).data})
+
+
+async def _detail(request, queryset, serializer_class, pk):
+    fields = requested_fields(request.GET.get('fields'), serializer_class)
+    # deferred fields cannot be loaded lazily in an async context
+    queryset = project(queryset, fields) if fields else queryset.defer(None)
+    try:
+        instance = await queryset.aget(pk=pk)
+    except queryset.model.DoesNotExist:
+        raise exceptions.NotFound()
+    return JsonResponse(serializer_class(instance, fields=fields).data)
+
+
+@async_api_view
+async def vendor_list(request):
+    return await _list(request, Vendor.objects.all(), VendorSerializer)
+
+
+@async_api_view
+async def vendor_detail(request, vendor_id):
+    return await _detail(request, Vendor.objects.all(), VendorSerializer, vendor_id)
+
+
+@async_api_view
+async def vendor_metrics(request, vendor_id):
+    # Current metrics with the same cache and ETag handling as
+    # VendorViewSet.performance
+    entry = await aget_vendor_metrics(vendor_id)
+    if entry is None:
+        raise exceptions.NotFound()
+    response = JsonResponse(entry['metrics'])
+    response['ETag'] = quote_etag(entry['etag'])
+    return get_conditional_response(
+        request, etag=response['ETag'], response=response)
+
+
+@async_api_view
+async def vendor_performance(request, vendor_id):
+    # Performance history with the ?from, ?to and ?bucket parameters of
+    # the sync vendor_performance view
+    params = history_params(request.GET)
+    if not await Vendor.objects.filter(pk=vendor_id).aexists():
+        raise exceptions.NotFound()
+    performances = vendor_history(vendor_id, params)
+    if 'bucket' in params:
+        rows = [bucket_row(row)
+                async for row in performance_buckets(performances, params['bucket'])]
+        return JsonResponse(rows, safe=False)
+    rows = [performance async for performance in performances]
+    return JsonResponse(PerformanceSerializer(rows, many=True).data, safe=False)
+
+
+@async_api_view
+async def purchase_order_list(request):
+    queryset = PurchaseOrder.objects.filter(**purchase_order_filters(request.GET))
+    return await _list(request, queryset, PurchaseOrderSerializer,
+                       PurchaseOrderViewSet.list_excluded_fields)
+
+
+@async_api_view
+async def purchase_order_detail(request, po_id):
+    return await _detail(request, PurchaseOrder.objects.all(), PurchaseOrderSerializer, po_id)
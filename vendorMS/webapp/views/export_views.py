@@ -0,0 +1,165 @@
+import csv
+import datetime
+import heapq
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
+
+from ..authentication import CachedTokenAuthentication
+from ..filters import (PerformanceExportFilterSerializer, PurchaseOrderExportFilterSerializer,
+                       purchase_order_filters)
+from ..models import ArchivedPurchaseOrder, PurchaseOrder, Performance
+
+# Streaming exports of the full purchase order and performance history.
+# Rows are read with values_list().iterator() in id order and written out
+# EXPORT_CHUNK_SIZE rows at a time, so memory use does not grow with the
+# number of rows. The first line is sent as soon as it is available.
+#
+# With include_archived=1 the purchase order export also reads the
+# ArchivedPurchaseOrder table, the way archive.fetch_purchase_order reads
+# through. Archived purchase orders keep their id, so the live and archived
+# rows are merged in id order, each with an 'archived' column.
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# (column name, model field) pairs, named like the serializer fields
+PURCHASE_ORDER_COLUMNS = (
+    ('id', 'id'), ('po_number', 'po_number'), ('vendor', 'vendor_id'),
+    ('order_date', 'order_date'), ('delivery_date', 'delivery_date'),
+    ('items', 'items'), ('quantity', 'quantity'), ('status', 'status'),
+    ('quality_rating', 'quality_rating'), ('issue_date', 'issue_date'),
+    ('acknowledgment_date', 'acknowledgment_date'),
+    ('delivered_on_time', 'delivered_on_time'),
+)
+
+PERFORMANCE_COLUMNS = (
+    ('id', 'id'), ('vendor', 'vendor_id'), ('date', 'date'),
+    ('on_time_delivery_rate', 'on_time_delivery_rate'),
+    ('quality_rating_avg', 'quality_rating_avg'),
+    ('average_response_time', 'average_response_time'),
+    ('fulfillment_rate', 'fulfillment_rate'),
+)
+
+
+def _formatter(tz):
+    # Datetimes in the current time zone, like the serializers output them.
+    # The zone is looked up once, timezone.localtime() would do it per value.
+    def format_value(value):
+        if isinstance(value, datetime.datetime):
+            return value.astimezone(tz).isoformat()
+        return value
+    return format_value
+
+
+class _Lines:
+    # File-like target for csv.writer which hands back each written line
+    def write(self, line):
+        return line
+
+
+def _ndjson(names, rows):
+    format_value = _formatter(timezone.get_current_timezone())
+    for row in rows:
+        yield json.dumps(dict(zip(names, map(format_value, row))),
+                         separators=(',', ':')) + '\n'
+
+
+def _csv(names, rows):
+    format_value = _formatter(timezone.get_current_timezone())
+    writer = csv.writer(_Lines())
+    yield writer.writerow(names)
+    for row in rows:
+        yield writer.writerow([json.dumps(value) if isinstance(value, (dict, list))
+                               else format_value(value) for value in row])
+
+
+def _chunks(lines, chunk_size):
+    # Send the first line (the CSV header or first row) on its own, then
+    # join the rest into chunks of chunk_size lines
+    lines = iter(lines)
+    for line in lines:
+        yield line
+        break
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _rows(queryset, columns):
+    # The queryset rows in id order, as tuples of the column values
+    return (queryset.order_by('id').values_list(*[field for _, field in columns])
+            .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE))
+
+
+def _flagged(rows, archived):
+    return (row + (archived,) for row in rows)
+
+
+def stream_rows(queryset, columns, file_format, filename):
+    """
+    Return a StreamingHttpResponse with the queryset rows in NDJSON or CSV"""
+    return stream_lines([name for name, _ in columns], _rows(queryset, columns),
+                        file_format, filename)
+
+
+def stream_lines(names, rows, file_format, filename):
+    """
+    Return a StreamingHttpResponse with rows, tuples of the values of the
+    names columns, in NDJSON or CSV"""
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    lines = _csv(names, rows) if file_format == 'csv' else _ndjson(names, rows)
+    response = StreamingHttpResponse(_chunks(lines, chunk_size),
+                                     content_type=CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{file_format}"'
+    return response
+
+
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def export_purchase_orders(request, file_format):
+    # Same filters as the purchase order list endpoint
+    filters = purchase_order_filters(request.query_params)
+    params = PurchaseOrderExportFilterSerializer(data=request.query_params.dict())
+    if not params.is_valid():
+        raise ValidationError(params.errors)
+    queryset = PurchaseOrder.objects.filter(**filters)
+    if not params.validated_data['include_archived']:
+        return stream_rows(queryset, PURCHASE_ORDER_COLUMNS, file_format, 'purchase_orders')
+
+    archived = ArchivedPurchaseOrder.objects.filter(**filters)
+    rows = heapq.merge(_flagged(_rows(queryset, PURCHASE_ORDER_COLUMNS), False),
+                       _flagged(_rows(archived, PURCHASE_ORDER_COLUMNS), True),
+                       key=lambda row: row[0])
+    names = [name for name, _ in PURCHASE_ORDER_COLUMNS] + ['archived']
+    return stream_lines(names, rows, file_format, 'purchase_orders')
+
+
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def export_performances(request, file_format):
+    params = PerformanceExportFilterSerializer(data=request.query_params.dict())
+    if not params.is_valid():
+        raise ValidationError(params.errors)
+    queryset = Performance.objects.all()
+    if 'vendor' in params.validated_data:
+        queryset = queryset.filter(vendor_id=params.validated_data['vendor'])
+    if 'from' in params.validated_data:
+        queryset = queryset.filter(date__gte=params.validated_data['from'])
+    if 'to' in params.validated_data:
+        queryset = queryset.filter(date__lt=params.validated_data['to'])
+    return stream_rows(queryset, PERFORMANCE_COLUMNS, file_format, 'performances')
@@ -0,0 +1,55 @@
+from rest_framework.exceptions import ValidationError
+
+
+def requested_fields(value, serializer_class, excluded=()):
+    """
+    Parse a ?fields=a,b value into a list of field names of serializer_class,
+    or None when no fields were requested. Without ?fields, excluded names
+    are left out of the list of all fields instead."""
+    if not value:
+        if not excluded:
+            return None
+        return [name for name in serializer_class().fields if name not in excluded]
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = set(fields) - set(serializer_class().fields)
+    if unknown:
+        raise ValidationError(
+            {'fields': [f"Unknown fields: {', '.join(sorted(unknown))}."]})
+    return fields
+
+
+def project(queryset, fields):
+    """
+    Select only the id and the columns of fields. Fields the model manager
+    defers are loaded too when requested: only() keeps deferring them"""
+    return queryset.defer(None).only('id', *fields)
+
+
+class FieldProjectionMixin:
+    """
+    Viewset mixin which lets clients pick the serialized fields with
+    ?fields=a,b on list and retrieve. Only the requested columns are
+    selected from the database. Fields in list_excluded_fields are left out
+    of list responses unless they are requested."""
+    projected_actions = ('list', 'retrieve')
+    list_excluded_fields = ()
+
+    def get_requested_fields(self):
+        if self.action not in self.projected_actions:
+            return None
+        return requested_fields(
+            self.request.query_params.get('fields'), self.get_serializer_class(),
+            excluded=self.list_excluded_fields if self.action == 'list' else ())
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        if fields:
+            queryset = project(queryset, fields)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
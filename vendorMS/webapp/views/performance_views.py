@@ -1,22 +1,86 @@
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from ..models import Vendor, Performance
+from django.db.models import Avg, Count, Max, Min
+from django.db.models.functions import TruncMonth, TruncQuarter, TruncYear
+from ..authentication import CachedTokenAuthentication
+from ..filters import PerformanceHistoryFilterSerializer
+from ..models import METRIC_FIELDS, Vendor, Performance
 from ..serializers import PerformanceSerializer
 from django.shortcuts import get_object_or_404
 
+BUCKETS = {
+    'month': TruncMonth,
+    'quarter': TruncQuarter,
+    'year': TruncYear,
+}
+
+
+def performance_buckets(performances, bucket):
+    """
+    Group performances into month/quarter/year buckets with the average,
+    minimum and maximum of each metric, computed in a single SQL query.
+    Rows are turned into the response format by bucket_row."""
+    aggregates = {}
+    for field in METRIC_FIELDS:
+        aggregates[f'{field}__avg'] = Avg(field)
+        aggregates[f'{field}__min'] = Min(field)
+        aggregates[f'{field}__max'] = Max(field)
+    return (performances.annotate(period=BUCKETS[bucket]('date'))
+            .values('period').annotate(samples=Count('id'), **aggregates)
+            .order_by('period'))
+
+
+def bucket_row(row):
+    return {
+        'period': row['period'],
+        'samples': row['samples'],
+        **{field: {stat: row[f'{field}__{stat}'] for stat in ('avg', 'min', 'max')}
+           for field in METRIC_FIELDS},
+    }
+
+
+def aggregate_performances(performances, bucket):
+    return [bucket_row(row) for row in performance_buckets(performances, bucket)]
+
+
+def history_params(query_params):
+    """
+    Validate the ?from, ?to and ?bucket parameters of a history request"""
+    params = PerformanceHistoryFilterSerializer(data=query_params.dict())
+    if not params.is_valid():
+        raise ValidationError(params.errors)
+    return params.validated_data
+
+
+def vendor_history(vendor_id, params):
+    """
+    Return the Performance rows of a vendor within the validated date range,
+    oldest first"""
+    performances = Performance.objects.filter(vendor_id=vendor_id).order_by('date')
+    if 'from' in params:
+        performances = performances.filter(date__gte=params['from'])
+    if 'to' in params:
+        performances = performances.filter(date__lt=params['to'])
+    return performances
+
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def vendor_performance(request, vendor_id):
+    params = history_params(request.query_params)
+
     # Retrieve the Vendor instance
     vendor = get_object_or_404(Vendor, id=vendor_id)
 
-    # Retrieve all Performance instances associated with this Vendor
-    performances = Performance.objects.filter(vendor=vendor)
+    # Retrieve the Performance instances of this Vendor within the date range
+    performances = vendor_history(vendor.pk, params)
+
+    if 'bucket' in params:
+        return Response(aggregate_performances(performances, params['bucket']))
 
     # Serialize the performances
     performance_serializer = PerformanceSerializer(performances, many=True)
@@ -1,22 +1,139 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.filters import OrderingFilter
 
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404, StreamingHttpResponse
+from django.db.models import BinaryField, Case, ExpressionWrapper, F, Q, Value, When
 from django.utils import timezone
+from .. import metrics
+from ..archive import fetch_purchase_order
+from ..authentication import CachedTokenAuthentication
+from ..fields import iter_json
+from ..filters import PurchaseOrderFilterBackend
 from ..models import PurchaseOrder
-from ..serializers import PurchaseOrderSerializer
+from ..serializers import PurchaseOrderSerializer, PurchaseOrderSelectionSerializer
+from .mixins import FieldProjectionMixin
 
 
-class PurchaseOrderViewSet(viewsets.ModelViewSet):
+class PurchaseOrderViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     queryset = PurchaseOrder.objects.all()
     serializer_class = PurchaseOrderSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [PurchaseOrderFilterBackend, OrderingFilter]
+    # Non-null columns only: the cursor position cannot step over NULLs
+    ordering_fields = ['id', 'po_number', 'order_date', 'issue_date',
+                       'delivery_date', 'quantity']
+    ordering = ['id']
+    # items is the largest column: lists leave it out unless it is requested
+    # with ?fields, and it is loaded only by the actions which return it
+    list_excluded_fields = ('items',)
+    item_actions = ('retrieve', 'update', 'partial_update')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.item_actions and not self.get_requested_fields():
+            queryset = queryset.defer(None)
+        return queryset
 
     @action(detail=True, methods=['post'])
     def acknowledge(self, request, pk=None):
+        # items is not loaded, so save() writes the loaded fields only
         po = self.get_object()
         po.acknowledgment_date = timezone.now()
         po.save()
         return Response({'status': 'PO acknowledged'}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def items(self, request, pk=None):
+        # The stored items payload, decompressed while it is sent instead
+        # of being decoded and serialized again
+        payload = ExpressionWrapper(F('items'), output_field=BinaryField())
+        blob = get_object_or_404(PurchaseOrder.objects.values_list(payload, flat=True), pk=pk)
+        return StreamingHttpResponse(iter_json(blob), content_type='application/json')
+
+    @action(detail=False, methods=['get'], url_path=r'by_number/(?P<po_number>[^/]+)',
+            url_name='by-number')
+    def by_number(self, request, po_number=None):
+        # Live or archived purchase order by po_number
+        purchase_order, archived = fetch_purchase_order(po_number)
+        if purchase_order is None:
+            raise Http404
+        return Response(dict(self.get_serializer(purchase_order).data, archived=archived))
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        # Create or update a list of purchase orders keyed on po_number
+        try:
+            chunk_size = int(request.query_params.get(
+                'chunk_size', settings.BULK_WRITE_CHUNK_SIZE))
+        except ValueError:
+            raise ValidationError({'chunk_size': ["A valid integer is required."]})
+        if chunk_size < 1:
+            raise ValidationError({'chunk_size': ["Must be at least 1."]})
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        with transaction.atomic():
+            valid, rejected = serializer.validate_rows()
+            created, updated = serializer.upsert(valid, chunk_size)
+        return Response({'created': created, 'updated': updated, 'rejected': rejected},
+                        status=status.HTTP_200_OK)
+
+    def _selected(self, request):
+        serializer = PurchaseOrderSelectionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.get_queryset()
+
+    def _transition(self, request, pending, stamp, values):
+        # Change the selected purchase orders matching pending with a single
+        # UPDATE which checks pending again, setting the stamp field to now.
+        # A concurrent request may have changed some of them since they were
+        # read: the metrics only get the changes of the rows updated here,
+        # told apart by their stamp. Returns [(before, now)] of those rows.
+        now = timezone.now()
+        before = {state['pk']: state for state in
+                  self._selected(request).filter(pending).select_for_update()
+                  .values('pk', *metrics.SNAPSHOT_FIELDS)}
+        updated = PurchaseOrder.objects.filter(pending, pk__in=before).update(
+            **{stamp: now}, **values(now))
+        if updated != len(before):
+            changed = set(PurchaseOrder.objects.filter(pk__in=before, **{stamp: now})
+                          .values_list('pk', flat=True))
+            before = {pk: state for pk, state in before.items() if pk in changed}
+        return list(before.values()), now
+
+    @action(detail=False, methods=['post'], url_path='acknowledge',
+            url_name='bulk-acknowledge')
+    def bulk_acknowledge(self, request):
+        # Acknowledge many purchase orders with a single UPDATE
+        with transaction.atomic():
+            before, now = self._transition(
+                request, Q(acknowledgment_date__isnull=True), 'acknowledgment_date',
+                lambda now: {})
+            metrics.apply_changes((state, dict(state, acknowledgment_date=now))
+                                  for state in before)
+        return Response({'status': 'POs acknowledged',
+                         'purchase_orders': [state['pk'] for state in before]},
+                        status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='complete',
+            url_name='bulk-complete')
+    def bulk_complete(self, request):
+        # Complete many pending purchase orders with a single UPDATE
+        with transaction.atomic():
+            before, now = self._transition(
+                request, Q(status='pending'), 'delivery_date',
+                lambda now: {'status': 'completed',
+                             'delivered_on_time': Case(
+                                 When(delivery_date__gte=now, then=Value(True)),
+                                 default=Value(False))})
+            metrics.apply_changes((state, metrics.completed_state(state, now))
+                                  for state in before)
+        return Response({'status': 'POs completed',
+                         'purchase_orders': [state['pk'] for state in before]},
+                        status=status.HTTP_200_OK)
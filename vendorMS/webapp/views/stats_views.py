@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+
+from ..authentication import CachedTokenAuthentication
+from .. import monitoring
+from ..profiling import profiling_stats, reset_profiling_stats
+
+
+class IsAdminUserOrReadOnly(IsAdminUser):
+    """
+    Lets any user read, but only staff users change"""
+
+    def has_permission(self, request, view):
+        return request.method in SAFE_METHODS or super().has_permission(request, view)
+
+
+@api_view(['GET', 'DELETE'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUserOrReadOnly])
+def request_stats(request):
+    # Per endpoint statistics of the profiling middleware in this process;
+    # DELETE starts a new measurement window
+    if request.method == 'DELETE':
+        reset_profiling_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response({'enabled': settings.PROFILING_ENABLED,
+                     'endpoints': profiling_stats()})
+
+
+@require_GET
+def prometheus_metrics(request):
+    # Text exposition format for Prometheus scrapers, which send the bearer
+    # token of settings.PROMETHEUS_BEARER_TOKEN instead of an API token or
+    # connect from one of settings.PROMETHEUS_ALLOWED_IPS
+    token = settings.PROMETHEUS_BEARER_TOKEN
+    authorized = (constant_time_compare(request.headers.get('Authorization', ''),
+                                        f'Bearer {token}') if token else False)
+    if not authorized and request.META.get('REMOTE_ADDR') not in settings.PROMETHEUS_ALLOWED_IPS:
+        return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return HttpResponse(monitoring.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,26 +1,96 @@
 from rest_framework import viewsets, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
-from rest_framework.authentication import TokenAuthentication
 
-from ..models import Vendor
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from ..authentication import CachedTokenAuthentication
+from ..cache import get_vendor_metrics
+from ..filters import VendorRankingFilterSerializer
+from ..models import Vendor, VendorRank
+from ..ranking import RANKED_METRICS, percentile, ranked_counts
+from ..scorecards import build_scorecards, scorecard_vendors
 from ..serializers import VendorSerializer
-from django.shortcuts import get_object_or_404
+from .mixins import FieldProjectionMixin
 
 
-class VendorViewSet(viewsets.ModelViewSet):
+class VendorViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     queryset = Vendor.objects.all()
     serializer_class = VendorSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     @action(detail=True, methods=['get'])
     def performance(self, request, pk=None):
-        vendor = get_object_or_404(Vendor, pk=pk)
-        performance_data = Vendor.objects.filter(pk=pk).values(
-            'on_time_delivery_rate', 
-            'quality_rating_avg', 
-            'average_response_time', 
-            'fulfillment_rate'
-        )
-        return Response(performance_data[0])
\ No newline at end of file
+        # Served from the vendor metrics cache, 304 if the client's copy is current
+        entry = get_vendor_metrics(pk) if pk.isdigit() else None
+        if entry is None:
+            raise Http404
+        response = Response(entry['metrics'])
+        response['ETag'] = quote_etag(entry['etag'])
+        return get_conditional_response(
+            request, etag=response['ETag'], response=response)
+
+    @action(detail=False, methods=['get'])
+    def ranking(self, request):
+        # Top vendors by a metric, read best first from the metric's index
+        params = VendorRankingFilterSerializer(data=request.query_params.dict())
+        if not params.is_valid():
+            raise ValidationError(params.errors)
+        data = params.validated_data
+        metric = data['metric']
+        counter, lower_is_better = RANKED_METRICS[metric]
+
+        vendors = Vendor.objects.filter(**{f'{counter}__gt': 0})
+        if 'min_completed_pos' in data:
+            vendors = vendors.filter(completed_po_count__gte=data['min_completed_pos'])
+        if 'min_value' in data:
+            vendors = vendors.filter(**{f'{metric}__gte': data['min_value']})
+        if 'max_value' in data:
+            vendors = vendors.filter(**{f'{metric}__lte': data['max_value']})
+        order = metric if lower_is_better else f'-{metric}'
+        rows = list(vendors.order_by(order, 'pk')
+                    .values('id', 'name', 'vendor_code', metric, 'completed_po_count')
+                    [:data['limit']])
+
+        ranks = dict(VendorRank.objects.filter(
+            metric=metric, vendor_id__in=[row['id'] for row in rows])
+            .values_list('vendor_id', 'rank'))
+        count = ranked_counts()[metric]
+        return Response({'metric': metric, 'ranked_vendors': count, 'results': [{
+            'id': row['id'],
+            'name': row['name'],
+            'vendor_code': row['vendor_code'],
+            'value': row[metric],
+            'completed_po_count': row['completed_po_count'],
+            'rank': ranks.get(row['id']),
+            'percentile': percentile(ranks[row['id']], count) if row['id'] in ranks else None,
+        } for row in rows]})
+
+    @action(detail=True, methods=['get'])
+    def rank(self, request, pk=None):
+        # Rank and percentile of one vendor by every metric it is ranked by
+        vendor = self.get_object()
+        ranks = {metric: rank for metric, rank in
+                 VendorRank.objects.filter(vendor=vendor).values_list('metric', 'rank')}
+        counts = ranked_counts()
+        return Response({metric: {
+            'value': getattr(vendor, metric),
+            'rank': ranks.get(metric),
+            'percentile': percentile(ranks[metric], counts[metric]) if metric in ranks else None,
+            'out_of': counts[metric],
+        } for metric in RANKED_METRICS})
+
+    @action(detail=False, methods=['get'])
+    def scorecards(self, request):
+        # One page of scorecards in a constant number of queries
+        vendors = self.paginate_queryset(scorecard_vendors())
+        return self.get_paginated_response(build_scorecards(vendors))
+
+    @action(detail=True, methods=['get'])
+    def scorecard(self, request, pk=None):
+        vendor = get_object_or_404(scorecard_vendors(), pk=pk)
+        return Response(build_scorecards([vendor])[0])